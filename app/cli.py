@@ -0,0 +1,147 @@
+"""Командная строка без графического интерфейса: индексация и поиск, в т.ч. пакетный (JSONL).
+
+Примеры:
+    python -m app.cli index text /path/to/docs --extensions .txt .pdf
+    python -m app.cli search image "кошка на диване" --top-k 10
+    python -m app.cli search all --queries queries.jsonl --output results.jsonl
+    python -m app.cli --metrics metrics.prom --profile index.collapsed index image /path/to/photos
+"""
+import os
+import sys
+import json
+import argparse
+import contextlib
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+from app.factory import create_processor, INDEX_MODELS, SEARCH_MODELS, MODALITIES
+from core import metrics
+from core.journal import JournaledIndex
+
+def load_model_manager(config, models):
+    """ModelManager с предзагрузкой только нужных моделей."""
+    from core.models import ModelManager
+    return ModelManager(config, models=models)
+
+def run_index(args, config):
+    """Индексация директории для одного типа данных; код возврата 1, если часть файлов не удалась."""
+    model_manager = load_model_manager(config, INDEX_MODELS[args.modality])
+    processor = create_processor(args.modality, config, model_manager)
+    journal = JournaledIndex(processor, args.directory, args.extensions,
+                             max_attempts=config.INDEX_MAX_ATTEMPTS, backoff=config.INDEX_RETRY_BACKOFF)
+    try:
+        done, failed = journal.run(args.chunk_size, progress=lambda done, failed, total: print(
+            f"Обработано файлов: {done}/{total}, не удалось: {failed}", file=sys.stderr))
+    finally:
+        # Процессор может держать пул процессов на все пачки запуска (извлечение текста)
+        if hasattr(processor, "close"):
+            processor.close()
+    for path in failed:
+        print(f"Не проиндексирован: {path}", file=sys.stderr)
+    return 1 if failed else 0
+
+def read_queries(args):
+    """Запросы из аргумента или JSONL-файла ("-" — stdin): строки вида {"query": ..., "top_k": ..., "id": ...}."""
+    if args.query is not None:
+        yield {"query": args.query}
+        return
+    stream = sys.stdin if args.queries == "-" else open(args.queries, "r", encoding="utf-8")
+    try:
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            yield item if isinstance(item, dict) else {"query": str(item)}
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def format_result(modality, result):
+    """Результат поиска в виде словаря для JSON."""
+    if modality == "all":
+        modality, path, desc, score, extra, sim = result
+        return {"modality": modality, "path": path, "description": desc, "score": float(score),
+                "similarity": float(sim), "extra": extra}
+    path, desc, sim, extra = result
+    return {"modality": modality, "path": path, "description": desc, "score": float(sim), "extra": extra}
+
+def run_search(args, config):
+    """Поиск по одному типу данных или по всем сразу; результаты — по строке JSON на запрос."""
+    # Сообщения процессоров уходят в stderr, чтобы не смешиваться с JSONL в stdout
+    output = sys.stdout if args.output is None else open(args.output, "w", encoding="utf-8")
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            _search_queries(args, config, output)
+        finally:
+            # Внутри redirect_stdout sys.stdout — это stderr, поэтому проверяется сам аргумент
+            if args.output is not None:
+                output.close()
+
+def _search_queries(args, config, output):
+    model_manager = load_model_manager(config, SEARCH_MODELS)
+    if args.modality == "all":
+        from core.search import SearchCoordinator
+        searcher = SearchCoordinator(
+            model_manager,
+            {modality: create_processor(modality, config, model_manager) for modality in MODALITIES},
+            sample_size=config.SEARCH_CALIBRATION_SAMPLE
+        )
+    else:
+        searcher = create_processor(args.modality, config, model_manager)
+
+    for item in read_queries(args):
+        results = searcher.search(item["query"], int(item.get("top_k", args.top_k)))
+        record = {key: value for key, value in item.items() if key != "top_k"}
+        record["results"] = [format_result(args.modality, result) for result in results]
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Семантический поиск без графического интерфейса")
+    parser.add_argument("--metrics", default=Config.METRICS_FILE,
+                        help="Файл метрик по стадиям: .json или текстовый формат Prometheus")
+    parser.add_argument("--profile", default=None,
+                        help="Профиль запуска: .prof — cProfile, иначе выборка стеков всех потоков (collapsed)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index = commands.add_parser("index", help="Индексация директории")
+    index.add_argument("modality", choices=MODALITIES)
+    index.add_argument("directory")
+    index.add_argument("--extensions", nargs="+", default=None, help="Расширения файлов, например .txt .pdf")
+    index.add_argument("--chunk-size", type=int, default=Config.INDEX_CHUNK_SIZE)
+
+    search = commands.add_parser("search", help="Поиск по запросу или по файлу запросов")
+    search.add_argument("modality", choices=MODALITIES + ("all",))
+    search.add_argument("query", nargs="?", default=None)
+    search.add_argument("--queries", default=None, help="JSONL-файл запросов (\"-\" — stdin)")
+    search.add_argument("--output", default=None, help="JSONL-файл результатов (по умолчанию stdout)")
+    search.add_argument("--top-k", type=int, default=5)
+
+    args = parser.parse_args(argv)
+    if args.command == "search" and (args.query is None) == (args.queries is None):
+        parser.error("укажите либо запрос, либо --queries")
+
+    config = Config()
+    with metrics.profile(args.profile) if args.profile else contextlib.nullcontext():
+        try:
+            if args.command == "index":
+                return run_index(args, config)
+            run_search(args, config)
+            return 0
+        finally:
+            report_metrics(args)
+
+def report_metrics(args):
+    """Сводка по стадиям в stderr и, если задан --metrics, запись файла метрик."""
+    summary = metrics.REGISTRY.format_summary()
+    if summary:
+        print("Время по стадиям:", file=sys.stderr)
+        for line in summary:
+            print(f"  {line}", file=sys.stderr)
+    if args.metrics:
+        metrics.REGISTRY.write(args.metrics)
+
+if __name__ == "__main__":
+    sys.exit(main())
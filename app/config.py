@@ -25,4 +25,71 @@ class Config:
         "whisper": "base"
     }
     
+    # Размер пачки записей, сбрасываемой в базу одной транзакцией
+    DB_FLUSH_SIZE = 500
+    
+    # Бюджет памяти на батч модели подписей изображений (определяет размер батча)
+    CAPTION_MEMORY_MB = 1024
+    # Потоки декодирования изображений и длина очереди между декодером и моделью
+    IMAGE_DECODE_WORKERS = 4
+    IMAGE_QUEUE_SIZE = 64
+    # Выборка кадров видео: интервал в секундах или порог смены сцены (None — по интервалу)
+    VIDEO_FRAME_INTERVAL = 1.0
+    VIDEO_SCENE_THRESHOLD = None
+    VIDEO_THUMBNAILS_DIR = os.path.join(DATA_DIR, "thumbnails")
+    # Порог расстояния dHash для повторяющихся подряд кадров (None — без дедупликации)
+    VIDEO_DEDUP_DISTANCE = 6
+    # Поиск видео: во сколько раз больше top_k видео отбирается по сводкам (центроидам кадров)
+    # и насколько оценка кадра может уступать лучшему кадру видео, чтобы войти во фрагмент
+    VIDEO_SEARCH_SHORTLIST = 4
+    VIDEO_SEGMENT_MARGIN = 0.05
+    # Окна транскрипции музыки (начало, длительность в секундах); None — трек целиком.
+    # Ведущая тишина окна до MUSIC_MAX_SILENCE секунд отрезается по порогу громкости.
+    MUSIC_TRANSCRIBE_WINDOWS = [(0, 60)]
+    MUSIC_MAX_SILENCE = 30
+    MUSIC_VAD_THRESHOLD_DB = -40.0
+    # Процессы извлечения текста из PDF/DOCX/ODT (0 — в основном процессе)
+    TEXT_EXTRACT_WORKERS = 2
+    # Перевод запросов к изображениям: бэкенд ("google", "marian" — локально, "identity" — без перевода),
+    # таймаут в секундах, после которого используется исходный запрос, и файл кэша переводов
+    TRANSLATION_BACKEND = "google"
+    TRANSLATION_TIMEOUT = 2.0
+    TRANSLATION_CACHE = os.path.join(DATA_DIR, "translations.db")
+    # Единый поиск: число результатов и размер выборки записей для калибровки оценок баз
+    UNIFIED_TOP_K = 20
+    SEARCH_CALIBRATION_SAMPLE = 256
+    # Сколько файлов передаётся процессору за один шаг индексации в интерфейсе
+    INDEX_CHUNK_SIZE = 32
+    # Планировщик индексации: потоки обхода и чтения файлов, процессы извлечения и декодирования,
+    # сколько пачек готовится заранее и приоритеты модальностей (меньше — раньше)
+    INDEX_IO_WORKERS = 2
+    INDEX_PROCESS_WORKERS = 2
+    INDEX_PREFETCH_CHUNKS = 1
+    INDEX_PRIORITIES = {"text": 0, "music": 1, "image": 2, "video": 3}
+    # Попыток на файл за запуск индексации и задержка перед первым повтором (далее удваивается), секунды
+    INDEX_MAX_ATTEMPTS = 3
+    INDEX_RETRY_BACKOFF = 5.0
+    # Файл метрик по стадиям (.json или формат Prometheus); None — не записывать
+    METRICS_FILE = None
+    
+    # Приближённый поиск (IVF) по модальностям; None — точный перебор.
+    # nprobe — число просматриваемых списков (выше — точнее и медленнее),
+    # min_rows — с какого размера базы индекс строится автоматически.
+    # Подбор nprobe: python -m core.ann <путь к базе> --output report.json
+    ANN_SETTINGS = {
+        "text": {"nprobe": 16, "min_rows": 50000},
+        "image": None,
+        "video": None,
+        "music": None
+    }
+    # Квантованная копия векторов для первого прохода поиска по модальностям; None — только float32.
+    # dtype — "float16" (половина памяти) или "int8" (четверть), rerank — во сколько раз больше top_k
+    # кандидатов пересчитывается по float32. Подбор: python -m core.quantization <путь к базе> --output report.json
+    QUANTIZATION_SETTINGS = {
+        "text": None,
+        "image": None,
+        "video": None,
+        "music": None
+    }
+    
     os.makedirs(DATA_DIR, exist_ok=True)
\ No newline at end of file
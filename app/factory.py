@@ -0,0 +1,51 @@
+"""Создание процессоров по настройкам Config (общее для интерфейса и командной строки)."""
+
+# Модели, нужные для индексации каждого типа данных; для поиска достаточно текстовой модели
+INDEX_MODELS = {
+    "text": ("text",),
+    "image": ("text", "image"),
+    "video": ("text", "image"),
+    "music": ("text", "whisper"),
+}
+SEARCH_MODELS = ("text",)
+
+MODALITIES = ("text", "image", "video", "music")
+
+def create_processor(modality, config, model_manager):
+    """Процессор указанного типа данных; модули процессоров импортируются только при необходимости."""
+    if modality == "text":
+        from processors.text_processor import TextProcessor
+        return TextProcessor(
+            model_manager, config.INDEX_FILE, ann=config.ANN_SETTINGS["text"],
+            quantization=config.QUANTIZATION_SETTINGS["text"], flush_size=config.DB_FLUSH_SIZE,
+            extract_workers=config.TEXT_EXTRACT_WORKERS
+        )
+    if modality == "image":
+        from processors.image_processor import ImageProcessor
+        from core.translation import Translator
+        return ImageProcessor(
+            model_manager, config.IMAGE_DB, ann=config.ANN_SETTINGS["image"],
+            quantization=config.QUANTIZATION_SETTINGS["image"], flush_size=config.DB_FLUSH_SIZE,
+            caption_memory_mb=config.CAPTION_MEMORY_MB, decode_workers=config.IMAGE_DECODE_WORKERS,
+            queue_size=config.IMAGE_QUEUE_SIZE,
+            translator=Translator(config.TRANSLATION_CACHE, config.TRANSLATION_BACKEND, timeout=config.TRANSLATION_TIMEOUT)
+        )
+    if modality == "video":
+        from processors.video_processor import VideoProcessor
+        return VideoProcessor(
+            model_manager, config.VIDEO_DB, ann=config.ANN_SETTINGS["video"],
+            quantization=config.QUANTIZATION_SETTINGS["video"], flush_size=config.DB_FLUSH_SIZE,
+            thumbnail_dir=config.VIDEO_THUMBNAILS_DIR, interval=config.VIDEO_FRAME_INTERVAL,
+            scene_threshold=config.VIDEO_SCENE_THRESHOLD, dedup_distance=config.VIDEO_DEDUP_DISTANCE,
+            caption_memory_mb=config.CAPTION_MEMORY_MB, shortlist=config.VIDEO_SEARCH_SHORTLIST,
+            segment_margin=config.VIDEO_SEGMENT_MARGIN
+        )
+    if modality == "music":
+        from processors.music_processor import MusicProcessor
+        return MusicProcessor(
+            model_manager, config.MUSIC_DB, ann=config.ANN_SETTINGS["music"],
+            quantization=config.QUANTIZATION_SETTINGS["music"], flush_size=config.DB_FLUSH_SIZE,
+            windows=config.MUSIC_TRANSCRIBE_WINDOWS, max_silence=config.MUSIC_MAX_SILENCE,
+            vad_threshold_db=config.MUSIC_VAD_THRESHOLD_DB
+        )
+    raise ValueError(f"Неизвестный тип данных: {modality}")
@@ -0,0 +1,107 @@
+"""Отчёт о времени импорта и запуска приложения.
+
+Каждое измерение выполняется в отдельном процессе, чтобы уже загруженные модули не искажали результат:
+    python -m app.startup_profile --output startup.json
+    python -m app.startup_profile --check --budget 3.0
+С --check код возврата ненулевой, если при запуске импортирована тяжёлая библиотека
+или запуск дольше бюджета — так регрессии ловятся в скриптах сборки.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Библиотеки, которые не должны импортироваться до первого обращения к соответствующей функции
+HEAVY_MODULES = ("torch", "transformers", "sentence_transformers", "whisper", "cv2", "matplotlib", "numba")
+
+# Запуск без Tk: менеджер моделей и все процессоры, как в MainWindow.__init__
+STARTUP_SNIPPET = """
+import sys, time, json
+started = time.perf_counter()
+from app.config import Config
+from app.factory import create_processor, MODALITIES
+from core.models import ModelManager
+imported = time.perf_counter()
+config = Config()
+model_manager = ModelManager(config)
+processors = [create_processor(modality, config, model_manager) for modality in MODALITIES]
+finished = time.perf_counter()
+try:
+    import resource
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+except ImportError:
+    peak_rss_mb = None
+print(json.dumps({
+    "import_seconds": imported - started,
+    "construct_seconds": finished - imported,
+    "total_seconds": finished - started,
+    "peak_rss_mb": peak_rss_mb,
+    "modules": sorted(sys.modules)
+}))
+"""
+
+def _run(args):
+    return subprocess.run([sys.executable] + args, cwd=PROJECT_ROOT, capture_output=True, text=True)
+
+def import_profile(module, top=20):
+    """Самые долгие по суммарному времени импорты модуля (python -X importtime)."""
+    result = _run(["-X", "importtime", "-c", f"import {module}"])
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, package = line[len("import time:"):].split("|")
+        rows.append({"package": package.strip(), "self_ms": int(self_us) / 1000,
+                     "cumulative_ms": int(cumulative_us) / 1000})
+    total_ms = sum(row["self_ms"] for row in rows)
+    heavy = sorted({row["package"].split(".")[0] for row in rows} & set(HEAVY_MODULES))
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return {"module": module, "total_ms": total_ms, "heavy_modules": heavy, "slowest": rows[:top]}
+
+def startup_profile():
+    """Время импорта и создания ModelManager и процессоров, пиковая память, загруженные тяжёлые модули."""
+    result = _run(["-c", STARTUP_SNIPPET])
+    if result.returncode != 0:
+        raise RuntimeError(f"Ошибка запуска:\n{result.stderr[-2000:]}")
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    modules = set(report.pop("modules"))
+    report["heavy_modules"] = [name for name in HEAVY_MODULES if name in modules]
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Профиль времени импорта и запуска приложения")
+    parser.add_argument("--modules", nargs="+", default=["app.ui.main_window", "app.cli"],
+                        help="Модули для профиля импорта")
+    parser.add_argument("--top", type=int, default=20, help="Сколько самых долгих импортов показывать")
+    parser.add_argument("--output", default=None, help="Путь для JSON-отчёта")
+    parser.add_argument("--check", action="store_true", help="Ненулевой код возврата при регрессии")
+    parser.add_argument("--budget", type=float, default=5.0, help="Допустимое время запуска, с (для --check)")
+    args = parser.parse_args(argv)
+
+    report = {
+        "imports": [import_profile(module, args.top) for module in args.modules],
+        "startup": startup_profile()
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+    problems = []
+    for item in report["imports"] + [report["startup"]]:
+        if item["heavy_modules"]:
+            problems.append(f"{item.get('module', 'запуск')}: импортированы {', '.join(item['heavy_modules'])}")
+    if report["startup"]["total_seconds"] > args.budget:
+        problems.append(f"запуск {report['startup']['total_seconds']:.2f} с > {args.budget:.2f} с")
+    for problem in problems:
+        print(f"Регрессия: {problem}", file=sys.stderr)
+    return 1 if args.check and problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
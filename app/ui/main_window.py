@@ -3,16 +3,14 @@ from tkinter import filedialog, messagebox, scrolledtext, ttk
 from app.ui.theme import Theme
 from app.ui.components import HistoryComponent
 from core.models import ModelManager
-from processors.text_processor import TextProcessor
-from processors.image_processor import ImageProcessor
-from processors.video_processor import VideoProcessor
-from processors.music_processor import MusicProcessor
+from app.factory import create_processor
+from core.search import SearchCoordinator
+from core.scheduler import IndexScheduler
+from core import metrics
 import json
 import os
 import asyncio
 from queue import Queue
-import matplotlib.pyplot as plt
-from matplotlib.widgets import Button
 
 class MainWindow:
     """Основное окно приложения семантического поиска с асинхронной обработкой."""
@@ -27,16 +25,34 @@ class MainWindow:
         self.theme = Theme(self._load_theme_config())
         self.model_manager = ModelManager(config)
         
-        self.text_processor = TextProcessor(self.model_manager, config.INDEX_FILE)
-        self.image_processor = ImageProcessor(self.model_manager, config.IMAGE_DB)
-        self.video_processor = VideoProcessor(self.model_manager, config.VIDEO_DB)
-        self.music_processor = MusicProcessor(self.model_manager, config.MUSIC_DB)
+        self.text_processor = create_processor("text", config, self.model_manager)
+        self.image_processor = create_processor("image", config, self.model_manager)
+        self.video_processor = create_processor("video", config, self.model_manager)
+        self.music_processor = create_processor("music", config, self.model_manager)
         
+        self.search_coordinator = SearchCoordinator(self.model_manager, {
+            "text": self.text_processor,
+            "image": self.image_processor,
+            "video": self.video_processor,
+            "music": self.music_processor
+        }, sample_size=config.SEARCH_CALIBRATION_SAMPLE)
         self.scan_dirs = {"text": "", "image": "", "video": "", "music": ""}
         self.image_buttons = []
         self.task_queue = Queue()  # Очередь для обновления UI из асинхронных задач
+        # Индексация идёт в собственных потоках планировщика, цикл asyncio остаётся свободным для поиска
+        self.scheduler = IndexScheduler(
+            report=lambda action, value: self.task_queue.put((action, value)),
+            chunk_size=config.INDEX_CHUNK_SIZE,
+            io_workers=config.INDEX_IO_WORKERS,
+            process_workers=config.INDEX_PROCESS_WORKERS,
+            prefetch_chunks=config.INDEX_PREFETCH_CHUNKS,
+            priorities=config.INDEX_PRIORITIES,
+            max_attempts=config.INDEX_MAX_ATTEMPTS,
+            backoff=config.INDEX_RETRY_BACKOFF
+        )
         
         self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
         self.root.after(100, self._check_queue)  # Периодическая проверка очереди
 
     def _load_theme_config(self):
@@ -108,7 +124,10 @@ class MainWindow:
             ("Поиск текста", lambda: self._perform_async_search(self.text_processor, self._display_text_results)),
             ("Поиск изображений", lambda: self._perform_async_search(self.image_processor, self._display_images)),
             ("Поиск видео", lambda: self._perform_async_search(self.video_processor, self._display_videos)),
-            ("Поиск музыки", lambda: self._perform_async_search(self.music_processor, self._display_music_results))
+            ("Поиск музыки", lambda: self._perform_async_search(self.music_processor, self._display_music_results)),
+            ("Поиск везде", lambda: self._perform_async_search(
+                self.search_coordinator, self._display_all_results, self.config.UNIFIED_TOP_K
+            ))
         ]:
             btn = tk.Button(
                 self.query_section,
@@ -155,6 +174,24 @@ class MainWindow:
             mode="determinate"
         )
         self.progress_bar.pack(side=tk.LEFT, padx=10)
+        self.pause_button = tk.Button(
+            self.progress_frame,
+            text="Пауза",
+            command=self._toggle_pause,
+            bg=self.theme.get_button_bg(),
+            fg=self.theme.get_button_fg(),
+            relief=tk.FLAT
+        )
+        self.pause_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = tk.Button(
+            self.progress_frame,
+            text="Отмена",
+            command=self.scheduler.cancel,
+            bg=self.theme.get_button_bg(),
+            fg=self.theme.get_button_fg(),
+            relief=tk.FLAT
+        )
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
         
         # Script Section
         self.script_section = tk.Frame(self.body_frame, bg=self.theme.get_bg_color())
@@ -241,9 +278,14 @@ class MainWindow:
             action, value = self.task_queue.get()
             if action == "progress":
                 self.progress_bar["value"] = value
+            elif action == "status":
+                self.progress_label.config(text=value)
             elif action == "complete":
+                self._write_metrics()
                 messagebox.showinfo("Информация", value)
-                self.progress_bar["value"] = 0
+                if not self.scheduler.active_jobs():
+                    self.progress_bar["value"] = 0
+                    self.pause_button.config(text="Пауза")
             elif action == "search_results":
                 value[0](value[1])  # Вызов функции отображения с результатами
         self.root.after(100, self._check_queue)
@@ -275,6 +317,8 @@ class MainWindow:
             self.text_ext_label.configure(bg=self.theme.get_bg_color(), fg=self.theme.get_fg_color())
         
         self.theme_button.configure(bg=self.theme.get_button_bg(), fg=self.theme.get_button_fg())
+        self.pause_button.configure(bg=self.theme.get_button_bg(), fg=self.theme.get_button_fg())
+        self.cancel_button.configure(bg=self.theme.get_button_bg(), fg=self.theme.get_button_fg())
         self.footer_label.configure(bg=self.theme.get_accent_color(), fg=self.theme.get_fg_color())
         self.progress_label.configure(bg=self.theme.get_bg_color(), fg=self.theme.get_fg_color())
         
@@ -296,17 +340,6 @@ class MainWindow:
     _select_video_dir = lambda self: self._select_dir("video")
     _select_music_dir = lambda self: self._select_dir("music")
 
-    async def _async_index(self, processor, name, directory, extensions=None):
-        """Асинхронная индексация файлов."""
-        files = processor.list_files_with_progress(directory, extensions or processor.default_extensions)
-        total_files = len(files)
-        for i, file_path in enumerate(files):
-            processor.process_file(file_path)
-            progress = (i + 1) / total_files * 100
-            self.task_queue.put(("progress", progress))
-            await asyncio.sleep(0.01)  # Позволяет UI обновляться
-        self.task_queue.put(("complete", f"Индексация {name} завершена."))
-
     def _run_async_indexing(self, processor, name):
         if not self.scan_dirs[name]:
             messagebox.showwarning("Предупреждение", f"Сначала выберите директорию для {name}")
@@ -314,24 +347,45 @@ class MainWindow:
         extensions = None
         if name == "text":
             extensions = [ext.strip() for ext in self.text_ext_entry.get().split(",")]
-        asyncio.run_coroutine_threadsafe(
-            self._async_index(processor, name, self.scan_dirs[name], extensions),
-            self.async_loop
-        )
+        self.scheduler.submit(name, processor, self.scan_dirs[name], extensions)
+
+    def _toggle_pause(self):
+        """Пауза или продолжение всех задач индексации."""
+        if self.pause_button.cget("text") == "Пауза":
+            self.scheduler.pause()
+            self.pause_button.config(text="Продолжить")
+        else:
+            self.scheduler.resume()
+            self.pause_button.config(text="Пауза")
+
+    def _write_metrics(self):
+        """Запись метрик по стадиям в Config.METRICS_FILE, если он задан."""
+        if not self.config.METRICS_FILE:
+            return
+        try:
+            metrics.REGISTRY.write(self.config.METRICS_FILE)
+        except OSError as e:
+            print(f"Ошибка записи метрик: {e}")
+
+    def _on_close(self):
+        # Незаписанные пачки будут обработаны при следующей индексации
+        self.scheduler.shutdown()
+        self._write_metrics()
+        self.root.destroy()
 
     async def _async_search(self, processor, query, display_method, top_k=5):
         """Асинхронный поиск."""
         results = processor.search(query, top_k)
         self.task_queue.put(("search_results", (display_method, results)))
 
-    def _perform_async_search(self, processor, display_method):
+    def _perform_async_search(self, processor, display_method, top_k=5):
         query = self.query_entry.get().strip()
         if not query:
             messagebox.showwarning("Предупреждение", "Введите поисковой запрос.")
             return
         self._save_search_history(query)
         asyncio.run_coroutine_threadsafe(
-            self._async_search(processor, query, display_method),
+            self._async_search(processor, query, display_method, top_k),
             self.async_loop
         )
 
@@ -356,7 +410,7 @@ class MainWindow:
     def _display_text_results(self, results):
         self.results_text.delete("1.0", tk.END)
         self.results_text.insert(tk.END, "Результаты поиска текста:\n\n")
-        for i, (path, sentence, score, _) in enumerate(results, 1):
+        for i, (path, sentence, score, location) in enumerate(results, 1):
             score_percent = score * 100
             similarity_level = (
                 "очень высокая" if score_percent > 90 else
@@ -371,7 +425,7 @@ class MainWindow:
             btn = tk.Button(
                 self.results_text,
                 text="Открыть",
-                command=lambda s=sentence, p=path: self._open_text_window(s, p),
+                command=lambda s=sentence, p=path, loc=location: self._open_text_window(s, p, loc),
                 bg=self.theme.get_button_bg(),
                 fg=self.theme.get_button_fg()
             )
@@ -396,7 +450,32 @@ class MainWindow:
             self.results_text.window_create(tk.END, window=btn)
             self.results_text.insert(tk.END, "\n\n")
 
+    def _display_all_results(self, results):
+        labels = {"text": "Текст", "image": "Изображение", "video": "Видео", "music": "Музыка"}
+        self.results_text.delete("1.0", tk.END)
+        self.results_text.insert(tk.END, "Результаты поиска по всем типам данных:\n\n")
+        for i, (modality, path, desc, score, extra, sim) in enumerate(results, 1):
+            info_text = (f"{i}. [{labels.get(modality, modality)}] Файл: {path}\n"
+                        f"   Описание: {desc[:200]}\n"
+                        f"   Оценка: {score:.2f} (схожесть: {sim:.2%})\n")
+            self.results_text.insert(tk.END, info_text)
+            if modality == "text":
+                text, command = "Открыть", lambda s=desc, p=path, loc=extra: self._open_text_window(s, p, loc)
+            else:
+                text, command = "Открыть папку", lambda p=path: self._open_directory(p)
+            btn = tk.Button(
+                self.results_text,
+                text=text,
+                command=command,
+                bg=self.theme.get_button_bg(),
+                fg=self.theme.get_button_fg()
+            )
+            self.results_text.window_create(tk.END, window=btn)
+            self.results_text.insert(tk.END, "\n\n")
+
     def _display_images(self, results):
+        import matplotlib.pyplot as plt  # matplotlib нужен только для показа результатов
+        from matplotlib.widgets import Button
         self.image_buttons = []
         fig = plt.figure(figsize=(15, 10))
         for i, (path, desc, sim, _) in enumerate(results):
@@ -416,6 +495,8 @@ class MainWindow:
         plt.show()
 
     def _display_videos(self, results):
+        import matplotlib.pyplot as plt  # matplotlib нужен только для показа результатов
+        from matplotlib.widgets import Button
         self.image_buttons = []
         fig = plt.figure(figsize=(15, 10))
         for i, (path, desc, sim, keyframe) in enumerate(results):
@@ -434,8 +515,8 @@ class MainWindow:
         plt.tight_layout()
         plt.show()
 
-    def _open_text_window(self, sentence, file_path):
-        snippet = self.text_processor.get_snippet(file_path, sentence)
+    def _open_text_window(self, sentence, file_path, location=None):
+        snippet = self.text_processor.get_snippet(file_path, sentence, location=location)
         window = tk.Toplevel(self.root)
         window.title(f"Фрагмент из {os.path.basename(file_path)}")
         window.geometry("800x600")
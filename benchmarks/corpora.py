@@ -0,0 +1,116 @@
+"""Синтетические корпуса для бенчмарков: тексты, изображения, короткие видео и беззвучные MP3.
+
+Все генераторы детерминированы (seed) и пропускают уже существующие файлы, поэтому
+корпус можно создать один раз и переиспользовать между запусками.
+"""
+import os
+import shutil
+import subprocess
+import numpy as np
+
+# Небольшой словарь: запросы из тех же слов находят осмысленные совпадения
+VOCABULARY = (
+    "поиск индекс модель вектор запрос файл текст изображение видео музыка кадр подпись база данные "
+    "память диск поток процесс пачка очередь результат оценка время задержка скорость кэш журнал "
+    "кошка собака дом город река гора лес море солнце дождь снег ночь утро вечер дорога мост "
+    "search index model vector query file image video music frame caption memory thread batch result"
+).split()
+
+def sentences(count, seed=0, min_words=5, max_words=14):
+    """Детерминированный поток предложений из словаря."""
+    rng = np.random.default_rng(seed)
+    words = np.array(VOCABULARY)
+    for _ in range(count):
+        length = int(rng.integers(min_words, max_words + 1))
+        yield " ".join(words[rng.integers(0, len(words), size=length)]).capitalize() + "."
+
+def make_text_corpus(directory, files=100, lines_per_file=200, seed=0):
+    """TXT-файлы по lines_per_file предложений; вторая половина файлов повторяет первую (общие эмбеддинги)."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(files):
+        path = os.path.join(directory, f"doc_{index:05d}.txt")
+        if not os.path.exists(path):
+            with open(path, "w", encoding="utf-8") as f:
+                for sentence in sentences(lines_per_file, seed=seed * 100003 + index % max(1, files // 2)):
+                    f.write(sentence + "\n")
+        paths.append(path)
+    return paths
+
+def make_image_corpus(directory, count=50, size=(640, 480), seed=0):
+    """JPEG- и PNG-изображения из шума и цветных прямоугольников."""
+    from PIL import Image, ImageDraw
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"img_{index:05d}.{'png' if index % 4 == 0 else 'jpg'}")
+        noise = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+        if not os.path.exists(path):
+            image = Image.fromarray(noise)
+            draw = ImageDraw.Draw(image)
+            for _ in range(5):
+                x0, y0 = int(rng.integers(0, size[0] // 2)), int(rng.integers(0, size[1] // 2))
+                draw.rectangle([x0, y0, x0 + size[0] // 3, y0 + size[1] // 3],
+                               fill=tuple(int(c) for c in rng.integers(0, 256, size=3)))
+            image.save(path)
+        paths.append(path)
+    return paths
+
+def make_video_corpus(directory, count=5, seconds=10, fps=10, size=(320, 240), seed=0):
+    """Короткие MP4 (mp4v) со сменой сцен каждые две секунды."""
+    import cv2
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"video_{index:05d}.mp4")
+        colors = rng.integers(0, 256, size=(seconds // 2 + 1, 3))
+        if not os.path.exists(path):
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+            for frame_index in range(seconds * fps):
+                frame = np.empty((size[1], size[0], 3), dtype=np.uint8)
+                frame[:] = colors[frame_index // (2 * fps)]
+                # Движущаяся полоса: соседние кадры одной сцены похожи, но не одинаковы
+                x = frame_index * 4 % size[0]
+                frame[:, x:x + 8] = 255 - frame[:, x:x + 8]
+                writer.write(frame)
+            writer.release()
+        paths.append(path)
+    return paths
+
+def make_music_corpus(directory, count=10, seconds=20, seed=0):
+    """Беззвучные MP3 с тегами ID3 (нужен ffmpeg)."""
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg не найден")
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"track_{index:05d}.mp3")
+        genre = VOCABULARY[int(rng.integers(0, len(VOCABULARY)))]
+        if not os.path.exists(path):
+            subprocess.run([
+                "ffmpeg", "-nostdin", "-v", "error", "-y", "-f", "lavfi", "-i", "anullsrc=r=44100:cl=mono",
+                "-t", str(seconds), "-b:a", "64k",
+                "-metadata", f"title=Track {index}", "-metadata", f"artist=Artist {index % 7}",
+                "-metadata", f"album=Album {index % 3}", "-metadata", f"genre={genre}", path
+            ], check=True)
+        paths.append(path)
+    return paths
+
+def random_unit_vectors(count, dim, seed=0, batch_size=50000, clusters=256, spread=0.6):
+    """Нормированные векторы вокруг clusters случайных центров, пачками (базы на миллионы строк без лишней памяти).
+
+    Настоящие эмбеддинги сгруппированы по темам; равномерно случайные векторы сделали бы
+    приближённый поиск заведомо бессмысленным.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        noise = rng.standard_normal((size, dim)).astype(np.float32) * (spread / np.sqrt(dim))
+        batch = centers[rng.integers(0, clusters, size=size)] + noise
+        batch /= np.linalg.norm(batch, axis=1, keepdims=True)
+        yield start, batch
@@ -0,0 +1 @@
+"""Пакет benchmarks - воспроизводимые замеры производительности с заглушкой моделей."""
\ No newline at end of file
@@ -0,0 +1,352 @@
+"""Воспроизводимые бенчмарки: база векторов, индексация процессорами и поиск от запроса до результата.
+
+Модели заменены детерминированной заглушкой (StubModelManager), корпуса генерируются синтетически,
+поэтому запуск не требует загрузки моделей и GPU, а результаты сопоставимы между коммитами:
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --output after.json --baseline before.json
+    python -m benchmarks.run --quick            # быстрый прогон на маленьких данных
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import contextlib
+import subprocess
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+from app.factory import create_processor, MODALITIES
+from core import metrics
+from core.database import Database
+from core.quantization import recall_report
+from benchmarks.stub_models import StubModelManager
+from benchmarks import corpora
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+QUICK_SIZES = (2000,)
+# Параметры приближённого поиска в бенчмарке базы: индекс строится на любом размере
+BENCH_ANN = {"nprobe": 16, "min_rows": 1}
+
+def latency_stats(samples):
+    """Сводка задержек в миллисекундах."""
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    if not len(ms):
+        return {}
+    return {"mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)), "max_ms": float(ms.max()), "count": len(ms)}
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+def remove_db(db_path, directories=()):
+    """Удаление базы вместе с хранилищами векторов (в т.ч. квантованными), индексом и служебными директориями.
+
+    directories — дополнительные директории процессора, например миниатюры видео из Config.
+    """
+    base = os.path.splitext(db_path)[0]
+    vectors = [f"{base}_vectors.{extension}" for extension in ("f32", "f16", "i8", "i8s")]
+    for path in [db_path, f"{db_path}-wal", f"{db_path}-shm", f"{base}_ivf.npy"] + vectors:
+        if os.path.exists(path):
+            os.remove(path)
+    for directory in (f"{base}_text", f"{base}_thumbnails", db_path.replace(".db", "_cache"), *directories):
+        shutil.rmtree(directory, ignore_errors=True)
+
+def bench_config(workdir):
+    """Config с базами внутри рабочей директории и переводом без сети."""
+    config = Config()
+    data = os.path.join(workdir, "data")
+    os.makedirs(data, exist_ok=True)
+    config.INDEX_FILE = os.path.join(data, "text.db")
+    config.IMAGE_DB = os.path.join(data, "images.db")
+    config.VIDEO_DB = os.path.join(data, "videos.db")
+    config.MUSIC_DB = os.path.join(data, "music.db")
+    config.VIDEO_THUMBNAILS_DIR = os.path.join(data, "thumbnails")
+    config.TRANSLATION_CACHE = os.path.join(data, "translations.db")
+    config.TRANSLATION_BACKEND = "identity"
+    config.ANN_SETTINGS = {modality: None for modality in MODALITIES}
+    return config
+
+def count_rows(db):
+    return sum(len(rows) for rows in db.iter_entries(10000))
+
+def make_queries(db, count, seed):
+    """Запросы — случайные строки базы с шумом: у каждого есть осмысленные ближайшие соседи."""
+    rng = np.random.default_rng(seed)
+    matrix = db.vectors()
+    rows = rng.choice(len(matrix), size=min(count, len(matrix)), replace=False)
+    return matrix[np.sort(rows)] + rng.normal(scale=0.05, size=(len(rows), matrix.shape[1])).astype(np.float32)
+
+def bench_database(workdir, size, dim, num_queries, top_k, seed):
+    """Database: пакетная запись, загрузка, add_entry, точный и приближённый поиск."""
+    db_path = os.path.join(workdir, f"bench_{size}.db")
+    remove_db(db_path)
+    db = Database(db_path, ann=BENCH_ANN)
+    started = time.perf_counter()
+    for start, batch in corpora.random_unit_vectors(size, dim, seed):
+        db.add_entries([(f"row/{start + i}", f"description {start + i}", vector, None)
+                        for i, vector in enumerate(batch)])
+    bulk = time.perf_counter() - started
+    _, load_seconds = timed(db.load)
+
+    rng = np.random.default_rng(seed + 1)
+    single = []
+    for i in range(100):
+        _, elapsed = timed(db.add_entry, f"single/{i}", "single", rng.standard_normal(dim).astype(np.float32))
+        single.append(elapsed)
+
+    queries = make_queries(db, num_queries, seed + 2)
+    exact, exact_times = [], []
+    for query in queries:
+        found, elapsed = timed(db.search, query, top_k, exact=True)
+        exact.append({path for path, *_ in found})
+        exact_times.append(elapsed)
+    ann_times, hits = [], 0
+    for query, truth in zip(queries, exact):
+        found, elapsed = timed(db.search, query, top_k)
+        ann_times.append(elapsed)
+        hits += len(truth & {path for path, *_ in found})
+    stats_times = [timed(db.score_stats, query)[1] for query in queries[:20]]
+    # float16 на больших базах медленный в numpy; его можно оценить через python -m core.quantization
+    quantized = recall_report(db, dtypes=("int8",), reranks=(1, 4), num_queries=min(num_queries, 50), top_k=top_k, seed=seed)
+
+    vectors_path = f"{os.path.splitext(db_path)[0]}_vectors.f32"
+    result = {
+        "rows": size,
+        "dim": dim,
+        "bulk_insert_seconds": bulk,
+        "bulk_insert_rows_per_second": size / bulk if bulk else None,
+        "load_seconds": load_seconds,
+        "add_entry": latency_stats(single),
+        "search_exact": latency_stats(exact_times),
+        "search_ann": latency_stats(ann_times),
+        "ann_recall": hits / max(1, sum(len(t) for t in exact)),
+        "score_stats": latency_stats(stats_times),
+        "quantized": [{key: row[key] for key in ("dtype", "rerank", "recall", "latency_ms", "memory_ratio")}
+                      for row in quantized["settings"]],
+        "db_bytes": sum(os.path.getsize(path) for path in (db_path, f"{db_path}-wal") if os.path.exists(path)),
+        "vectors_bytes": os.path.getsize(vectors_path)
+    }
+    db.close()
+    remove_db(db_path)
+    return result
+
+CORPUS_MAKERS = {
+    "text": lambda directory, args: corpora.make_text_corpus(directory, args.text_files, args.text_lines),
+    "image": lambda directory, args: corpora.make_image_corpus(directory, args.image_files),
+    "video": lambda directory, args: corpora.make_video_corpus(directory, args.video_files),
+    "music": lambda directory, args: corpora.make_music_corpus(directory, args.music_files),
+}
+
+def bench_index(workdir, modality, args, model):
+    """index_files процессора на синтетическом корпусе: первый проход и повтор без изменений."""
+    corpus_dir = os.path.join(workdir, "corpus", modality)
+    try:
+        files = CORPUS_MAKERS[modality](corpus_dir, args)
+        config = bench_config(workdir)
+        db_path = {"text": config.INDEX_FILE, "image": config.IMAGE_DB,
+                   "video": config.VIDEO_DB, "music": config.MUSIC_DB}[modality]
+        remove_db(db_path, [config.VIDEO_THUMBNAILS_DIR] if modality == "video" else ())
+        processor = create_processor(modality, config, model)
+    except (ImportError, OSError, RuntimeError, subprocess.CalledProcessError) as e:
+        return {"skipped": f"{type(e).__name__}: {e}"}
+    index = processor.index_files if modality != "text" else (
+        lambda directory: processor.index_files(directory, processor.default_extensions))
+    metrics.REGISTRY.reset()
+    _, first = timed(index, corpus_dir)
+    # Разбивка первого прохода по стадиям: диск, модель или SQLite
+    stages = metrics.REGISTRY.summary()
+    _, repeat = timed(index, corpus_dir)
+    rows = count_rows(processor.db)
+    duplicate = {}
+    if modality == "video":
+        # Побайтная копия уже проиндексированного видео должна браться из кэша без вызова модели подписей
+        calls = processor.captioner.calls
+        copy_path = os.path.join(corpus_dir, f"duplicate{os.path.splitext(files[0])[1]}")
+        shutil.copyfile(files[0], copy_path)
+        try:
+            index(corpus_dir)
+        finally:
+            os.remove(copy_path)
+        duplicate["duplicate_caption_calls"] = processor.captioner.calls - calls
+    return {
+        "files": len(files),
+        "corpus_bytes": sum(os.path.getsize(path) for path in files),
+        "rows": rows,
+        "index_seconds": first,
+        "files_per_second": len(files) / first if first else None,
+        "reindex_unchanged_seconds": repeat,
+        **duplicate,
+        "stages": stages
+    }
+
+def fill_text_db(processor, model, size, seed, batch_size=20000):
+    """Наполнение текстовой базы синтетическими предложениями без чтения файлов."""
+    stream = corpora.sentences(size, seed=seed)
+    for start in range(0, size, batch_size):
+        batch = [next(stream) for _ in range(min(batch_size, size - start))]
+        embeddings = model.encode_text(batch)
+        processor.db.add_entries([
+            (f"synthetic/doc_{(start + i) // 200:05d}.txt#{(start + i) % 200}", sentence, embedding, None,
+             f"synthetic/doc_{(start + i) // 200:05d}.txt")
+            for i, (sentence, embedding) in enumerate(zip(batch, embeddings))
+        ])
+
+def fill_caption_db(db, model, size, seed, batch_size=20000):
+    """Наполнение базы изображений, видео или музыки синтетическими описаниями."""
+    stream = corpora.sentences(size, seed=seed)
+    for start in range(0, size, batch_size):
+        batch = [next(stream) for _ in range(min(batch_size, size - start))]
+        db.add_entries([(f"synthetic/item_{start + i:07d}", sentence, embedding, None)
+                        for i, (sentence, embedding) in enumerate(zip(batch, model.encode_text(batch)))])
+
+def bench_query(workdir, size, num_queries, top_k, seed, model):
+    """От текста запроса до результата: поиск по тексту (size строк) и единый поиск по всем базам.
+
+    Базы остальных модальностей получают по size // 10 строк.
+    """
+    from core.search import SearchCoordinator
+    config = bench_config(os.path.join(workdir, f"query_{size}"))
+    processors, skipped = {}, {}
+    for modality in MODALITIES:
+        try:
+            processors[modality] = create_processor(modality, config, model)
+        except ImportError as e:
+            skipped[modality] = f"{type(e).__name__}: {e}"
+    started = time.perf_counter()
+    fill_text_db(processors["text"], model, size, seed)
+    for offset, (modality, processor) in enumerate(processors.items()):
+        if modality != "text":
+            fill_caption_db(processor.db, model, max(1, size // 10), seed + offset)
+    fill_seconds = time.perf_counter() - started
+    for processor in processors.values():
+        processor.db.load()
+
+    queries = [" ".join(sentence.split()[:4]) + f" {i}" for i, sentence in enumerate(corpora.sentences(num_queries, seed=seed + 7))]
+    text_times = [timed(processors["text"].search, query, top_k)[1] for query in queries]
+    cached_times = [timed(processors["text"].search, query, top_k)[1] for query in queries]
+    coordinator = SearchCoordinator(model, processors, sample_size=config.SEARCH_CALIBRATION_SAMPLE)
+    unified_times = [timed(coordinator.search, f"{query} all", top_k)[1] for query in queries]
+    shutil.rmtree(os.path.join(workdir, f"query_{size}"), ignore_errors=True)
+    return {
+        "text_rows": size,
+        "fill_seconds": fill_seconds,
+        "text_search": latency_stats(text_times),
+        "text_search_cached_query": latency_stats(cached_times),
+        "unified_search": latency_stats(unified_times),
+        "unified_modalities": sorted(processors),
+        "skipped": skipped
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def flatten(report, prefix=""):
+    """Числовые метрики отчёта в виде {путь: значение}."""
+    if isinstance(report, dict):
+        items = report.items()
+    elif isinstance(report, list):
+        items = ((str(item.get("rows", item.get("text_rows", i))) if isinstance(item, dict) else str(i), item)
+                 for i, item in enumerate(report))
+    else:
+        return {prefix: report} if isinstance(report, (int, float)) and not isinstance(report, bool) else {}
+    flat = {}
+    for key, value in items:
+        flat.update(flatten(value, f"{prefix}.{key}" if prefix else key))
+    return flat
+
+def compare(baseline, report):
+    """Строки сравнения метрик времени с прошлым отчётом."""
+    old, new = flatten(baseline), flatten(report)
+    lines = []
+    for key in sorted(old.keys() & new.keys()):
+        if not key.endswith(("_ms", "_seconds")) or key.startswith("meta."):
+            continue
+        if old[key]:
+            lines.append(f"{key}: {old[key]:.3f} -> {new[key]:.3f} (x{new[key] / old[key]:.2f})")
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки базы, индексации и поиска с заглушкой моделей")
+    parser.add_argument("--suites", nargs="+", default=["database", "index", "query"],
+                        choices=["database", "index", "query"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=None, help="Размеры баз в строках")
+    parser.add_argument("--dim", type=int, default=768, help="Размерность эмбеддингов")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--text-files", type=int, default=200)
+    parser.add_argument("--text-lines", type=int, default=200)
+    parser.add_argument("--image-files", type=int, default=50)
+    parser.add_argument("--video-files", type=int, default=5)
+    parser.add_argument("--music-files", type=int, default=10)
+    parser.add_argument("--quick", action="store_true", help="Маленькие данные для быстрой проверки")
+    parser.add_argument("--workdir", default=None, help="Рабочая директория (корпуса сохраняются между запусками)")
+    parser.add_argument("--output", default=None, help="Путь для JSON-отчёта")
+    parser.add_argument("--baseline", default=None, help="Прошлый JSON-отчёт для сравнения")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.text_files, args.text_lines, args.image_files, args.video_files, args.music_files = 20, 50, 8, 2, 3
+        args.queries = min(args.queries, 20)
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="semantic_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    report = {"meta": {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "dim": args.dim,
+        "sizes": list(sizes),
+        "seed": args.seed
+    }}
+    # Сообщения процессоров уходят в stderr, stdout остаётся для отчёта
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            if "database" in args.suites:
+                report["database"] = []
+                for size in sizes:
+                    print(f"База: {size} строк")
+                    report["database"].append(bench_database(workdir, size, args.dim, args.queries, args.top_k, args.seed))
+            if "index" in args.suites:
+                report["index"] = {}
+                for modality in MODALITIES:
+                    print(f"Индексация: {modality}")
+                    report["index"][modality] = bench_index(workdir, modality, args, StubModelManager(args.dim))
+            if "query" in args.suites:
+                report["query"] = []
+                for size in sizes:
+                    print(f"Поиск: {size} строк")
+                    report["query"].append(bench_query(workdir, size, args.queries, args.top_k, args.seed,
+                                                       StubModelManager(args.dim)))
+        finally:
+            if args.workdir is None:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            for line in compare(json.load(f), report):
+                print(line, file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
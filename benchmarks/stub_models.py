@@ -0,0 +1,98 @@
+import re
+import time
+import zlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from core import metrics
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+class StubModelManager:
+    """Детерминированная замена ModelManager для бенчмарков: без загрузки моделей и GPU.
+
+    Эмбеддинг текста — сумма псевдослучайных векторов его слов (seed — crc32 слова), поэтому тексты
+    с общими словами близки, а результат одинаков на любой машине. Подпись изображения строится
+    по среднему цвету и размеру, транскрипция — по длине и громкости фрагмента. Задержки
+    *_delay (секунды на элемент) позволяют имитировать стоимость настоящих моделей.
+    """
+
+    def __init__(self, dim=768, encode_delay=0.0, caption_delay=0.0, transcribe_delay=0.0, query_cache_size=1024):
+        self.dim = dim
+        self.device = "cpu"
+        self.text_model_name = f"stub-{dim}"
+        self.model_names = {"text": self.text_model_name, "image": "stub-caption", "whisper": "stub-asr"}
+        self.encode_delay = encode_delay
+        self.caption_delay = caption_delay
+        self.transcribe_delay = transcribe_delay
+        self.query_cache_size = query_cache_size
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._query_cache = OrderedDict()
+        self.calls = {"encode_text": 0, "encode_query": 0, "generate_image_captions": 0, "transcribe_audio": 0,
+                      "fine_tune_text_model": 0}
+
+    def _token_vector(self, token):
+        vector = self._tokens.get(token)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(token.encode("utf-8")))
+            vector = rng.standard_normal(self.dim).astype(np.float32)
+            with self._lock:
+                self._tokens[token] = vector
+        return vector
+
+    def encode_text(self, texts, batch_size=32):
+        self.calls["encode_text"] += 1
+        with metrics.stage("encode", items=len(texts)):
+            if self.encode_delay:
+                time.sleep(self.encode_delay * len(texts))
+            result = np.zeros((len(texts), self.dim), dtype=np.float32)
+            for i, text in enumerate(texts):
+                for token in TOKEN_RE.findall(text.lower()):
+                    result[i] += self._token_vector(token)
+            # Пустой текст получает фиксированный ненулевой вектор, как и у настоящей модели
+            result[~result.any(axis=1)] = self._token_vector("")
+            return result
+
+    def encode_query(self, text):
+        self.calls["encode_query"] += 1
+        key = (self.text_model_name, text)
+        with self._lock:
+            if key in self._query_cache:
+                self._query_cache.move_to_end(key)
+                return self._query_cache[key]
+        embedding = self.encode_text([text])[0]
+        embedding.flags.writeable = False
+        with self._lock:
+            self._query_cache[key] = embedding
+            if len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return embedding
+
+    def generate_image_captions(self, images, max_length=100, num_beams=5):
+        self.calls["generate_image_captions"] += 1
+        with metrics.stage("caption", items=len(images)):
+            if self.caption_delay:
+                time.sleep(self.caption_delay * len(images))
+            captions = []
+            for image in images:
+                pixels = np.asarray(image.convert("RGB"), dtype=np.float32)
+                channel = ("red", "green", "blue")[int(np.argmax(pixels.mean(axis=(0, 1))))]
+                brightness = "bright" if pixels.mean() > 127 else "dark"
+                captions.append(f"a {brightness} picture with {channel} tones {image.width}x{image.height}")
+            return captions
+
+    def transcribe_audio(self, audio):
+        self.calls["transcribe_audio"] += 1
+        with metrics.stage("transcribe"):
+            if self.transcribe_delay:
+                time.sleep(self.transcribe_delay)
+            if isinstance(audio, str):
+                return ""
+            loudness = float(np.sqrt(np.mean(np.square(audio)))) if len(audio) else 0.0
+            return f"speech {len(audio) // 16000} seconds loudness {loudness:.2f}" if loudness > 0.01 else ""
+
+    def fine_tune_text_model(self, examples, output_path, epochs=1, batch_size=8):
+        """Дообучение без эффекта: эмбеддинги заглушки не зависят от данных, модель остаётся прежней."""
+        self.calls["fine_tune_text_model"] += 1
+        return self
@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+class IVFIndex:
+    """Инвертированный индекс (IVF) на центроидах k-means для приближённого поиска.
+
+    Рядом с .db хранятся только центроиды, номер списка каждой записи лежит
+    в колонке entries.ann_list, а сами векторы берутся из хранилища векторов Database.
+    Позиция строки в индексе совпадает с её номером в хранилище (entries.emb_row).
+    """
+
+    def __init__(self, index_path, nlist=None, nprobe=8, min_rows=10000,
+                 sample_size=100000, iterations=10, seed=0):
+        self.index_path = index_path
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_rows = min_rows
+        self.sample_size = sample_size
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        self.assign = np.empty(0, dtype=np.int32)
+        self.lists = []
+
+    @classmethod
+    def from_settings(cls, db_path, settings):
+        """Создание индекса из настроек Config.ANN_SETTINGS."""
+        index_path = f"{os.path.splitext(db_path)[0]}_ivf.npy"
+        return cls(index_path, **settings)
+
+    @property
+    def ready(self):
+        return self.centroids is not None
+
+    def label(self, vector):
+        """Номер ближайшего центроида для одного нормированного вектора."""
+        return int(np.argmax(self.centroids @ vector))
+
+    def _assign_vectors(self, matrix, positions=None, chunk_size=65536):
+        """Номер ближайшего центроида для строк матрицы (по частям, чтобы не раздувать память)."""
+        count = len(matrix) if positions is None else len(positions)
+        labels = np.empty(count, dtype=np.int32)
+        for start in range(0, count, chunk_size):
+            if positions is None:
+                chunk = matrix[start:start + chunk_size]
+            else:
+                chunk = matrix[positions[start:start + chunk_size]]
+            labels[start:start + chunk_size] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return labels
+
+    def _rebuild_lists(self):
+        """Построение инвертированных списков по массиву назначений."""
+        self.lists = [[] for _ in range(len(self.centroids))]
+        for position, label in enumerate(self.assign.tolist()):
+            if label >= 0:
+                self.lists[label].append(position)
+
+    def build(self, matrix, alive):
+        """Обучение сферического k-means на выборке живых строк и назначение всех строк."""
+        rng = np.random.default_rng(self.seed)
+        positions = np.flatnonzero(alive[:len(matrix)])
+        nlist = min(self.nlist or max(1, int(4 * np.sqrt(len(positions)))), len(positions))
+        sample_idx = rng.choice(positions, size=min(len(positions), max(self.sample_size, nlist)), replace=False)
+        sample = np.asarray(matrix[np.sort(sample_idx)])
+
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            self.centroids = centroids
+            labels = self._assign_vectors(sample)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=nlist) == 0
+            # Пустые кластеры пересеваются случайными точками выборки
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        self.centroids = centroids
+
+        self.assign = np.full(len(matrix), -1, dtype=np.int32)
+        self.assign[positions] = self._assign_vectors(matrix, positions)
+        self._rebuild_lists()
+        np.save(self.index_path, self.centroids)
+        return positions
+
+    def load(self, matrix, labels, alive):
+        """Загрузка центроидов с диска.
+
+        labels — номера списков из entries.ann_list по строкам хранилища (-1 — нет назначения);
+        живые строки без назначения назначаются заново, их позиции возвращаются для записи в базу.
+        Возвращает None, если индекс на диске отсутствует или не подходит.
+        """
+        if not os.path.exists(self.index_path):
+            return None
+        try:
+            centroids = np.load(self.index_path)
+        except Exception as e:
+            print(f"Ошибка чтения ANN-индекса {self.index_path}: {e}")
+            return None
+        if centroids.ndim != 2 or centroids.shape[1] != matrix.shape[1]:
+            print(f"ANN-индекс {self.index_path} не совпадает по размерности, будет перестроен")
+            return None
+
+        self.centroids = centroids.astype(np.float32)
+        self.assign = np.asarray(labels, dtype=np.int32).copy()
+        self.assign[self.assign >= len(self.centroids)] = -1
+        self.assign[~alive[:len(self.assign)]] = -1
+        missing = np.flatnonzero(alive[:len(self.assign)] & (self.assign < 0))
+        if len(missing):
+            self.assign[missing] = self._assign_vectors(matrix, missing)
+        self._rebuild_lists()
+        return missing
+
+    def update(self, position, label):
+        """Инкрементальное назначение новой строки."""
+        if position >= len(self.assign):
+            grown = np.full(max(position + 1, len(self.assign) * 2), -1, dtype=np.int32)
+            grown[:len(self.assign)] = self.assign
+            self.assign = grown
+        self.assign[position] = label
+        self.lists[label].append(position)
+
+    def remove(self, position):
+        """Исключение строки из индекса (запись заменена или удалена)."""
+        if position < len(self.assign) and self.assign[position] >= 0:
+            self.lists[self.assign[position]].remove(position)
+            self.assign[position] = -1
+
+    def candidates(self, query, nprobe=None):
+        """Позиции строк из nprobe ближайших к запросу списков."""
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        centroid_scores = self.centroids @ query
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        lists = [self.lists[c] for c in probes if self.lists[c]]
+        if not lists:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.asarray(lst, dtype=np.int64) for lst in lists])
+
+
+def recall_report(db, nprobes=(1, 2, 4, 8, 16, 32, 64), num_queries=200, top_k=10, seed=0, nlist=None):
+    """Сравнение приближённого поиска с точным: recall@k, задержка и доля просмотренных строк.
+
+    Индекс с заданным nlist строится во временной директории: центроиды и назначения базы,
+    которыми пользуется приложение, не меняются. Запросами служат случайные строки базы с небольшим шумом.
+    """
+    db.load()
+    rng = np.random.default_rng(seed)
+    matrix = db.vectors()
+    alive_mask = db._alive[:len(matrix)]
+    alive = np.flatnonzero(alive_mask)
+    if not len(alive):
+        raise ValueError("В базе нет векторов")
+    sample = rng.choice(alive, size=min(num_queries, len(alive)), replace=False)
+    queries = db._normalize(matrix[np.sort(sample)] + rng.normal(scale=0.05, size=(len(sample), matrix.shape[1])).astype(np.float32))
+    k = min(top_k, len(alive))
+
+    exact, exact_time = [], 0.0
+    for query in queries:
+        start = time.perf_counter()
+        scores = matrix @ query
+        scores[~alive_mask] = -np.inf
+        exact.append(set(np.argpartition(-scores, k - 1)[:k].tolist()))
+        exact_time += time.perf_counter() - start
+
+    workdir = tempfile.mkdtemp(prefix="ivf_")
+    try:
+        index = IVFIndex(os.path.join(workdir, "ivf.npy"), nlist=nlist, min_rows=1, seed=seed)
+        started = time.perf_counter()
+        index.build(matrix, alive_mask)
+        build_seconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "db_path": db.db_path,
+        "rows": len(alive),
+        "nlist": len(index.centroids),
+        "top_k": top_k,
+        "queries": len(queries),
+        "build_seconds": build_seconds,
+        "exact_latency_ms": exact_time / len(queries) * 1000,
+        "settings": []
+    }
+    for nprobe in nprobes:
+        hits, elapsed, scanned = 0, 0.0, 0
+        for query, truth in zip(queries, exact):
+            start = time.perf_counter()
+            candidates = index.candidates(query, nprobe)
+            scores = matrix[candidates] @ query
+            found = candidates[np.argpartition(-scores, min(k, len(scores)) - 1)[:k]] if len(scores) else candidates
+            elapsed += time.perf_counter() - start
+            scanned += len(candidates)
+            hits += len(truth & set(found.tolist()))
+        report["settings"].append({
+            "nprobe": nprobe,
+            "recall": hits / max(1, sum(len(t) for t in exact)),
+            "latency_ms": elapsed / len(queries) * 1000,
+            "scanned_fraction": scanned / (len(queries) * len(alive))
+        })
+    return report
+
+
+def main(argv=None):
+    from core.database import Database
+
+    parser = argparse.ArgumentParser(description="Отчёт recall/задержка ANN-индекса относительно точного поиска")
+    parser.add_argument("db_path")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", default="1,2,4,8,16,32,64", help="Список значений nprobe через запятую")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--output", default=None, help="Путь для JSON-отчёта")
+    args = parser.parse_args(argv)
+
+    # База открывается без ANN-настроек: отчёт не строит и не перезаписывает её индекс
+    db = Database(args.db_path)
+    report = recall_report(db, [int(n) for n in args.nprobe.split(",")], args.queries, args.top_k, nlist=args.nlist)
+    print(f"Строк: {report['rows']}, списков: {report['nlist']}, точный поиск: {report['exact_latency_ms']:.2f} мс")
+    for row in report["settings"]:
+        print(f"nprobe={row['nprobe']:<4} recall@{args.top_k}={row['recall']:.3f}  "
+              f"{row['latency_ms']:.2f} мс  просмотрено {row['scanned_fraction']:.1%}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
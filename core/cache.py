@@ -1,30 +1,119 @@
 import os
-import hashlib
+import glob
+import time
+import sqlite3
+import threading
+import numpy as np
+from core.utils import file_hash
 
 class Cache:
-    """Система кэширования для хранения результатов обработки."""
-    
-    def __init__(self, cache_dir):
+    """Система кэширования для хранения результатов обработки.
+
+    Ключ записи — хэш содержимого файла, поэтому побайтно одинаковые файлы получают
+    один и тот же результат без повторной обработки; в вид записей с эмбеддингом входит
+    имя текстовой модели (embedding_kind). Подписи, транскрипции и эмбеддинги
+    лежат в одной таблице SQLite; при превышении бюджета вытесняются давно не читавшиеся записи.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
         self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
         os.makedirs(cache_dir, exist_ok=True)
-    
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "cache.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT,
+                    kind TEXT,
+                    text TEXT,
+                    embedding BLOB,
+                    size INTEGER,
+                    accessed REAL,
+                    PRIMARY KEY (key, kind)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON cache(accessed)")
+        self._import_legacy()
+        self._total = self._conn.execute("SELECT IFNULL(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def _import_legacy(self):
+        """Перенос подписей из файлов <md5>.txt старого формата кэша."""
+        legacy = glob.glob(os.path.join(self.cache_dir, "*.txt"))
+        if not legacy:
+            return
+        rows = []
+        for path in legacy:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            rows.append((os.path.splitext(os.path.basename(path))[0], "caption", text, None,
+                         len(text.encode("utf-8")), time.time()))
+        with self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO cache VALUES (?, ?, ?, ?, ?, ?)", rows)
+        for path in legacy:
+            os.remove(path)
+
+    @staticmethod
+    def embedding_kind(kind, model_name):
+        """Вид записи с эмбеддингом: эмбеддинги разных текстовых моделей хранятся раздельно."""
+        return f"{kind}:{model_name}"
+
     def get_cache_key(self, file_path):
-        """Генерация уникального ключа для файла."""
-        with open(file_path, "rb") as f:
-            return hashlib.md5(f.read()).hexdigest()
-    
-    def load(self, file_path):
+        """Генерация уникального ключа для файла (потоковое хэширование содержимого)."""
+        return file_hash(file_path)
+
+    def get(self, file_path, kind="caption"):
+        """Получение (text, embedding) из кэша; отсутствующие части возвращаются как None."""
+        key = self.get_cache_key(file_path)
+        with self._lock:
+            row = self._conn.execute("SELECT text, embedding FROM cache WHERE key = ? AND kind = ?", (key, kind)).fetchone()
+            if row is None:
+                return None, None
+            with self._conn:
+                self._conn.execute("UPDATE cache SET accessed = ? WHERE key = ? AND kind = ?", (time.time(), key, kind))
+        text, emb_bytes = row
+        embedding = np.frombuffer(emb_bytes, dtype=np.float32) if emb_bytes is not None else None
+        return text, embedding
+
+    def put(self, file_path, text=None, embedding=None, kind="caption"):
+        """Сохранение результата обработки файла."""
+        key = self.get_cache_key(file_path)
+        emb_bytes = np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None
+        size = len(text.encode("utf-8") if text else b"") + len(emb_bytes or b"")
+        with self._lock:
+            with self._conn:
+                old = self._conn.execute("SELECT size FROM cache WHERE key = ? AND kind = ?", (key, kind)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, kind, text, emb_bytes, size, time.time())
+                )
+            self._total += size - (old[0] if old else 0)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Вытеснение давно не читавшихся записей до 90% бюджета."""
+        target = self.max_bytes * 0.9
+        with self._conn:
+            while self._total > target:
+                rows = self._conn.execute("SELECT key, kind, size FROM cache ORDER BY accessed LIMIT 256").fetchall()
+                if not rows:
+                    self._total = 0
+                    break
+                evicted = []
+                for key, kind, size in rows:
+                    if self._total <= target:
+                        break
+                    evicted.append((key, kind))
+                    self._total -= size
+                self._conn.executemany("DELETE FROM cache WHERE key = ? AND kind = ?", evicted)
+
+    def load(self, file_path, kind="caption"):
         """Загрузка данных из кэша."""
-        cache_key = self.get_cache_key(file_path)
-        cache_path = os.path.join(self.cache_dir, f"{cache_key}.txt")
-        if os.path.exists(cache_path):
-            with open(cache_path, "r", encoding="utf-8") as f:
-                return f.read()
-        return None
-    
-    def save(self, file_path, data):
+        return self.get(file_path, kind)[0]
+
+    def save(self, file_path, data, kind="caption"):
         """Сохранение данных в кэш."""
-        cache_key = self.get_cache_key(file_path)
-        cache_path = os.path.join(self.cache_dir, f"{cache_key}.txt")
-        with open(cache_path, "w", encoding="utf-8") as f:
-            f.write(data)
\ No newline at end of file
+        self.put(file_path, text=data, kind=kind)
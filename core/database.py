@@ -1,54 +1,775 @@
+import os
+import time
 import sqlite3
+import threading
 import numpy as np
+from core import metrics
+from core.ann import IVFIndex
+from core.quantization import QuantizedVectors
+from core.vector_store import VectorStore
+from core.utils import file_signature, file_hash
+
+# Ограничение числа параметров в одном SQL-запросе (SQLITE_MAX_VARIABLE_NUMBER в старых сборках)
+SQL_CHUNK = 900
+# Как часто BatchWriter фиксирует завершённые файлы, даже если буфер не заполнен (секунды)
+CHECKPOINT_SECONDS = 10.0
 
 class Database:
-    """Управление базой данных для хранения описаний и эмбеддингов."""
-    
-    def __init__(self, db_path):
+    """Управление базой данных для хранения описаний и эмбеддингов.
+
+    Описания хранятся в SQLite, а нормированные эмбеддинги — в append-only файле
+    <база>_vectors.f32, на строки которого указывает колонка entries.emb_row.
+    Записи с одинаковым ключом содержимого (таблица embeddings) делят одну строку хранилища.
+    """
+
+    def __init__(self, db_path, ann=None, name=None, quantization=None):
         self.db_path = db_path
+        # Модальность базы (text, image, ...) — метка в метриках записи и поиска
+        self.name = name
+        # Одно долгоживущее соединение на базу; доступ из разных потоков сериализуется блокировкой
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
         self._init_db()
-    
+        dim = self._get_meta("dim")
+        self.store = VectorStore(f"{os.path.splitext(db_path)[0]}_vectors.f32", int(dim) if dim else None)
+        # Необязательный приближённый индекс (IVF), настройки берутся из Config.ANN_SETTINGS
+        self.ann = IVFIndex.from_settings(db_path, ann) if ann else None
+        # Необязательная квантованная копия векторов для первого прохода поиска (Config.QUANTIZATION_SETTINGS)
+        self.quantized = QuantizedVectors.from_settings(db_path, quantization, self.store.dim) if quantization else None
+        # Маска строк хранилища, на которые ссылаются записи (заменённые строки остаются в файле),
+        # и число ссылающихся записей на каждую строку
+        self._loaded = False
+        self._alive = np.zeros(0, dtype=bool)
+        self._refs = np.zeros(0, dtype=np.int32)
+        self._rows = 0
+        self._count = 0
+
     def _init_db(self):
-        """Инициализация таблицы в базе данных."""
-        with sqlite3.connect(self.db_path) as conn:
+        """Инициализация таблиц и настроек соединения."""
+        conn = self._conn
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-65536")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with conn:
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS entries (
                     path TEXT PRIMARY KEY,
                     description TEXT,
                     embedding BLOB,
-                    extra TEXT
+                    extra TEXT,
+                    ann_list INTEGER,
+                    emb_row INTEGER,
+                    source TEXT
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # Ключ содержимого (например, хэш модели и текста) -> строка хранилища
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, emb_row INTEGER)")
+            # Манифест проиндексированных файлов для инкрементальной переиндексации
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime REAL,
+                    hash TEXT
+                )
+            """)
+            # Журнал задач индексации: pending — ожидает или прерван, done — записан вместе с манифестом,
+            # failed — не удался (attempts попыток, последняя ошибка в error)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS journal (
+                    path TEXT PRIMARY KEY,
+                    directory TEXT,
+                    state TEXT,
+                    attempts INTEGER,
+                    error TEXT,
+                    updated REAL
                 )
             """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+            for column, column_type in (("ann_list", "INTEGER"), ("emb_row", "INTEGER"), ("source", "TEXT")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE entries ADD COLUMN {column} {column_type}")
+            if "source" not in columns:
+                # Старые записи текста имеют вид "файл#хэш", остальные модальности хранят путь к файлу
+                conn.execute("""
+                    UPDATE entries SET source = CASE WHEN instr(path, '#') > 0
+                        THEN substr(path, 1, instr(path, '#') - 1) ELSE path END
+                """)
             conn.execute("CREATE INDEX IF NOT EXISTS idx_path ON entries(path)")
-            conn.commit()
-    
+            # Составной индекс отдаёт записи строки хранилища уже упорядоченными по пути
+            conn.execute("DROP INDEX IF EXISTS idx_emb_row")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_emb_row_path ON entries(emb_row, path)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_source ON entries(source)")
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def close(self):
+        """Закрытие соединения с базой."""
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _normalize(vectors):
+        """L2-нормировка строк матрицы (нулевые векторы остаются нулевыми)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def vectors(self):
+        """Матрица всех строк хранилища (np.memmap, без копирования)."""
+        return self.store.matrix(self._rows)
+
+    def load(self):
+        """Подготовка к поиску: маска живых строк и ANN-индекс; сами векторы не читаются."""
+        with self._lock:
+            if self._loaded:
+                return
+            with metrics.stage("db_load", modality=self.name):
+                self._load()
+
+    def _load(self):
+        self.migrate_embeddings()
+        refs = np.array(
+            self._conn.execute("""
+                SELECT emb_row, MAX(IFNULL(ann_list, -1)), COUNT(*) FROM entries
+                WHERE emb_row IS NOT NULL GROUP BY emb_row
+            """).fetchall(),
+            dtype=np.int64
+        ).reshape(-1, 3)
+        self._rows = len(self.store)
+        self._sync_quantized(self._rows)
+        refs = refs[refs[:, 0] < self._rows]
+        self._refs = np.zeros(self._rows, dtype=np.int32)
+        self._refs[refs[:, 0]] = refs[:, 2]
+        self._alive = self._refs > 0
+        self._count = int(self._alive.sum())
+        self._loaded = True
+
+        if self.ann is not None and self._count:
+            labels = np.full(self._rows, -1, dtype=np.int32)
+            labels[refs[:, 0]] = refs[:, 1]
+            missing = self.ann.load(self.vectors(), labels, self._alive)
+            if missing is None:
+                if self._count >= self.ann.min_rows:
+                    self._build_ann()
+            elif len(missing):
+                self._store_ann_labels(missing)
+
+    def _sync_quantized(self, rows):
+        """Догон квантованной копии до rows строк хранилища (строки могли дописать без неё)."""
+        if self.quantized is None or len(self.quantized) >= rows:
+            return
+        with self._conn:
+            # Та же блокировка записи, что и при дописывании хранилища: процессы не дублируют строки копии
+            self._conn.execute("BEGIN IMMEDIATE")
+            with metrics.stage("quantize", items=rows - len(self.quantized), modality=self.name):
+                self.quantized.sync(self.store, rows)
+
+    def _build_ann(self):
+        """Обучение ANN-индекса по живым строкам и запись назначений в базу."""
+        positions = self.ann.build(self.vectors(), self._alive)
+        self._store_ann_labels(positions)
+
+    def _store_ann_labels(self, positions):
+        """Сохранение номеров IVF-списков для указанных строк хранилища."""
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE entries SET ann_list = ? WHERE emb_row = ?",
+                ((int(self.ann.assign[i]), int(i)) for i in positions)
+            )
+
+    def _emb_rows_for_paths(self, paths):
+        """Текущие строки хранилища для указанных путей."""
+        rows = []
+        for start in range(0, len(paths), SQL_CHUNK):
+            chunk = paths[start:start + SQL_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(row[0] for row in self._conn.execute(
+                f"SELECT emb_row FROM entries WHERE emb_row IS NOT NULL AND path IN ({placeholders})", chunk
+            ))
+        return rows
+
+    def _release_rows(self, positions):
+        """Снятие ссылок записей; строки без ссылок исключаются из поиска."""
+        for position in positions:
+            if position < len(self._refs) and self._refs[position] > 0:
+                self._refs[position] -= 1
+                if self._refs[position] == 0:
+                    self._alive[position] = False
+                    self._count -= 1
+                    if self.ann is not None and self.ann.ready:
+                        self.ann.remove(position)
+
+    def _reference_rows(self, positions, labels):
+        """Учёт новых ссылок на строки хранилища; labels — номера IVF-списков (None без индекса)."""
+        end = max(positions, default=-1) + 1
+        if end > len(self._alive):
+            size = max(end, len(self._alive) * 2)
+            self._alive = np.concatenate([self._alive, np.zeros(size - len(self._alive), dtype=bool)])
+            self._refs = np.concatenate([self._refs, np.zeros(size - len(self._refs), dtype=np.int32)])
+        self._rows = max(self._rows, end)
+        for position, label in zip(positions, labels):
+            if self._refs[position] == 0:
+                self._alive[position] = True
+                self._count += 1
+                if label is not None:
+                    self.ann.update(position, label)
+            self._refs[position] += 1
+        if self.ann is not None and not self.ann.ready and self._count >= self.ann.min_rows:
+            self._build_ann()
+
+    def _row_label(self, position):
+        """Номер IVF-списка уже записанной строки хранилища."""
+        if position < len(self.ann.assign) and self.ann.assign[position] >= 0:
+            return int(self.ann.assign[position])
+        return self.ann.label(self.store.get(position))
+
+    def lookup_embeddings(self, keys):
+        """Строки хранилища для известных ключей содержимого: {key: emb_row}."""
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), SQL_CHUNK):
+                chunk = keys[start:start + SQL_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(self._conn.execute(
+                    f"SELECT key, emb_row FROM embeddings WHERE key IN ({placeholders})", chunk
+                ))
+        return found
+
+    def add_entries(self, entries, files=()):
+        """Пакетное добавление записей одной транзакцией.
+
+        entries — кортежи (path, description, embedding, extra[, source[, key]]); source — исходный файл
+        записи (по умолчанию path), key — ключ содержимого: записи с уже известным ключом ссылаются
+        на существующую строку хранилища, и embedding для них может быть None. files — строки манифеста
+        (path, size, mtime, hash), которые фиксируются в той же транзакции.
+        """
+        with metrics.stage("db_write", items=0, modality=self.name) as stage:
+            # При повторе пути внутри пачки остаётся последняя запись
+            entries = [(entry + (None, None))[:6] for entry in entries]
+            # Векторы по ключам собираются до отбрасывания повторов, чтобы ссылки на ключ не потеряли вектор
+            key_vectors = {entry[5]: entry[2] for entry in entries if entry[5] is not None and entry[2] is not None}
+            entries = list({entry[0]: entry for entry in entries}.values())
+            stage.items = len(entries)
+            files = list(files)
+            if not entries and not files:
+                return
+            with self._lock:
+                if not entries:
+                    self.record_files(files)
+                    return
+                with_ann = self._loaded and self.ann is not None and self.ann.ready
+                with self._conn:
+                    # Блокировка записи берётся до дописывания файла, чтобы номера строк не пересекались между процессами
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    known = self.lookup_embeddings({entry[5] for entry in entries if entry[5] is not None})
+                    # Каждой записи сопоставляется существующая строка или индекс нового вектора в пачке
+                    new_vectors, new_keys, targets = [], {}, []
+                    for path, _, embedding, _, _, key in entries:
+                        if key in known:
+                            targets.append(("row", known[key]))
+                        elif key is not None and key in new_keys:
+                            targets.append(("new", new_keys[key]))
+                        elif embedding is None and key not in key_vectors:
+                            raise ValueError(f"Нет эмбеддинга для записи {path}")
+                        else:
+                            if key is not None:
+                                new_keys[key] = len(new_vectors)
+                            targets.append(("new", len(new_vectors)))
+                            new_vectors.append(embedding if embedding is not None else key_vectors[key])
+
+                    replaced = self._emb_rows_for_paths([entry[0] for entry in entries])
+                    start = None
+                    new_labels = []
+                    if new_vectors:
+                        vectors = self._normalize(new_vectors)
+                        if with_ann:
+                            new_labels = np.argmax(vectors @ self.ann.centroids.T, axis=1).tolist()
+                        if self.store.dim is None:
+                            self._set_meta("dim", vectors.shape[1])
+                        start = self.store.append(vectors)
+                        if self.quantized is not None:
+                            self.quantized.sync(self.store)
+                    rows, labels = [], []
+                    for kind, value in targets:
+                        if kind == "new":
+                            rows.append(start + value)
+                            labels.append(new_labels[value] if with_ann else None)
+                        else:
+                            rows.append(value)
+                            labels.append(self._row_label(value) if with_ann else None)
+                    self._conn.executemany(
+                        """INSERT OR REPLACE INTO entries (path, description, embedding, extra, ann_list, emb_row, source)
+                           VALUES (?, ?, NULL, ?, ?, ?, ?)""",
+                        ((path, desc, extra, label, row, source or path)
+                         for (path, desc, _, extra, source, _), row, label in zip(entries, rows, labels))
+                    )
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, emb_row) VALUES (?, ?)",
+                        ((key, start + index) for key, index in new_keys.items())
+                    )
+                    self._record_files(files)
+                if self._loaded:
+                    # Сначала новые ссылки, затем снятие старых: запись с прежним ключом не выпадает из поиска
+                    self._reference_rows(rows, labels)
+                    self._release_rows(replaced)
+
+    def get_manifest(self, directory=None):
+        """Манифест файлов {path: (size, mtime, hash)}, при необходимости только внутри directory."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path, size, mtime, hash FROM files").fetchall()
+        prefix = os.path.join(directory, "") if directory else ""
+        return {path: (size, mtime, file_hash) for path, size, mtime, file_hash in rows if path.startswith(prefix)}
+
+    def get_sources(self):
+        """Исходные файлы всех записей базы, включая записанные до появления манифеста.
+
+        Просматривает все записи, поэтому предназначен для разовой миграции, а не для каждого запроса.
+        """
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT source FROM entries WHERE source IS NOT NULL")]
+
+    def _record_files(self, files):
+        # Файл отмечается в журнале выполненным в той же транзакции, что и его записи
+        self._conn.executemany("INSERT OR REPLACE INTO files (path, size, mtime, hash) VALUES (?, ?, ?, ?)", files)
+        self._conn.executemany(
+            "UPDATE journal SET state = 'done', error = NULL, updated = ? WHERE path = ?",
+            ((time.time(), row[0]) for row in files)
+        )
+
+    def record_files(self, files):
+        """Запись строк манифеста (path, size, mtime, hash)."""
+        with self._lock, self._conn:
+            self._record_files(files)
+
+    def journal_start(self, directory, files):
+        """Новый журнал индексации директории: все files в состоянии pending.
+
+        Записи файлов, не завершённых прошлым запуском (pending или failed), удаляются:
+        частично записанные результаты прерванного файла не смешиваются с новыми.
+        Возвращает список таких файлов.
+        """
+        files = list(files)
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                interrupted = [row[0] for row in self._conn.execute(
+                    "SELECT path FROM journal WHERE directory = ? AND state != 'done'", (directory,)
+                )]
+                self._conn.execute("DELETE FROM journal WHERE directory = ?", (directory,))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO journal VALUES (?, ?, 'pending', 0, NULL, ?)",
+                    ((path, directory, now) for path in files)
+                )
+            self.delete_sources(interrupted)
+        return interrupted
+
+    def journal_fail(self, path, error):
+        """Отметка неудачной попытки; возвращает число попыток файла."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE journal SET state = 'failed', attempts = attempts + 1, error = ?, updated = ? WHERE path = ?",
+                (error, time.time(), path)
+            )
+            row = self._conn.execute("SELECT attempts FROM journal WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else 1
+
+    def journal_done(self, paths):
+        """Файлы из paths, отмеченные в журнале как выполненные."""
+        paths = list(paths)
+        done = set()
+        with self._lock:
+            for start in range(0, len(paths), SQL_CHUNK):
+                chunk = paths[start:start + SQL_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                done.update(row[0] for row in self._conn.execute(
+                    f"SELECT path FROM journal WHERE state = 'done' AND path IN ({placeholders})", chunk
+                ))
+        return done
+
+    def journal_status(self, directory=None):
+        """Число файлов журнала по состояниям и список неудавшихся [(path, attempts, error)]."""
+        where, params = ("WHERE directory = ?", (directory,)) if directory else ("", ())
+        with self._lock:
+            counts = dict(self._conn.execute(f"SELECT state, COUNT(*) FROM journal {where} GROUP BY state", params))
+            failed = self._conn.execute(
+                f"SELECT path, attempts, error FROM journal {where} {'AND' if where else 'WHERE'} state = 'failed'",
+                params
+            ).fetchall()
+        return {state: counts.get(state, 0) for state in ("pending", "done", "failed")}, failed
+
+    def delete_sources(self, sources):
+        """Удаление всех записей и строк манифеста для указанных исходных файлов."""
+        sources = list(sources)
+        if not sources:
+            return
+        with metrics.stage("db_delete", items=len(sources), modality=self.name):
+            with self._lock:
+                released = []
+                with self._conn:
+                    for start in range(0, len(sources), SQL_CHUNK):
+                        chunk = sources[start:start + SQL_CHUNK]
+                        placeholders = ",".join("?" * len(chunk))
+                        released.extend(row[0] for row in self._conn.execute(
+                            f"SELECT emb_row FROM entries WHERE emb_row IS NOT NULL AND source IN ({placeholders})", chunk
+                        ))
+                        self._conn.execute(f"DELETE FROM entries WHERE source IN ({placeholders})", chunk)
+                        self._conn.execute(f"DELETE FROM files WHERE path IN ({placeholders})", chunk)
+                if self._loaded:
+                    self._release_rows(released)
+
     def add_entry(self, path, description, embedding, extra=None):
         """Добавление записи в базу данных."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                "INSERT OR REPLACE INTO entries (path, description, embedding, extra) VALUES (?, ?, ?, ?)",
-                (path, description, embedding.tobytes(), extra)
-            )
-            conn.commit()
-    
+        self.add_entries([(path, description, embedding, extra)])
+
     def get_entry(self, path):
-        """Получение записи по пути."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("SELECT description, embedding, extra FROM entries WHERE path = ?", (path,))
-            result = cursor.fetchone()
-            if result:
-                desc, emb_bytes, extra = result
+        """Получение записи по пути (эмбеддинг возвращается нормированным)."""
+        with self._lock:
+            result = self._conn.execute(
+                "SELECT description, emb_row, embedding, extra FROM entries WHERE path = ?", (path,)
+            ).fetchone()
+            if not result:
+                return None, None, None
+            desc, emb_row, emb_bytes, extra = result
+            if emb_row is not None:
+                embedding = self.store.get(emb_row)
+            else:
                 embedding = np.frombuffer(emb_bytes, dtype=np.float32)
-                return desc, embedding, extra
-            return None, None, None
-    
-    def search(self, query_embedding, top_k=5):
-        """Поиск по эмбеддингу с возвратом топ-N результатов."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("SELECT path, description, embedding, extra FROM entries")
-            results = []
-            for path, desc, emb_bytes, extra in cursor.fetchall():
-                emb = np.frombuffer(emb_bytes, dtype=np.float32)
-                similarity = np.dot(query_embedding, emb) / (np.linalg.norm(query_embedding) * np.linalg.norm(emb))
-                results.append((path, desc, similarity, extra))
-            return sorted(results, key=lambda x: x[2], reverse=True)[:top_k]
\ No newline at end of file
+        return desc, embedding, extra
+
+    def iter_entries(self, batch_size=1000):
+        """Обход всех записей пачками списков (path, description, extra, source) без эмбеддингов."""
+        last = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT path, description, extra, source FROM entries WHERE path > ? ORDER BY path LIMIT ?",
+                    (last, batch_size)
+                ).fetchall()
+            if not rows:
+                break
+            yield rows
+            last = rows[-1][0]
+
+    def _fetch_rows(self, emb_rows, scores, limit=None):
+        """Записи для найденных строк хранилища в порядке убывания сходства (не больше limit).
+
+        Строку хранилища могут разделять тысячи записей с одинаковым текстом, поэтому
+        для каждой читается не больше недостающего до limit числа записей (по индексу
+        (emb_row, path) без сортировки), а после заполнения limit чтение прекращается.
+        """
+        results = []
+        with self._lock:
+            for emb_row, score in zip(emb_rows.tolist(), scores.tolist()):
+                remaining = -1 if limit is None else limit - len(results)
+                if remaining == 0:
+                    break
+                for path, desc, extra in self._conn.execute(
+                    "SELECT path, description, extra FROM entries WHERE emb_row = ? ORDER BY path LIMIT ?",
+                    (int(emb_row), remaining)
+                ):
+                    results.append((path, desc, score, extra))
+        return results
+
+    def search(self, query_embedding, top_k=5, exact=False, nprobe=None):
+        """Поиск по эмбеддингу с возвратом топ-N результатов.
+
+        При построенном ANN-индексе просматриваются только nprobe ближайших списков, при
+        квантованной копии кандидаты отбираются по ней и пересчитываются по float32;
+        exact=True принудительно включает полный перебор float32.
+        """
+        with metrics.stage("search", modality=self.name):
+            query = self._normalize(query_embedding)
+            # Под блокировкой берётся только снимок состояния, сам перебор идёт без неё
+            with self._lock:
+                self.load()
+                matrix = self.vectors()
+                alive = self._alive[:len(matrix)]
+                candidates = None
+                quantized = self.quantized if not exact else None
+                if quantized is not None:
+                    self._sync_quantized(len(matrix))
+                if self._count and not exact and self.ann is not None and self.ann.ready:
+                    candidates = self.ann.candidates(query, nprobe)
+                    if len(candidates) < top_k:
+                        candidates = None
+            if top_k <= 0 or not alive.any():
+                return []
+
+            if quantized is not None:
+                candidates, scores = quantized.shortlist(query, matrix, alive, candidates, top_k)
+            elif candidates is None:
+                scores = matrix @ query
+                scores[~alive] = -np.inf
+                candidates = np.arange(len(matrix))
+            else:
+                scores = matrix[candidates] @ query
+
+            if not len(scores):
+                return []
+            k = min(top_k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            top = top[np.isfinite(scores[top])]
+            return self._fetch_rows(candidates[top], scores[top], top_k)
+
+    def score_entries(self, query_embedding, paths=None, sources=None):
+        """Сходство запроса только с записями из списка путей или исходных файлов, без перебора базы.
+
+        Записи находятся по индексам path и source, поэтому стоимость пропорциональна их числу.
+        Возвращает [(path, description, score, extra, source)] по убыванию score.
+        """
+        column, values = ("path", paths) if paths is not None else ("source", sources)
+        values = list(values or ())
+        if not values:
+            return []
+        with metrics.stage("score_entries", items=0, modality=self.name) as stage:
+            query = self._normalize(query_embedding)
+            rows = []
+            with self._lock:
+                self.load()
+                matrix = self.vectors()
+                for start in range(0, len(values), SQL_CHUNK):
+                    chunk = values[start:start + SQL_CHUNK]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows.extend(self._conn.execute(
+                        f"""SELECT path, description, extra, source, emb_row FROM entries
+                            WHERE emb_row IS NOT NULL AND {column} IN ({placeholders})""",
+                        chunk
+                    ))
+            rows = [row for row in rows if row[4] < len(matrix)]
+            stage.items = len(rows)
+            if not rows:
+                return []
+            emb_rows = np.array([row[4] for row in rows], dtype=np.int64)
+            # Строки хранилища читаются по возрастанию номера
+            order = np.argsort(emb_rows)
+            scores = np.empty(len(rows), dtype=np.float32)
+            scores[order] = matrix[emb_rows[order]] @ query
+            results = [(path, desc, float(score), extra, source)
+                       for (path, desc, extra, source, _), score in zip(rows, scores)]
+        results.sort(key=lambda result: result[2], reverse=True)
+        return results
+
+    def source_vectors(self, source):
+        """Записи одного исходного файла: список (path, description, extra) и матрица их векторов."""
+        with self._lock:
+            self.load()
+            rows = self._conn.execute(
+                "SELECT path, description, extra, emb_row FROM entries WHERE emb_row IS NOT NULL AND source = ? ORDER BY path",
+                (source,)
+            ).fetchall()
+            matrix = self.vectors()
+            rows = [row for row in rows if row[3] < len(matrix)]
+            vectors = np.array(matrix[[row[3] for row in rows]]) if rows else np.empty((0, matrix.shape[1]), dtype=np.float32)
+        return [row[:3] for row in rows], vectors
+
+    def score_stats(self, query_embedding, sample_size=256, seed=0):
+        """Среднее и стандартное отклонение сходства запроса со случайной выборкой записей базы.
+
+        Служит для калибровки оценок разных баз; None для пустой базы.
+        """
+        query = self._normalize(query_embedding)
+        with self._lock:
+            self.load()
+            matrix = self.vectors()
+            positions = np.flatnonzero(self._alive[:len(matrix)])
+        if not len(positions):
+            return None
+        if len(positions) > sample_size:
+            positions = np.sort(np.random.default_rng(seed).choice(positions, size=sample_size, replace=False))
+        scores = matrix[positions] @ query
+        return float(scores.mean()), float(scores.std())
+
+    def migrate_embeddings(self, batch_size=10000):
+        """Перенос эмбеддингов из BLOB-колонки (старый формат) в хранилище векторов."""
+        migrated = 0
+        with self._lock:
+            while True:
+                rows = self._conn.execute(
+                    "SELECT rowid, path, embedding FROM entries WHERE emb_row IS NULL AND embedding IS NOT NULL LIMIT ?",
+                    (batch_size,)
+                ).fetchall()
+                if not rows:
+                    break
+                if self.store.dim is None:
+                    self.store.dim = len(rows[0][2]) // np.dtype(np.float32).itemsize
+                valid, invalid = [], []
+                for rowid, path, blob in rows:
+                    if len(blob) == self.store.row_bytes:
+                        valid.append((rowid, blob))
+                    else:
+                        print(f"Пропущена запись с некорректным эмбеддингом: {path}")
+                        invalid.append((rowid,))
+                with self._conn:
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    self._set_meta("dim", self.store.dim)
+                    if valid:
+                        matrix = np.frombuffer(b"".join(blob for _, blob in valid), dtype=np.float32)
+                        start = self.store.append(self._normalize(matrix.reshape(len(valid), -1)))
+                        self._conn.executemany(
+                            "UPDATE entries SET emb_row = ?, embedding = NULL, ann_list = NULL WHERE rowid = ?",
+                            ((start + i, rowid) for i, (rowid, _) in enumerate(valid))
+                        )
+                    self._conn.executemany("UPDATE entries SET embedding = NULL WHERE rowid = ?", invalid)
+                migrated += len(valid)
+        if migrated:
+            print(f"Эмбеддинги перенесены в {self.store.path}: {migrated}")
+        return migrated
+
+    def compact(self, batch_size=65536):
+        """Перезапись хранилища без строк, на которые больше не ссылаются записи.
+
+        Выполняется, когда с базой не работают другие процессы.
+        """
+        with self._lock:
+            self.migrate_embeddings()
+            live = np.array(
+                [row[0] for row in self._conn.execute(
+                    "SELECT DISTINCT emb_row FROM entries WHERE emb_row IS NOT NULL ORDER BY emb_row"
+                )],
+                dtype=np.int64
+            )
+            old_rows = len(self.store)
+            if len(live) == old_rows:
+                return 0
+            tmp_store = VectorStore(f"{self.store.path}.tmp", self.store.dim)
+            if os.path.exists(tmp_store.path):
+                os.remove(tmp_store.path)
+            matrix = self.store.matrix()
+            for start in range(0, len(live), batch_size):
+                tmp_store.append(matrix[live[start:start + batch_size]])
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                # Отрицательные номера исключают пересечение старой и новой нумерации
+                self._conn.executemany(
+                    "UPDATE entries SET emb_row = ? WHERE emb_row = ?",
+                    ((-new - 1, int(old)) for new, old in enumerate(live))
+                )
+                self._conn.execute("UPDATE entries SET emb_row = -emb_row - 1 WHERE emb_row < 0")
+                self._conn.executemany(
+                    "UPDATE embeddings SET emb_row = ? WHERE emb_row = ?",
+                    ((-new - 1, int(old)) for new, old in enumerate(live))
+                )
+                self._conn.execute("DELETE FROM embeddings WHERE emb_row >= 0")
+                self._conn.execute("UPDATE embeddings SET emb_row = -emb_row - 1")
+                del matrix
+                self.store.release()
+                os.replace(tmp_store.path, self.store.path)
+                if self.quantized is not None:
+                    # Нумерация строк изменилась: копия строится заново при загрузке
+                    self.quantized.reset()
+            self._loaded = False
+            self.load()
+            return old_rows - len(live)
+
+
+class BatchWriter:
+    """Буфер записей, сбрасываемый в базу пачками в одной транзакции.
+
+    Записи файла попадают в базу вместе с его строкой манифеста только после add_file,
+    поэтому прерванная обработка не оставляет в базе половину файла. Завершённые файлы
+    фиксируются при заполнении буфера (flush_size записей) и не реже раза в checkpoint_seconds.
+    Если незавершённый файл накопил больше spill_size записей (очень большой документ),
+    они пишутся заранее без манифеста; при сбое их удаляет журнал индексации.
+    """
+
+    def __init__(self, db, flush_size=500, checkpoint_seconds=CHECKPOINT_SECONDS, spill_size=None):
+        self.db = db
+        self.flush_size = flush_size
+        self.checkpoint_seconds = checkpoint_seconds
+        self.spill_size = spill_size or flush_size * 16
+        self._rows = []
+        self._files = []
+        self._complete = set()
+        self._keys = set()
+        self._errors = {}
+        self._last_write = time.monotonic()
+        self._lock = threading.Lock()
+
+    def known_keys(self, keys):
+        """Ключи, для которых эмбеддинг уже есть в базе или в буфере."""
+        keys = set(keys)
+        with self._lock:
+            buffered = keys & self._keys
+        return buffered | set(self.db.lookup_embeddings(keys - buffered))
+
+    def add(self, path, description, embedding, extra=None, source=None, key=None):
+        """Добавление записи в буфер; при заполнении буфера фиксируются завершённые файлы.
+
+        key — ключ содержимого; для ключа, уже известного базе или буферу, embedding может быть None.
+        """
+        with self._lock:
+            self._rows.append((path, description, embedding, extra, source or path, key))
+            if key is not None and embedding is not None:
+                self._keys.add(key)
+            if len(self._rows) >= self.spill_size:
+                rows, files = self._take(spill=True)
+            elif len(self._rows) >= self.flush_size and self._complete:
+                rows, files = self._take()
+            else:
+                return
+        self.db.add_entries(rows, files)
+
+    def add_file(self, file_path):
+        """Отметка файла как проиндексированного; попадает в манифест вместе с его записями."""
+        size, mtime = file_signature(file_path)
+        with self._lock:
+            self._files.append((file_path, size, mtime, file_hash(file_path)))
+            self._complete.add(file_path)
+            if len(self._rows) < self.flush_size and time.monotonic() - self._last_write < self.checkpoint_seconds:
+                return
+            rows, files = self._take()
+        self.db.add_entries(rows, files)
+
+    def fail_file(self, file_path, error):
+        """Отметка ошибки обработки файла, которую процессор перехватил, чтобы продолжить пачку."""
+        with self._lock:
+            self._errors[file_path] = error
+
+    def take_errors(self, files):
+        """Ошибки файлов из files, отмеченные fail_file: {файл: исключение}; отметки снимаются."""
+        with self._lock:
+            return {path: self._errors.pop(path) for path in files if path in self._errors}
+
+    def flush(self):
+        """Запись всех завершённых файлов; записи ещё обрабатываемых файлов остаются в буфере."""
+        with self._lock:
+            rows, files = self._take()
+        self.db.add_entries(rows, files)
+
+    def discard_incomplete(self):
+        """Удаление из буфера записей незавершённых файлов; возвращает их исходные файлы."""
+        with self._lock:
+            dropped = {row[4] for row in self._rows if row[4] not in self._complete}
+            self._rows = self._with_vectors([row for row in self._rows if row[4] in self._complete])
+            self._keys = {row[5] for row in self._rows if row[5] is not None and row[2] is not None}
+        return sorted(dropped)
+
+    def _with_vectors(self, rows):
+        # Вектор ключа мог остаться у записи другого файла: ссылкам на ключ он передаётся явно
+        vectors = {row[5]: row[2] for row in self._rows if row[5] is not None and row[2] is not None}
+        return [row[:2] + (vectors.get(row[5]),) + row[3:] if row[2] is None and row[5] is not None else row
+                for row in rows]
+
+    def _take(self, spill=False):
+        """Извлечение из буфера записей завершённых файлов (при spill — всех) и их строк манифеста (под self._lock)."""
+        if spill:
+            rows, kept = self._with_vectors(self._rows), []
+        else:
+            rows = self._with_vectors([row for row in self._rows if row[4] in self._complete])
+            kept = self._with_vectors([row for row in self._rows if row[4] not in self._complete])
+        files = self._files
+        self._rows, self._files, self._complete = kept, [], set()
+        self._keys = {row[5] for row in kept if row[5] is not None and row[2] is not None}
+        self._last_write = time.monotonic()
+        return rows, files
@@ -0,0 +1,159 @@
+import os
+import zipfile
+import subprocess
+import xml.etree.ElementTree as ET
+
+# Размер блока чтения текстовых файлов (байты) и предельная длина одного фрагмента (символы)
+CHUNK_BYTES = 1 << 20
+MAX_SEGMENT_CHARS = 10000
+
+DOCX_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+ODF_TEXT_NS = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+
+def _split_long(segment, max_chars=MAX_SEGMENT_CHARS):
+    """Разбиение слишком длинного фрагмента на части фиксированной длины."""
+    for start in range(0, len(segment), max_chars):
+        yield segment[start:start + max_chars]
+
+def _line_segments(raw, offset, encoding):
+    """Фрагменты одной строки без краевых пробелов с байтовыми смещениями."""
+    text = raw.decode(encoding)
+    stripped = text.strip()
+    if not stripped:
+        return
+    start = offset + len(text[:len(text) - len(text.lstrip())].encode(encoding))
+    for piece in _split_long(stripped):
+        end = start + len(piece.encode(encoding))
+        yield piece, start, end
+        start = end
+
+def iter_lines(path, chunk_bytes=CHUNK_BYTES, encoding="utf-8"):
+    """Непустые строки текстового файла в виде (текст, начало, конец) — смещения в байтах.
+
+    Файл читается блоками фиксированного размера, поэтому память не зависит от его длины.
+    """
+    with open(path, "rb") as f:
+        offset = 0
+        tail = b""
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                break
+            lines = (tail + chunk).split(b"\n")
+            tail = lines.pop()
+            for line in lines:
+                yield from _line_segments(line, offset, encoding)
+                offset += len(line) + 1
+        if tail:
+            yield from _line_segments(tail, offset, encoding)
+
+def iter_plain(path):
+    """Строки текстового файла (TXT, CSV)."""
+    for text, _, _ in iter_lines(path):
+        yield text
+
+def iter_pdf(path):
+    """Абзацы PDF постранично: вывод pdftotext (poppler) читается потоком, страницы разделены \\f."""
+    process = subprocess.Popen(["pdftotext", "-enc", "UTF-8", path, "-"],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        paragraph = []
+        for raw in process.stdout:
+            for part in raw.decode("utf-8", errors="replace").split("\f"):
+                line = part.strip()
+                if line:
+                    paragraph.append(line)
+                    continue
+                if paragraph:
+                    yield from _split_long(" ".join(paragraph))
+                    paragraph = []
+        if paragraph:
+            yield from _split_long(" ".join(paragraph))
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise OSError(f"pdftotext завершился с кодом {process.returncode}")
+
+# Пустые элементы-разделители внутри абзаца: itertext() их не видит, и соседние слова склеиваются
+DOCX_BREAKS = {f"{DOCX_NS}tab": " ", f"{DOCX_NS}br": "\n", f"{DOCX_NS}cr": "\n"}
+ODF_BREAKS = {f"{ODF_TEXT_NS}tab": " ", f"{ODF_TEXT_NS}line-break": "\n", f"{ODF_TEXT_NS}s": " "}
+
+def _element_text(elem, breaks):
+    """Текст элемента, в котором разделители из breaks заменены пробелом или переводом строки."""
+    parts = []
+
+    def walk(node):
+        separator = breaks.get(node.tag)
+        if separator is not None:
+            # text:s хранит число подряд идущих пробелов в атрибуте text:c
+            parts.append(separator * int(node.get(f"{ODF_TEXT_NS}c", 1)) if separator == " " else separator)
+        elif node.text:
+            parts.append(node.text)
+        for child in node:
+            walk(child)
+            if child.tail:
+                parts.append(child.tail)
+
+    walk(elem)
+    return "".join(parts)
+
+def _iter_xml_paragraphs(path, member, tags, breaks):
+    """Текст элементов-абзацев XML внутри zip-контейнера без построения всего дерева."""
+    with zipfile.ZipFile(path) as archive, archive.open(member) as xml:
+        for _, elem in ET.iterparse(xml, events=("end",)):
+            if elem.tag in tags:
+                yield from _split_long(_element_text(elem, breaks))
+                elem.clear()
+
+def iter_docx(path):
+    """Абзацы DOCX."""
+    return _iter_xml_paragraphs(path, "word/document.xml", {f"{DOCX_NS}p"}, DOCX_BREAKS)
+
+def iter_odt(path):
+    """Абзацы и заголовки ODT."""
+    return _iter_xml_paragraphs(path, "content.xml", {f"{ODF_TEXT_NS}p", f"{ODF_TEXT_NS}h"}, ODF_BREAKS)
+
+# Форматы, которые читаются напрямую; для остальных извлечённый текст хранится в отдельном файле
+PLAIN_EXTENSIONS = {".txt", ".csv"}
+
+# Извлекатели по расширению; новые форматы добавляются через register_extractor
+EXTRACTORS = {
+    ".txt": iter_plain,
+    ".csv": iter_plain,
+    ".pdf": iter_pdf,
+    ".docx": iter_docx,
+    ".odt": iter_odt,
+}
+
+def register_extractor(extension, extractor):
+    """Регистрация извлекателя: функция path -> итератор текстовых фрагментов."""
+    EXTRACTORS[extension.lower()] = extractor
+
+def iter_segments(path):
+    """Непустые текстовые фрагменты файла по мере извлечения."""
+    extractor = EXTRACTORS.get(os.path.splitext(path)[1].lower(), iter_plain)
+    for segment in extractor(path):
+        segment = segment.strip()
+        if segment:
+            yield segment
+
+def is_plain(path):
+    """Читается ли файл напрямую (смещения фрагментов указывают в сам файл)."""
+    return os.path.splitext(path)[1].lower() in PLAIN_EXTENSIONS
+
+def extract_to_file(path, output_path):
+    """Извлечение текста в отдельный файл по одному фрагменту на строку (в т.ч. в рабочих процессах).
+
+    Возвращает output_path; при ошибке недописанный файл удаляется, а исключение передаётся
+    вызывающему, чтобы журнал индексации сохранил его текст.
+    """
+    try:
+        with open(output_path, "w", encoding="utf-8") as out:
+            for segment in iter_segments(path):
+                out.write(segment.replace("\r", " ").replace("\n", " "))
+                out.write("\n")
+        return output_path
+    except Exception:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
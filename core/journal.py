@@ -0,0 +1,105 @@
+import os
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+
+# Попыток на файл за один запуск и задержка перед первым повтором (далее удваивается), секунды
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 5.0
+# Ошибки содержимого файла (неверная кодировка — UnicodeDecodeError, повреждённый DOCX/ODT):
+# повтор даст тот же результат, поэтому файл пропускается сразу
+PERMANENT_ERRORS = (ValueError, zipfile.BadZipFile, ET.ParseError)
+
+class JournaledIndex:
+    """Возобновляемая индексация директории с журналом файлов в базе процессора.
+
+    Журнал (таблица journal) хранит состояние каждого файла: pending, done или failed.
+    Файл становится done в той же транзакции, что и его записи с манифестом, поэтому после
+    сбоя перезапуск продолжает с невыполненных файлов, а их частично записанные результаты
+    удаляются. Ошибка файла не прерывает запуск: файл повторяется позже с растущей задержкой,
+    пока не исчерпает max_attempts попыток; при ошибке содержимого (PERMANENT_ERRORS) — сразу
+    пропускается. Процессор, перехвативший ошибку файла сам, передаёт её через writer.fail_file.
+    """
+
+    def __init__(self, processor, directory, extensions=None, max_attempts=MAX_ATTEMPTS, backoff=RETRY_BACKOFF):
+        self.processor = processor
+        self.db = processor.db
+        self.directory = directory
+        self.extensions = extensions
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def plan(self):
+        """Новые, изменённые и не завершённые прошлым запуском файлы; журнал начинается заново."""
+        files = self.processor.plan_index(self.directory, self.extensions)
+        interrupted = self.db.journal_start(self.directory, files)
+        if interrupted:
+            print(f"Возобновление индексации: незавершённых файлов прошлого запуска {len(interrupted)}")
+        return files
+
+    def run_chunk(self, files, prepared=None):
+        """Обработка пачки файлов с фиксацией завершённых.
+
+        Возвращает (выполненные, [(файл, время следующей попытки)], окончательно не удавшиеся).
+        """
+        error = None
+        try:
+            if prepared is None:
+                self.processor.process_files(files)
+            else:
+                self.processor.process_files(files, prepared=prepared)
+        except Exception as e:
+            error = e
+        self.processor.writer.flush()
+        self.processor.writer.discard_incomplete()
+        errors = self.processor.writer.take_errors(files)
+        done = self.db.journal_done(files)
+        failed = [path for path in files if path not in done]
+        if error is not None and len(failed) > 1:
+            # Неизвестно, на каком файле упала пачка: оставшиеся обрабатываются по одному
+            print(f"Ошибка обработки пачки ({error}), файлы повторяются по одному")
+            results = [self.run_chunk([path]) for path in failed]
+            return ([path for path in files if path in done] + [path for result in results for path in result[0]],
+                    [item for result in results for item in result[1]],
+                    [path for result in results for path in result[2]])
+        retries, exhausted = [], []
+        if failed:
+            # Записи, успевшие попасть в базу до ошибки, удаляются вместе с файлом
+            self.db.delete_sources(failed)
+        for path in failed:
+            file_error = errors.get(path, error)
+            message = str(file_error) if file_error is not None else "файл не обработан"
+            attempts = self.db.journal_fail(path, message)
+            if attempts < self.max_attempts and os.path.exists(path) and not isinstance(file_error, PERMANENT_ERRORS):
+                retries.append((path, time.time() + self.backoff * 2 ** (attempts - 1)))
+            else:
+                print(f"Файл пропущен после {attempts} попыток: {path} ({message})")
+                exhausted.append(path)
+        return [path for path in files if path in done], retries, exhausted
+
+    def run(self, chunk_size=32, progress=None):
+        """Полный запуск: пачки файлов, затем повторы неудавшихся по мере истечения задержек.
+
+        progress(выполнено, не удалось, всего) вызывается после каждой пачки.
+        Возвращает (число выполненных, список окончательно не удавшихся файлов).
+        """
+        files = self.plan()
+        done, failed, retries = 0, [], []
+        for start in range(0, len(files), chunk_size):
+            completed, retry, exhausted = self.run_chunk(files[start:start + chunk_size])
+            done += len(completed)
+            failed += exhausted
+            retries += retry
+            if progress:
+                progress(done, len(failed), len(files))
+        while retries:
+            retries.sort(key=lambda item: item[1])
+            path, retry_at = retries.pop(0)
+            time.sleep(max(0.0, retry_at - time.time()))
+            completed, retry, exhausted = self.run_chunk([path])
+            done += len(completed)
+            failed += exhausted
+            retries += retry
+            if progress:
+                progress(done, len(failed), len(files))
+        return done, failed
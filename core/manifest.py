@@ -0,0 +1,43 @@
+import os
+from core import metrics
+from core.utils import file_signature, file_hash
+
+def select_changed_files(db, directory, files):
+    """Отбор файлов для (пере)индексации по манифесту базы.
+
+    Файлы с прежними размером и mtime пропускаются без чтения; при изменившемся mtime
+    сравнивается хэш содержимого. Записи новых (отсутствующих в манифесте) и изменённых файлов
+    и файлов, которых больше нет на диске, удаляются из базы, после чего возвращается список новых и изменённых файлов.
+    Пока манифест директории пуст (база без манифеста), удалённые файлы ищутся по исходным файлам записей.
+    """
+    with metrics.stage("manifest", items=len(files)):
+        manifest = db.get_manifest(directory)
+        changed, stale, touched = [], [], []
+        for path in files:
+            size, mtime = file_signature(path)
+            known = manifest.get(path)
+            if known is None:
+                # Записи могли остаться от базы без манифеста: они удаляются, чтобы не задвоиться
+                stale.append(path)
+                changed.append(path)
+                continue
+            known_size, known_mtime, known_hash = known
+            if size == known_size and mtime == known_mtime:
+                continue
+            if size == known_size and file_hash(path) == known_hash:
+                touched.append((path, size, mtime, known_hash))
+                continue
+            stale.append(path)
+            changed.append(path)
+
+        current = set(files)
+        known = manifest
+        if not manifest:
+            # Первый запуск на базе старого формата: записи удалённых файлов иначе остались бы навсегда
+            prefix = os.path.join(directory, "")
+            known = [source for source in db.get_sources() if source.startswith(prefix)]
+        removed = [path for path in known if path not in current and not os.path.exists(path)]
+        db.delete_sources(stale + removed)
+        db.record_files(touched)
+        print(f"Новых и изменённых файлов: {len(changed)}, без изменений: {len(files) - len(changed)}, удалено: {len(removed)}")
+        return changed
@@ -0,0 +1,319 @@
+"""Реестр метрик: счётчики и гистограммы задержек по стадиям индексации и поиска.
+
+Стадии (scan, manifest, decode, extract, caption, transcribe, encode, db_write, search и др.)
+замеряются через stage(); по их сумме видно, чем ограничен запуск — диском, моделью или SQLite.
+Снимок выгружается в JSON или в текстовый формат Prometheus (write), для глубокого разбора
+есть profile(): cProfile или выборка стеков всех потоков в формате collapsed (как у py-spy).
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import cProfile
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+PREFIX = "semantic_search"
+# Границы корзин гистограмм задержек, секунды
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами, как в Prometheus."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (верхняя граница корзины)."""
+        if not self.count:
+            return None
+        target, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def cumulative(self):
+        """Накопленные счётчики по границам корзин (le)."""
+        result, seen = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            result.append((bound, seen))
+        return result
+
+
+class Stage:
+    """Результат замера стадии; items можно уточнить внутри блока with."""
+
+    def __init__(self, items):
+        self.items = items
+        self.seconds = 0.0
+
+
+class MetricsRegistry:
+    """Потокобезопасный набор именованных счётчиков и гистограмм с метками."""
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = defaultdict(dict)
+        self._histograms = defaultdict(dict)
+        self._help = {}
+        self._local = threading.local()
+
+    def describe(self, name, text):
+        """Описание метрики для # HELP."""
+        self._help[name] = text
+
+    def _labels(self, labels):
+        scoped = dict(getattr(self._local, "labels", ()))
+        scoped.update((key, str(value)) for key, value in labels.items() if value is not None)
+        return tuple(sorted(scoped.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._counters[name][key] = self._counters[name].get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            histogram = self._histograms[name].get(key)
+            if histogram is None:
+                histogram = self._histograms[name][key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def stage(self, name, items=1, **labels):
+        """Замер стадии: время в stage_seconds, число элементов в stage_items_total."""
+        record = Stage(items)
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - started
+            self.observe("stage_seconds", record.seconds, stage=name, **labels)
+            self.inc("stage_items_total", record.items, stage=name, **labels)
+
+    def timed_iter(self, iterable, name, **labels):
+        """Итератор, у которого замеряется время получения каждого элемента (ленивое чтение, декодирование)."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name, **labels) as record:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    record.items = 0
+                    return
+            yield item
+
+    @contextmanager
+    def scope(self, **labels):
+        """Метки по умолчанию для всех замеров текущего потока внутри блока (например, modality)."""
+        previous = getattr(self._local, "labels", {})
+        self._local.labels = {**previous, **{key: str(value) for key, value in labels.items()}}
+        try:
+            yield
+        finally:
+            self._local.labels = previous
+
+    def scoped(self, **labels):
+        """Декоратор: вызов функции внутри scope(**labels)."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.scope(**labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def timed(self, name=None, **labels):
+        """Декоратор: каждый вызов функции — стадия name (по умолчанию имя функции)."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or func.__name__, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def summary(self):
+        """Суммарное время стадий: {"[модальность/]стадия": {seconds, count, items, share, p50, p95}}."""
+        with self._lock:
+            histograms = {key: (h.sum, h.count, h.quantile(0.5), h.quantile(0.95))
+                          for key, h in self._histograms.get("stage_seconds", {}).items()}
+            items = dict(self._counters.get("stage_items_total", {}))
+        total = sum(seconds for seconds, *_ in histograms.values()) or 1.0
+        result = {}
+        for key, (seconds, count, p50, p95) in histograms.items():
+            labels = dict(key)
+            name = f"{labels['modality']}/{labels['stage']}" if "modality" in labels else labels["stage"]
+            entry = result.setdefault(name, {"seconds": 0.0, "count": 0, "items": 0, "share": 0.0,
+                                             "p50_seconds": p50, "p95_seconds": p95})
+            entry["seconds"] += seconds
+            entry["count"] += count
+            entry["items"] += items.get(key, 0)
+            entry["share"] = entry["seconds"] / total
+        return dict(sorted(result.items(), key=lambda item: -item[1]["seconds"]))
+
+    def format_summary(self):
+        """Сводка по стадиям в виде строк, от самой долгой."""
+        return [f"{name}: {entry['seconds']:.2f} с ({entry['share']:.0%}), вызовов {entry['count']}, элементов {entry['items']}"
+                for name, entry in self.summary().items()]
+
+    def snapshot(self):
+        """Все метрики в виде словаря для JSON."""
+        with self._lock:
+            counters = {name: [{"labels": dict(key), "value": value} for key, value in values.items()]
+                        for name, values in self._counters.items()}
+            histograms = {name: [{"labels": dict(key), "count": h.count, "sum": h.sum,
+                                  "buckets": {("+Inf" if bound == float("inf") else repr(bound)): seen
+                                              for bound, seen in h.cumulative()}}
+                                 for key, h in values.items()]
+                          for name, values in self._histograms.items()}
+        return {"timestamp": time.time(), "counters": counters, "histograms": histograms, "summary": self.summary()}
+
+    def to_prometheus(self):
+        """Текстовый формат Prometheus (exposition format 0.0.4)."""
+        def render(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+                       for _, value in pairs)
+            return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+        lines = []
+        with self._lock:
+            for name, values in sorted(self._counters.items()):
+                full = f"{self.prefix}_{name}"
+                if name in self._help:
+                    lines.append(f"# HELP {full} {self._help[name]}")
+                lines.append(f"# TYPE {full} counter")
+                lines.extend(f"{full}{render(key)} {value}" for key, value in sorted(values.items()))
+            for name, values in sorted(self._histograms.items()):
+                full = f"{self.prefix}_{name}"
+                if name in self._help:
+                    lines.append(f"# HELP {full} {self._help[name]}")
+                lines.append(f"# TYPE {full} histogram")
+                for key, histogram in sorted(values.items()):
+                    for bound, seen in histogram.cumulative():
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{full}_bucket{render(key, [('le', le)])} {seen}")
+                    lines.append(f"{full}_sum{render(key)} {histogram.sum}")
+                    lines.append(f"{full}_count{render(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Запись снимка: .json — JSON, иначе текстовый формат Prometheus (например, для textfile collector).
+
+        Файл заменяется атомарно, читатель не увидит его наполовину записанным.
+        """
+        text = (json.dumps(self.snapshot(), ensure_ascii=False, indent=2) if path.endswith(".json")
+                else self.to_prometheus())
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+
+class StackSampler:
+    """Выборочный профилировщик: периодические снимки стеков всех потоков.
+
+    Результат — строки "поток;функция;...;функция число" (collapsed stacks, как py-spy --format raw),
+    которые открываются в speedscope или flamegraph.pl. В отличие от cProfile видит все потоки
+    (планировщик, декодеры, пул поиска) и почти не замедляет работу.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.counts[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.counts.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profile(path, interval=0.005):
+    """Профилирование блока: путь .prof — cProfile (только текущий поток, для snakeviz/pstats),
+    иначе выборка стеков всех потоков в формате collapsed."""
+    if path.endswith(".prof"):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+    else:
+        sampler = StackSampler(interval)
+        sampler.start()
+        try:
+            yield sampler
+        finally:
+            sampler.stop()
+            sampler.write(path)
+
+
+# Общий реестр процесса
+REGISTRY = MetricsRegistry()
+REGISTRY.describe("stage_seconds", "Время стадий индексации и поиска, секунды")
+REGISTRY.describe("stage_items_total", "Число элементов, обработанных стадией")
+REGISTRY.describe("queue_wait_seconds", "Простой конвейера декодирования изображений за вызов, секунды")
+REGISTRY.describe("query_cache_total", "Обращения к кэшу эмбеддингов запросов")
+
+stage = REGISTRY.stage
+timed_iter = REGISTRY.timed_iter
+scope = REGISTRY.scope
+scoped = REGISTRY.scoped
+timed = REGISTRY.timed
+inc = REGISTRY.inc
+observe = REGISTRY.observe
@@ -0,0 +1,25 @@
+import sys
+import argparse
+from core.database import Database
+
+def main(argv=None):
+    """Перевод баз старого формата (эмбеддинги в BLOB) на хранилище векторов."""
+    parser = argparse.ArgumentParser(description="Миграция эмбеддингов из SQLite BLOB в файл, отображаемый в память")
+    parser.add_argument("db_paths", nargs="+", help="Пути к базам (.db или indexed_data.pkl)")
+    parser.add_argument("--compact", action="store_true", help="Удалить из хранилища строки без ссылок")
+    parser.add_argument("--vacuum", action="store_true", help="Вернуть место, освобождённое BLOB-колонкой (VACUUM)")
+    args = parser.parse_args(argv)
+
+    for db_path in args.db_paths:
+        db = Database(db_path)
+        migrated = db.migrate_embeddings()
+        print(f"{db_path}: перенесено эмбеддингов: {migrated}")
+        if args.compact:
+            print(f"{db_path}: удалено неиспользуемых строк: {db.compact()}")
+        if args.vacuum:
+            db._conn.execute("VACUUM")
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
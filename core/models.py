@@ -1,36 +1,137 @@
-from sentence_transformers import SentenceTransformer
-from transformers import BlipProcessor, BlipForConditionalGeneration
-import whisper
-import torch
+from collections import OrderedDict
+import threading
+from core import metrics
+
+# torch, transformers, sentence_transformers и whisper импортируются при первой загрузке модели:
+# их импорт занимает секунды и не нужен, пока модель не понадобилась
+
+# Реестр загруженных моделей: одна копия каждой модели на процесс
+_models = {}
+_models_lock = threading.Lock()
+
+def get_model(kind, name, device):
+    """Общий для всех процессоров экземпляр модели; загружается при первом обращении."""
+    key = (kind, name, device)
+    with _models_lock:
+        if key not in _models:
+            if kind == "text":
+                from sentence_transformers import SentenceTransformer
+                _models[key] = SentenceTransformer(name).to(device)
+            elif kind == "blip_processor":
+                from transformers import BlipProcessor
+                _models[key] = BlipProcessor.from_pretrained(name)
+            elif kind == "blip":
+                from transformers import BlipForConditionalGeneration
+                _models[key] = BlipForConditionalGeneration.from_pretrained(name).to(device)
+            elif kind == "whisper":
+                import whisper
+                _models[key] = whisper.load_model(name, device=device)
+            else:
+                raise ValueError(f"Неизвестный тип модели: {kind}")
+        return _models[key]
+
+def register_model(kind, name, device, model):
+    """Регистрация уже загруженной модели (например, после дообучения)."""
+    with _models_lock:
+        _models[(kind, name, device)] = model
 
 class ModelManager:
-    def __init__(self, config):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"Используемое устройство: {self.device}")
-        
-        self.text_model = SentenceTransformer(config.MODEL_NAMES["text"]).to(self.device)
-        self.blip_processor = BlipProcessor.from_pretrained(config.MODEL_NAMES["image"])
-        self.blip_model = BlipForConditionalGeneration.from_pretrained(config.MODEL_NAMES["image"]).to(self.device)
-        self.whisper_model = whisper.load_model(config.MODEL_NAMES["whisper"])
-    
+    """Доступ к моделям.
+
+    Модели загружаются при первом обращении; models ("text", "image", "whisper")
+    перечисляет те, что нужно загрузить сразу при создании.
+    """
+
+    def __init__(self, config, query_cache_size=1024, models=()):
+        self._device = None
+        self.model_names = dict(config.MODEL_NAMES)
+        self.text_model_name = self.model_names["text"]
+        self._text_model = None
+        for model in models:
+            if model == "text":
+                self._text_model = get_model("text", self.text_model_name, self.device)
+            elif model == "image":
+                get_model("blip_processor", self.model_names["image"], self.device)
+                get_model("blip", self.model_names["image"], self.device)
+            elif model == "whisper":
+                get_model("whisper", self.model_names["whisper"], self.device)
+            else:
+                raise ValueError(f"Неизвестная модель: {model}")
+
+        # LRU-кэш эмбеддингов запросов по (модель, текст)
+        self.query_cache_size = query_cache_size
+        self._query_cache = OrderedDict()
+        self._query_lock = threading.Lock()
+
+    @property
+    def device(self):
+        if self._device is None:
+            import torch
+            self._device = "cuda" if torch.cuda.is_available() else "cpu"
+            print(f"Используемое устройство: {self._device}")
+        return self._device
+
+    @property
+    def text_model(self):
+        if self._text_model is None:
+            self._text_model = get_model("text", self.text_model_name, self.device)
+        return self._text_model
+
+    @text_model.setter
+    def text_model(self, model):
+        self._text_model = model
+
+    @property
+    def blip_processor(self):
+        return get_model("blip_processor", self.model_names["image"], self.device)
+
+    @property
+    def blip_model(self):
+        return get_model("blip", self.model_names["image"], self.device)
+
+    @property
+    def whisper_model(self):
+        return get_model("whisper", self.model_names["whisper"], self.device)
+
     def encode_text(self, texts, batch_size=32):
-        return self.text_model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
-    
+        with metrics.stage("encode", items=len(texts)):
+            return self.text_model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+
+    def encode_query(self, text):
+        """Эмбеддинг поискового запроса с кэшированием повторных запросов."""
+        key = (self.text_model_name, text)
+        with self._query_lock:
+            if key in self._query_cache:
+                self._query_cache.move_to_end(key)
+                metrics.inc("query_cache_total", result="hit")
+                return self._query_cache[key]
+        metrics.inc("query_cache_total", result="miss")
+        embedding = self.encode_text([text])[0]
+        embedding.flags.writeable = False
+        with self._query_lock:
+            self._query_cache[key] = embedding
+            if len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return embedding
+
     def generate_image_captions(self, images, max_length=100, num_beams=5):
-        inputs = self.blip_processor(images=images, return_tensors="pt").to(self.device)
-        outputs = self.blip_model.generate(**inputs, max_length=max_length, num_beams=num_beams, early_stopping=True)
-        return self.blip_processor.batch_decode(outputs, skip_special_tokens=True)
-    
-    def transcribe_audio(self, audio_path):
-        return self.whisper_model.transcribe(audio_path, language="ru")["text"]
-    
+        with metrics.stage("caption", items=len(images)):
+            inputs = self.blip_processor(images=images, return_tensors="pt").to(self.device)
+            outputs = self.blip_model.generate(**inputs, max_length=max_length, num_beams=num_beams, early_stopping=True)
+            return self.blip_processor.batch_decode(outputs, skip_special_tokens=True)
+
+    def transcribe_audio(self, audio):
+        """Транскрипция файла или массива float32 с частотой 16 кГц."""
+        with metrics.stage("transcribe"):
+            return self.whisper_model.transcribe(audio, language="ru")["text"]
+
     def fine_tune_text_model(self, examples, output_path, epochs=1, batch_size=8):
-        from sentence_transformers import InputExample, losses
+        from sentence_transformers import SentenceTransformer, losses
         from torch.utils.data import DataLoader
-        
+
         train_dataloader = DataLoader(examples, shuffle=True, batch_size=batch_size)
         train_loss = losses.CosineSimilarityLoss(self.text_model)
-        
+
         self.text_model.fit(
             train_objectives=[(train_dataloader, train_loss)],
             epochs=epochs,
@@ -38,4 +139,6 @@ class ModelManager:
             output_path=output_path
         )
         self.text_model = SentenceTransformer(output_path).to(self.device)
-        return self.text_model
\ No newline at end of file
+        self.text_model_name = output_path
+        register_model("text", output_path, self.device, self.text_model)
+        return self.text_model
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from core.vector_store import VectorStore
+
+# Расширение файла и тип numpy квантованной копии
+DTYPES = {"float16": ("f16", np.float16), "int8": ("i8", np.int8)}
+# Строк за одно преобразование в float32 при поиске (блок остаётся в кэше процессора) и при квантовании
+SCORE_CHUNK = 4096
+SYNC_CHUNK = 65536
+
+class QuantizedVectors:
+    """Квантованная копия хранилища векторов для первого прохода поиска.
+
+    float16 — половина объёма float32 почти без потери точности, но numpy медленно переводит его
+    в float32, поэтому первый проход упирается в процессор; int8 — четверть объёма,
+    каждая строка хранится как round(v / scale) с собственным масштабом scale = max|v| / 127
+    (файл масштабов <база>_vectors.i8s). Основной float32-файл остаётся источником точных
+    значений: после прохода по квантованной матрице rerank * top_k лучших кандидатов
+    пересчитываются по нему, поэтому при поиске читается лишь малая доля float32-строк.
+    Копия дописывается вместе с основным хранилищем и догоняет его при загрузке базы.
+    """
+
+    def __init__(self, base_path, dim=None, dtype="int8", rerank=4, chunk_size=SCORE_CHUNK):
+        if dtype not in DTYPES:
+            raise ValueError(f"Неизвестный тип квантования: {dtype} (доступны {', '.join(DTYPES)})")
+        extension, np_dtype = DTYPES[dtype]
+        self.dtype = dtype
+        self.rerank = rerank
+        self.chunk_size = chunk_size
+        self.data = VectorStore(f"{base_path}_vectors.{extension}", dim, np_dtype)
+        self.scales = VectorStore(f"{base_path}_vectors.i8s", 1) if dtype == "int8" else None
+
+    @classmethod
+    def from_settings(cls, db_path, settings, dim=None):
+        """Создание копии из настроек Config.QUANTIZATION_SETTINGS."""
+        return cls(os.path.splitext(db_path)[0], dim, **settings)
+
+    @property
+    def paths(self):
+        return [store.path for store in (self.data, self.scales) if store is not None]
+
+    @property
+    def row_bytes(self):
+        """Байт на строку с учётом масштаба int8."""
+        return self.data.row_bytes + (self.scales.row_bytes if self.scales is not None else 0)
+
+    def __len__(self):
+        if self.scales is None:
+            return len(self.data)
+        return min(len(self.data), len(self.scales))
+
+    def quantize(self, vectors):
+        """Квантование пачки нормированных float32-векторов: (данные, масштабы или None)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), None
+        scales = np.abs(vectors).max(axis=1, keepdims=True) / 127.0
+        scales[scales == 0] = 1.0
+        return np.rint(vectors / scales).astype(np.int8), scales.astype(np.float32)
+
+    def reset(self):
+        """Удаление квантованных файлов (после перезаписи основного хранилища)."""
+        for store in (self.data, self.scales):
+            if store is not None:
+                store.release()
+                if os.path.exists(store.path):
+                    os.remove(store.path)
+
+    def sync(self, store, rows=None):
+        """Дописывание строк основного хранилища, которых ещё нет в копии (до rows строк).
+
+        Копия длиннее хранилища или с рассогласованными файлами строится заново.
+        """
+        rows = len(store) if rows is None else rows
+        if self.data.dim is None:
+            self.data.dim = store.dim
+        if len(self) > len(store) or (self.scales is not None and len(self.data) != len(self.scales)):
+            self.reset()
+        done = len(self)
+        if done >= rows:
+            return 0
+        matrix = store.matrix(rows)
+        for start in range(done, rows, SYNC_CHUNK):
+            data, scales = self.quantize(matrix[start:start + SYNC_CHUNK])
+            self.data.append(data)
+            if scales is not None:
+                self.scales.append(scales)
+        return rows - done
+
+    def scores(self, query, rows, positions=None):
+        """Приближённое сходство запроса со строками копии (все первые rows или только positions)."""
+        data = self.data.matrix(rows)
+        scales = self.scales.matrix(rows)[:, 0] if self.scales is not None else None
+        count = rows if positions is None else len(positions)
+        result = np.empty(count, dtype=np.float32)
+        for start in range(0, count, self.chunk_size):
+            end = min(start + self.chunk_size, count)
+            index = slice(start, end) if positions is None else positions[start:end]
+            # Поблочное преобразование в float32: матричное умножение идёт через BLAS без копии всей матрицы
+            result[start:end] = data[index].astype(np.float32) @ query
+            if scales is not None:
+                result[start:end] *= scales[index]
+        return result
+
+    def shortlist(self, query, matrix, alive, candidates=None, top_k=5, rerank=None):
+        """Двухпроходный поиск: кандидаты по квантованной копии, точные оценки по float32.
+
+        candidates — позиции строк от ANN-индекса (None — все строки matrix с учётом alive).
+        Возвращает (позиции, точные оценки) не более чем для rerank * top_k строк.
+        """
+        approx = self.scores(query, len(matrix), candidates)
+        if candidates is None:
+            approx[~alive] = -np.inf
+            candidates = np.arange(len(matrix))
+        if not len(approx):
+            return candidates, approx
+        k = min(len(approx), top_k * (rerank or self.rerank))
+        best = np.argpartition(-approx, k - 1)[:k]
+        best = best[np.isfinite(approx[best])]
+        # Упорядоченные позиции читают float32-файл последовательно
+        positions = np.sort(candidates[best])
+        return positions, matrix[positions] @ query
+
+
+def recall_report(db, dtypes=("float16", "int8"), reranks=(1, 2, 4, 8), num_queries=200, top_k=10, seed=0):
+    """Сравнение двухпроходного поиска по квантованным копиям с точным float32-перебором.
+
+    Для каждого типа и множителя rerank — recall@k, задержка и объём матрицы первого прохода.
+    Копии строятся во временной директории, файлы базы не меняются. Запросами служат
+    случайные строки базы с небольшим шумом.
+    """
+    db.load()
+    rng = np.random.default_rng(seed)
+    matrix = db.vectors()
+    alive_mask = db._alive[:len(matrix)]
+    alive = np.flatnonzero(alive_mask)
+    if not len(alive):
+        raise ValueError("В базе нет векторов")
+    sample = rng.choice(alive, size=min(num_queries, len(alive)), replace=False)
+    queries = db._normalize(matrix[np.sort(sample)] + rng.normal(scale=0.05, size=(len(sample), matrix.shape[1])).astype(np.float32))
+    k = min(top_k, len(alive))
+
+    exact, exact_time = [], 0.0
+    for query in queries:
+        start = time.perf_counter()
+        scores = matrix @ query
+        scores[~alive_mask] = -np.inf
+        exact.append(set(np.argpartition(-scores, k - 1)[:k].tolist()))
+        exact_time += time.perf_counter() - start
+
+    float32_bytes = matrix.shape[1] * 4
+    report = {
+        "db_path": db.db_path,
+        "rows": len(alive),
+        "dim": matrix.shape[1],
+        "top_k": top_k,
+        "queries": len(queries),
+        "float32": {"bytes_per_row": float32_bytes, "matrix_mb": len(matrix) * float32_bytes / 2 ** 20,
+                    "latency_ms": exact_time / len(queries) * 1000},
+        "settings": []
+    }
+    workdir = tempfile.mkdtemp(prefix="quantization_")
+    try:
+        for dtype in dtypes:
+            quantized = QuantizedVectors(os.path.join(workdir, dtype), matrix.shape[1], dtype)
+            started = time.perf_counter()
+            quantized.sync(db.store, len(matrix))
+            build_seconds = time.perf_counter() - started
+            for rerank in reranks:
+                hits, elapsed = 0, 0.0
+                for query, truth in zip(queries, exact):
+                    start = time.perf_counter()
+                    positions, scores = quantized.shortlist(query, matrix, alive_mask, top_k=k, rerank=rerank)
+                    top = positions[np.argpartition(-scores, min(k, len(scores)) - 1)[:k]] if len(scores) else positions
+                    elapsed += time.perf_counter() - start
+                    hits += len(truth & set(top.tolist()))
+                report["settings"].append({
+                    "dtype": dtype,
+                    "rerank": rerank,
+                    "recall": hits / max(1, sum(len(t) for t in exact)),
+                    "latency_ms": elapsed / len(queries) * 1000,
+                    "bytes_per_row": quantized.row_bytes,
+                    "matrix_mb": len(matrix) * quantized.row_bytes / 2 ** 20,
+                    "memory_ratio": quantized.row_bytes / float32_bytes,
+                    "build_seconds": build_seconds
+                })
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def main(argv=None):
+    from core.database import Database
+
+    parser = argparse.ArgumentParser(description="Отчёт recall/память/задержка квантованного поиска относительно float32")
+    parser.add_argument("db_path")
+    parser.add_argument("--dtypes", default="float16,int8", help="Типы квантования через запятую")
+    parser.add_argument("--rerank", default="1,2,4,8", help="Множители числа пересчитываемых кандидатов через запятую")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--output", default=None, help="Путь для JSON-отчёта")
+    args = parser.parse_args(argv)
+
+    db = Database(args.db_path)
+    report = recall_report(db, args.dtypes.split(","), [int(n) for n in args.rerank.split(",")],
+                           args.queries, args.top_k)
+    base = report["float32"]
+    print(f"Строк: {report['rows']}, float32: {base['matrix_mb']:.1f} МБ, точный поиск: {base['latency_ms']:.2f} мс")
+    for row in report["settings"]:
+        print(f"{row['dtype']:<8} rerank={row['rerank']:<3} recall@{args.top_k}={row['recall']:.3f}  "
+              f"{row['latency_ms']:.2f} мс  {row['matrix_mb']:.1f} МБ ({row['memory_ratio']:.0%})")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from core.journal import JournaledIndex, MAX_ATTEMPTS, RETRY_BACKOFF
+
+class IndexJob:
+    """Индексация одной директории одним процессором: состояние, прогресс и оценка оставшегося времени.
+
+    Прогресс считается по объёму обработанных файлов в байтах, поэтому оценка времени
+    не искажается, когда крупные и мелкие файлы идут вперемешку; время на паузе не учитывается.
+    Файлы и их состояние записываются в журнал (JournaledIndex), поэтому прерванная задача
+    продолжается при следующем запуске с невыполненных файлов.
+    """
+
+    def __init__(self, name, processor, directory, extensions, priority, seq, max_attempts=MAX_ATTEMPTS,
+                 backoff=RETRY_BACKOFF):
+        self.name = name
+        self.processor = processor
+        self.directory = directory
+        self.extensions = extensions
+        self.priority = priority
+        self.seq = seq
+        self.journal = JournaledIndex(processor, directory, extensions, max_attempts, backoff)
+        self.state = "planning"  # planning, running, paused, cancelled, done
+        self.chunks = deque()  # Ещё не подготовленные пачки файлов
+        self.ready = deque()  # Пачки с запущенной подготовкой: (файлы, future)
+        self.retries = []  # Неудавшиеся файлы, ожидающие повтора: (время повтора, файл)
+        self.sizes = {}
+        self.total_files = 0
+        self.total_bytes = 0
+        self.done_files = 0
+        self.done_bytes = 0
+        self.failed_files = 0
+        self._active_time = 0.0
+        self._resumed_at = None
+
+    @property
+    def active(self):
+        return self.state in ("planning", "running", "paused")
+
+    def elapsed(self):
+        """Время работы без учёта пауз, секунды."""
+        if self._resumed_at is None:
+            return self._active_time
+        return self._active_time + time.monotonic() - self._resumed_at
+
+    def _start_clock(self):
+        if self._resumed_at is None:
+            self._resumed_at = time.monotonic()
+
+    def _stop_clock(self):
+        if self._resumed_at is not None:
+            self._active_time += time.monotonic() - self._resumed_at
+            self._resumed_at = None
+
+    def percent(self):
+        if self.total_bytes:
+            return self.done_bytes / self.total_bytes * 100
+        return 100.0 if self.state == "done" else 0.0
+
+    def eta(self):
+        """Оценка оставшегося времени в секундах; None, пока нет обработанных файлов."""
+        elapsed = self.elapsed()
+        if not self.done_bytes or elapsed <= 0:
+            return None
+        return (self.total_bytes - self.done_bytes) / (self.done_bytes / elapsed)
+
+    def status(self):
+        """Строка состояния для интерфейса."""
+        text = f"{self.name}: {self.done_files}/{self.total_files} файлов"
+        if self.failed_files:
+            text += f", ошибок: {self.failed_files}"
+        if self.retries:
+            text += f", ожидают повтора: {len(self.retries)}"
+        if self.state == "planning":
+            return f"{self.name}: поиск файлов..."
+        if self.state == "paused":
+            return text + " (пауза)"
+        eta = self.eta()
+        if eta is not None and self.state == "running":
+            minutes, seconds = divmod(int(eta), 60)
+            text += f", осталось ~{minutes} мин {seconds:02d} с"
+        return text
+
+
+class IndexScheduler:
+    """Планировщик индексации с отдельными исполнителями для каждой стадии.
+
+    - потоки ввода-вывода: обход директории и подготовка следующих пачек файлов
+      (processor.prepare_files, если процессор его поддерживает);
+    - пул процессов: тяжёлое извлечение и декодирование, которое подготовка отдаёт в executor;
+    - один поток модели: processor.process_files и сброс записей в базу.
+
+    Поток модели на каждом шаге берёт готовую пачку задачи с наименьшим приоритетом
+    (при равенстве — более раннюю), поэтому новая срочная задача начинает выполняться
+    после текущей пачки. Пауза и отмена тоже срабатывают между пачками. Прогресс
+    передаётся в report(action, value): "progress" (проценты по всем задачам),
+    "status" (строка состояния) и "complete" (сообщение о завершении задачи).
+    """
+
+    def __init__(self, report=None, chunk_size=32, io_workers=2, process_workers=2, prefetch_chunks=1,
+                 priorities=None, max_attempts=MAX_ATTEMPTS, backoff=RETRY_BACKOFF):
+        self.report = report or (lambda action, value: None)
+        self.chunk_size = chunk_size
+        self.process_workers = process_workers
+        self.prefetch_chunks = prefetch_chunks
+        self.priorities = dict(priorities or {})
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.jobs = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._io = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="index-io")
+        self._pool = None
+        self._worker = None
+
+    def _process_pool(self):
+        # Процессы создаются при первой задаче, а не при запуске приложения
+        with self._cond:
+            if self._pool is None and self.process_workers > 0:
+                self._pool = ProcessPoolExecutor(max_workers=self.process_workers)
+            return self._pool
+
+    def submit(self, name, processor, directory, extensions=None, priority=None):
+        """Постановка директории в очередь индексации; возвращает IndexJob.
+
+        Для одного процессора одновременно выполняется не больше одной задачи:
+        повторный вызов возвращает уже идущую.
+        """
+        with self._cond:
+            for job in self.jobs:
+                if job.processor is processor and job.active:
+                    return job
+            if priority is None:
+                priority = self.priorities.get(name, 0)
+            job = IndexJob(name, processor, directory, extensions, priority, self._seq, self.max_attempts, self.backoff)
+            self._seq += 1
+            self.jobs.append(job)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="index-model", daemon=True)
+                self._worker.start()
+        self._io.submit(self._plan, job)
+        self._report_progress()
+        return job
+
+    def pause(self, job=None):
+        """Пауза задачи (или всех задач) после текущей пачки."""
+        with self._cond:
+            for item in self._select(job):
+                if item.state == "running":
+                    item.state = "paused"
+                    item._stop_clock()
+        self._report_progress()
+
+    def resume(self, job=None):
+        """Продолжение задачи (или всех задач) после паузы."""
+        with self._cond:
+            for item in self._select(job):
+                if item.state == "paused":
+                    item.state = "running"
+                    self._fill(item)
+            self._cond.notify_all()
+        self._report_progress()
+
+    def cancel(self, job=None):
+        """Отмена задачи (или всех задач): уже записанное остаётся в базе, остальное будет обработано при следующем запуске."""
+        with self._cond:
+            for item in self._select(job):
+                if item.active:
+                    item.state = "cancelled"
+                    item._stop_clock()
+                    item.chunks.clear()
+                    item.retries = []
+            self._cond.notify_all()
+
+    def active_jobs(self):
+        with self._cond:
+            return [job for job in self.jobs if job.active]
+
+    def shutdown(self, wait=False):
+        """Остановка планировщика; незаписанные пачки будут обработаны при следующей индексации."""
+        self.cancel()
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if wait and self._worker is not None:
+            self._worker.join()
+        self._io.shutdown(wait=wait, cancel_futures=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    def _select(self, job):
+        return self.jobs if job is None else [job]
+
+    def _plan(self, job):
+        """Поиск новых, изменённых и прерванных файлов (поток ввода-вывода)."""
+        try:
+            files = job.journal.plan()
+        except Exception as e:
+            print(f"Ошибка подготовки индексации {job.name}: {e}")
+            files = []
+        sizes = []
+        for path in files:
+            try:
+                sizes.append(max(os.path.getsize(path), 1))
+            except OSError:
+                sizes.append(1)
+        with self._cond:
+            job.total_files = len(files)
+            job.total_bytes = sum(sizes)
+            job.sizes = dict(zip(files, sizes))
+            for start in range(0, len(files), self.chunk_size):
+                job.chunks.append((files[start:start + self.chunk_size], sum(sizes[start:start + self.chunk_size])))
+            if job.state == "planning":
+                job.state = "running"
+                job._start_clock()
+                self._fill(job)
+            self._cond.notify_all()
+        self._report_progress()
+
+    def _fill(self, job):
+        """Запуск подготовки следующих пачек задачи, пока их не станет prefetch_chunks (под self._cond)."""
+        while job.state == "running" and job.chunks and len(job.ready) < self.prefetch_chunks:
+            chunk = job.chunks.popleft()
+            job.ready.append((chunk, self._io.submit(self._prepare, job.processor, chunk[0])))
+
+    def _prepare(self, processor, files):
+        """Подготовка пачки в потоке ввода-вывода; тяжёлая часть может уйти в пул процессов."""
+        prepare = getattr(processor, "prepare_files", None)
+        if prepare is None:
+            return None
+        return prepare(files, self._process_pool())
+
+    def _next(self):
+        """Следующая работа для потока модели: (задача, пачка, future) или (задача, None, None) для завершения.
+
+        Повтор неудавшегося файла — пачка из одного файла без подготовки (future = None).
+        """
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None, None, None
+                finished = [job for job in self.jobs if job.state == "cancelled" and job.ready is not None
+                            or job.state == "running" and not job.chunks and not job.ready and not job.retries]
+                if finished:
+                    return finished[0], None, None
+                now = time.time()
+                runnable = [job for job in self.jobs if job.state == "running"
+                            and (job.ready or job.retries and job.retries[0][0] <= now)]
+                if runnable:
+                    job = min(runnable, key=lambda item: (item.priority, item.seq))
+                    if not job.ready:
+                        _, path = job.retries.pop(0)
+                        return job, ([path], job.sizes.get(path, 1)), None
+                    chunk, future = job.ready.popleft()
+                    self._fill(job)
+                    return job, chunk, future
+                waiting = [job.retries[0][0] for job in self.jobs if job.state == "running" and job.retries]
+                self._cond.wait(timeout=max(0.0, min(waiting) - now) if waiting else None)
+
+    def _run(self):
+        """Поток модели: обработка готовых пачек и завершение задач."""
+        while True:
+            job, chunk, future = self._next()
+            if job is None:
+                return
+            if chunk is None:
+                self._finish(job)
+                continue
+            files, _ = chunk
+            try:
+                prepared = future.result() if future is not None else None
+            except Exception as e:
+                print(f"Ошибка подготовки файлов {job.name}: {e}")
+                prepared = None
+            try:
+                completed, retries, exhausted = job.journal.run_chunk(files, prepared)
+            except Exception as e:
+                # Ошибка самой базы: файлы остаются в журнале невыполненными до следующего запуска
+                print(f"Ошибка индексации {job.name}: {e}")
+                completed, retries, exhausted = [], [], list(files)
+            with self._cond:
+                job.done_files += len(completed)
+                job.failed_files += len(exhausted)
+                # Объём файла засчитывается, когда его судьба решена: записан или исчерпал попытки
+                job.done_bytes += sum(job.sizes.get(path, 1) for path in completed + exhausted)
+                if job.state != "cancelled":
+                    job.retries = sorted(job.retries + [(retry_at, path) for path, retry_at in retries])
+            self._report_progress()
+
+    def _finish(self, job):
+        """Сброс буфера процессора и завершение (или отмена) задачи в потоке модели."""
+        with self._cond:
+            cancelled = job.state == "cancelled"
+            for _, future in job.ready:
+                future.cancel()
+            job.ready = None if cancelled else deque()
+            if not cancelled:
+                job.state = "done"
+                job._stop_clock()
+        try:
+            job.processor.flush()
+        except Exception as e:
+            print(f"Ошибка записи {job.name}: {e}")
+        self._report_progress()
+        if cancelled:
+            self.report("complete", f"Индексация {job.name} отменена: обработано {job.done_files} из {job.total_files} файлов.")
+        else:
+            self.report("complete", f"Индексация {job.name} завершена: {job.done_files} файлов, ошибок: {job.failed_files}.")
+
+    def _report_progress(self):
+        with self._cond:
+            active = [item for item in self.jobs if item.active]
+            total = sum(item.total_bytes for item in active)
+            done = sum(item.done_bytes for item in active)
+            status = "; ".join(item.status() for item in active)
+        self.report("progress", done / total * 100 if total else 0.0)
+        self.report("status", status or "Прогресс:")
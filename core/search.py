@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+from core import metrics
+
+class SearchCoordinator:
+    """Единый поиск по всем модальностям.
+
+    Запрос кодируется один раз (модальности с собственным текстом запроса, например
+    переводом для изображений, кодируют его отдельно), базы просматриваются параллельно,
+    а оценки приводятся к общей шкале: сходство переводится в z-оценку относительно
+    случайной выборки записей той же базы.
+    """
+
+    def __init__(self, model_manager, processors, sample_size=256):
+        self.model = model_manager
+        self.processors = dict(processors)
+        self.sample_size = sample_size
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(self.processors)))
+        self.last_timings = {}
+
+    @staticmethod
+    def calibrate(score, stats):
+        """Z-оценка сходства относительно выборки базы.
+
+        Без статистики или при нулевом разбросе (одна запись, одинаковые векторы) оценка равна 0 —
+        среднему уровню любой базы, а не сырому косинусу, шкала которого с z-оценками несравнима.
+        """
+        if stats is None or stats[1] < 1e-6:
+            return 0.0
+        mean, std = stats
+        return (score - mean) / std
+
+    def _search_shard(self, modality, query, query_embedding, top_k):
+        """Поиск в одной базе; результаты помечаются модальностью."""
+        with metrics.stage("search_shard", modality=modality) as shard:
+            processor = self.processors[modality]
+            text = processor.query_text(query)
+            embedding = query_embedding if text == query else self.model.encode_query(text)
+            results = processor.search_embedding(embedding, top_k)
+            stats = processor.db.score_stats(embedding, self.sample_size)
+        self.last_timings[modality] = shard.seconds
+        return [(modality, path, desc, self.calibrate(sim, stats), extra, sim) for path, desc, sim, extra in results]
+
+    def search(self, query, top_k=10, modalities=None):
+        """Общий список (modality, path, description, score, extra, similarity) по убыванию score."""
+        with metrics.stage("unified_search"):
+            return self._search(query, top_k, modalities)
+
+    def _search(self, query, top_k, modalities):
+        modalities = [m for m in (modalities or self.processors) if m in self.processors]
+        query_embedding = self.model.encode_query(query)
+        self.last_timings = {}
+        futures = {
+            modality: self.executor.submit(self._search_shard, modality, query, query_embedding, top_k)
+            for modality in modalities
+        }
+        merged = []
+        for modality, future in futures.items():
+            try:
+                merged.extend(future.result())
+            except Exception as e:
+                print(f"Ошибка поиска ({modality}): {e}")
+        merged.sort(key=lambda result: result[3], reverse=True)
+        return merged[:top_k]
@@ -0,0 +1,130 @@
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+class IdentityBackend:
+    """Без перевода: запрос используется как есть."""
+
+    def translate(self, text, target):
+        return text
+
+
+class GoogleBackend:
+    """Google Translate через deep_translator (нужен доступ к сети)."""
+
+    def __init__(self, source="auto"):
+        self.source = source
+        self._translators = {}
+
+    def translate(self, text, target):
+        if target not in self._translators:
+            from deep_translator import GoogleTranslator
+            self._translators[target] = GoogleTranslator(source=self.source, target=target)
+        return self._translators[target].translate(text)
+
+
+class MarianBackend:
+    """Локальный перевод моделью MarianMT (transformers), работает без сети."""
+
+    def __init__(self, model_name="Helsinki-NLP/opus-mt-ru-en"):
+        self.model_name = model_name
+        self._model = None
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    def translate(self, text, target):
+        with self._lock:
+            if self._model is None:
+                from transformers import MarianMTModel, MarianTokenizer
+                self._tokenizer = MarianTokenizer.from_pretrained(self.model_name)
+                self._model = MarianMTModel.from_pretrained(self.model_name)
+            inputs = self._tokenizer([text], return_tensors="pt", truncation=True)
+            outputs = self._model.generate(**inputs, max_new_tokens=128)
+            return self._tokenizer.decode(outputs[0], skip_special_tokens=True)
+
+
+# Доступные бэкенды по имени; свои добавляются через register_backend
+BACKENDS = {
+    "identity": IdentityBackend,
+    "google": GoogleBackend,
+    "marian": MarianBackend,
+}
+
+def register_backend(name, factory):
+    """Регистрация бэкенда перевода: factory() возвращает объект с методом translate(text, target)."""
+    BACKENDS[name] = factory
+
+
+class Translator:
+    """Перевод запросов с постоянным кэшем по (текст, целевой язык).
+
+    Бэкенд вызывается в фоновом потоке с ограничением по времени: если он не уложился
+    в timeout или упал, возвращается исходный текст. Запоздавший ответ всё равно
+    попадает в кэш и используется при следующем таком же запросе.
+    """
+
+    def __init__(self, cache_path, backend="google", target="en", timeout=2.0):
+        self.backend = BACKENDS[backend]() if isinstance(backend, str) else backend
+        self.target = target
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS translations (
+                    text TEXT,
+                    target TEXT,
+                    translated TEXT,
+                    created REAL,
+                    PRIMARY KEY (text, target)
+                )
+            """)
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        self._pending = {}
+
+    def _lookup(self, text, target):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT translated FROM translations WHERE text = ? AND target = ?", (text, target)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _store(self, text, target, translated):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)", (text, target, translated, time.time())
+            )
+
+    def _call_backend(self, text, target):
+        translated = self.backend.translate(text, target)
+        # Ответ, совпадающий с исходным текстом (в т.ч. от identity), не кэшируется,
+        # чтобы смена бэкенда не оставила в кэше непереведённые запросы
+        if translated and translated != text:
+            self._store(text, target, translated)
+        return translated
+
+    def translate(self, text, target=None):
+        """Перевод текста; при ошибке или превышении timeout возвращается исходный текст."""
+        target = target or self.target
+        text = text.strip()
+        if not text:
+            return text
+        cached = self._lookup(text, target)
+        if cached is not None:
+            return cached
+        key = (text, target)
+        with self._lock:
+            # Повторный запрос того же текста ждёт уже идущий вызов бэкенда
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._call_backend, text, target)
+                self._pending[key] = future
+                future.add_done_callback(lambda _, key=key: self._pending.pop(key, None))
+        try:
+            return future.result(timeout=self.timeout) or text
+        except FutureTimeout:
+            print(f"Перевод не получен за {self.timeout} с, используется исходный запрос")
+        except Exception as e:
+            print(f"Ошибка перевода: {e}")
+        return text
@@ -1,16 +1,12 @@
 import os
-import time
+import hashlib
+from functools import lru_cache
 from tqdm import tqdm
+from core import metrics
 
 def timing_decorator(func):
-    """Декоратор для замера времени выполнения функции."""
-    def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        print(f"Время выполнения {func.__name__}: {end_time - start_time:.4f} секунд")
-        return result
-    return wrapper
+    """Декоратор для замера времени выполнения функции: стадия с именем функции в реестре метрик."""
+    return metrics.timed(func.__name__)(func)
 
 def list_files_by_extension(start_path, extensions):
     """Список файлов с указанными расширениями в директории."""
@@ -22,7 +18,13 @@ def list_files_by_extension(start_path, extensions):
     return sorted(all_files)
 
 def list_files_with_progress(start_path, extensions):
-    """Список файлов с прогресс-баром."""
+    """Список файлов с прогресс-баром (стадия scan)."""
+    with metrics.stage("scan") as stage:
+        all_files = _list_files_with_progress(start_path, extensions)
+        stage.items = len(all_files)
+    return all_files
+
+def _list_files_with_progress(start_path, extensions):
     all_files = []
     file_count = sum(
         len([f for f in files if f.lower().endswith(tuple(extensions))])
@@ -34,4 +36,23 @@ def list_files_with_progress(start_path, extensions):
                 if file.lower().endswith(tuple(extensions)):
                     all_files.append(os.path.join(root, file))
                     pbar.update(1)
-    return sorted(all_files)
\ No newline at end of file
+    return sorted(all_files)
+
+def file_signature(path):
+    """Размер и время изменения файла."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+@lru_cache(maxsize=65536)
+def _file_hash(path, size, mtime, chunk_size):
+    # MD5 совпадает с ключами кэша прежнего формата; криптостойкость здесь не нужна
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_hash(path, chunk_size=1 << 20):
+    """Потоковый хэш содержимого файла; результат запоминается по (путь, размер, mtime)."""
+    size, mtime = file_signature(path)
+    return _file_hash(path, size, mtime, chunk_size)
@@ -0,0 +1,70 @@
+import os
+import numpy as np
+
+class VectorStore:
+    """Append-only хранилище векторов в сыром файле, читаемое через np.memmap.
+
+    Строка файла — один вектор фиксированной размерности, номер строки хранится
+    в колонке entries.emb_row. Файл только дописывается, поэтому несколько процессов
+    могут отображать его в память одновременно и делить страничный кэш ОС.
+    Основное хранилище — float32; квантованные копии (core.quantization) используют тот же формат
+    с dtype float16 или int8.
+    """
+
+    def __init__(self, path, dim=None, dtype=np.float32):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self._map = None
+        self._mapped_rows = 0
+        if dim is not None:
+            self._truncate_partial_row()
+
+    @property
+    def row_bytes(self):
+        return self.dim * self.dtype.itemsize
+
+    def _truncate_partial_row(self):
+        """Отрезание недописанного хвоста после аварийного завершения записи."""
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        if size % self.row_bytes:
+            with open(self.path, "r+b") as f:
+                f.truncate(size - size % self.row_bytes)
+
+    def __len__(self):
+        if self.dim is None or not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // self.row_bytes
+
+    def append(self, vectors):
+        """Дописывание векторов в конец файла; возвращает номер первой записанной строки."""
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Размерность {vectors.shape[1]} не совпадает с хранилищем ({self.dim})")
+        with open(self.path, "ab") as f:
+            start = f.tell() // self.row_bytes
+            f.write(vectors.tobytes())
+        return start
+
+    def matrix(self, rows=None):
+        """Представление первых rows строк файла без копирования (np.memmap только для чтения)."""
+        rows = len(self) if rows is None else rows
+        if self.dim is None or rows == 0:
+            return np.empty((0, self.dim or 0), dtype=self.dtype)
+        if self._map is None or self._mapped_rows < rows:
+            self._map = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(len(self), self.dim))
+            self._mapped_rows = self._map.shape[0]
+        return self._map[:rows]
+
+    def release(self):
+        """Закрытие отображения файла (перед заменой файла на диске)."""
+        self._map = None
+        self._mapped_rows = 0
+
+    def get(self, row):
+        """Копия одного вектора."""
+        return np.array(self.matrix(row + 1)[row])
@@ -1,43 +1,52 @@
 import os
+import time
+import queue
+import threading
 from PIL import Image
-import sqlite3
-import numpy as np
+from core import metrics
 from core.models import ModelManager
-from core.database import Database
+from core.database import Database, BatchWriter
 from core.cache import Cache
 from core.utils import list_files_with_progress
-from pdf2image import convert_from_path
-from deep_translator import GoogleTranslator
-from numba import njit
+from core.manifest import select_changed_files
+from core.journal import JournaledIndex
+from core.translation import Translator
 from concurrent.futures import ThreadPoolExecutor
-from sentence_transformers import SentenceTransformer
 
-@njit
-def fast_cosine_similarity(a, b):
-    """Быстрое вычисление косинусного сходства с Numba."""
-    dot_product = np.dot(a, b)
-    norm_a = np.linalg.norm(a)
-    norm_b = np.linalg.norm(b)
-    return dot_product / (norm_a * norm_b)
+# Оценка памяти на один кроп при генерации BLIP-base (384px, num_beams=5), МБ
+CROP_MEMORY_MB = 32
+CROPS_PER_IMAGE = 4
 
 class ImageProcessor:
     """Обработка изображений для семантического поиска с улучшенной точностью."""
     
-    def __init__(self, model_manager: ModelManager, db_path: str):
+    def __init__(self, model_manager: ModelManager, db_path: str, ann=None, quantization=None, flush_size=500, caption_memory_mb=1024,
+                 decode_workers=4, queue_size=64, translator=None):
         self.model = model_manager
-        self.db = Database(db_path)
+        self.db = Database(db_path, ann=ann, name="image", quantization=quantization)
+        self.writer = BatchWriter(self.db, flush_size)
         self.cache = Cache(db_path.replace(".db", "_cache"))
         self.default_extensions = [".png", ".jpg", ".jpeg", ".pdf"]
-        self.translator = GoogleTranslator(source='auto', target='en')
+        # Перевод запросов с постоянным кэшем; бэкенд и таймаут задаются в Config
+        self.translator = translator or Translator(f"{os.path.splitext(db_path)[0]}_translations.db")
+        # Размер батча подписей в кропах, кратен числу кропов одного изображения
+        crops = min(128, max(CROPS_PER_IMAGE, caption_memory_mb // CROP_MEMORY_MB))
+        self.caption_batch_size = crops // CROPS_PER_IMAGE * CROPS_PER_IMAGE
+        # Декодирование идёт в отдельных потоках; очередь ограничена, чтобы память не росла
+        self.decode_workers = max(1, decode_workers)
+        self.queue_size = max(1, queue_size)
+        self.pipeline_stats = {}
 
-    def resize_image(self, image, max_size=512):
+    @staticmethod
+    def resize_image(image, max_size=512):
         """Изменение размера изображения."""
         width, height = image.size
         if width > max_size or height > max_size:
             image.thumbnail((max_size, max_size))
         return image
     
-    def split_image(self, image):
+    @staticmethod
+    def split_image(image):
         """Разделение изображения на 4 части."""
         width, height = image.size
         return [
@@ -47,14 +56,28 @@ class ImageProcessor:
             image.crop((width // 2, height // 2, width, height))
         ]
     
+    def load_image(self, image_path, max_size=512):
+        """Чтение изображения; JPEG декодируется сразу в уменьшенном масштабе (draft)."""
+        image = Image.open(image_path)
+        if image.format == "JPEG":
+            image.draft("RGB", (max_size, max_size))
+        return self.resize_image(image.convert("RGB"), max_size)
+
+    def caption_kind(self):
+        """Вид записи кэша с подписью и эмбеддингом текущей текстовой модели."""
+        return self.cache.embedding_kind("caption", self.model.text_model_name)
+
+    def load_crops(self, image_path):
+        """Чтение изображения и разбиение на кропы для модели подписей."""
+        return self.split_image(self.load_image(image_path))
+
     def generate_description(self, image_path):
         """Генерация описания изображения."""
         cached_desc = self.cache.load(image_path)
         if cached_desc:
             return cached_desc
         
-        image = self.resize_image(Image.open(image_path).convert("RGB"))
-        areas = self.split_image(image)
+        areas = self.load_crops(image_path)
         captions = self.model.generate_image_captions(areas, max_length=100, num_beams=5)
         description = " ".join(captions)
         self.cache.save(image_path, description)
@@ -62,6 +85,7 @@ class ImageProcessor:
 
     def pdf_to_images(self, pdf_path, output_folder="temp_images"):
         """Конвертация PDF в изображения."""
+        from pdf2image import convert_from_path
         os.makedirs(output_folder, exist_ok=True)
         images = convert_from_path(pdf_path)
 
@@ -77,39 +101,183 @@ class ImageProcessor:
 
     def process_file(self, file_path):
         """Обработка одного файла (изображение или PDF)."""
-        if file_path.lower().endswith(".pdf"):
-            pdf_images = self.pdf_to_images(file_path)
-            for img_path in pdf_images:
-                description = self.generate_description(img_path)
-                # Используем roberta-base-nli-stsb-mean-tokens для точности
-                embedding = SentenceTransformer('roberta-base-nli-stsb-mean-tokens').encode([description])[0]
-                self.db.add_entry(img_path, description, embedding)
-        else:
-            description = self.generate_description(file_path)
-            embedding = SentenceTransformer('roberta-base-nli-stsb-mean-tokens').encode([description])[0]
-            self.db.add_entry(file_path, description, embedding)
+        self.process_files([file_path])
+
+    @metrics.scoped(modality="image")
+    def process_files(self, files):
+        """Обработка набора файлов: кропы разных изображений идут в модель общими батчами.
+
+        Потоки-декодеры читают изображения, проверяют кэш и готовят кропы заранее,
+        передавая результат через ограниченную очередь; в текущем потоке остаются
+        только вызовы моделей и запись в базу.
+        """
+        remaining = {}
+        stop = threading.Event()
+        paths = queue.Queue(maxsize=self.queue_size)
+        prepared = queue.Queue(maxsize=self.queue_size)
+        stats = {"decode": 0.0, "decode_wait": 0.0, "model": 0.0, "model_wait": 0.0}
+        stats_lock = threading.Lock()
+
+        def put(target, item):
+            """Блокирующая запись в очередь; возвращает время ожидания или None после остановки."""
+            started = time.perf_counter()
+            while not stop.is_set():
+                try:
+                    target.put(item, timeout=0.1)
+                    return time.perf_counter() - started
+                except queue.Full:
+                    continue
+            return None
+
+        def feed():
+            try:
+                for source in files:
+                    try:
+                        if source.lower().endswith(".pdf"):
+                            with metrics.stage("pdf_render", modality="image") as rendering:
+                                images = self.pdf_to_images(source)
+                                rendering.items = len(images)
+                        else:
+                            images = [source]
+                    except Exception as e:
+                        print(f"Ошибка конвертации {source}: {e}")
+                        self.writer.fail_file(source, e)
+                        continue
+                    remaining[source] = len(images)
+                    if not images and put(prepared, (source, None, None, None, None)) is None:
+                        return
+                    for image_path in images:
+                        if put(paths, (source, image_path)) is None:
+                            return
+            finally:
+                for _ in range(self.decode_workers):
+                    put(paths, None)
+
+        def decode():
+            while not stop.is_set():
+                try:
+                    item = paths.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    break
+                source, image_path = item
+                try:
+                    # Потоки-декодеры не наследуют метки вызывающего потока, модальность указывается явно
+                    with metrics.stage("decode", modality="image") as decoding:
+                        description, embedding = self.cache.get(image_path, kind=self.caption_kind())
+                        # Подпись не зависит от текстовой модели и переиспользуется при её смене
+                        description = description or self.cache.load(image_path)
+                        crops = None if description else self.load_crops(image_path)
+                except Exception as e:
+                    print(f"Ошибка чтения изображения {image_path}: {e}")
+                    self.writer.fail_file(source, e)
+                    continue
+                decoded = decoding.seconds
+                waited = put(prepared, (source, image_path, crops, description, embedding))
+                with stats_lock:
+                    stats["decode"] += decoded
+                    stats["decode_wait"] += waited or 0.0
+            put(prepared, None)
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        threads += [threading.Thread(target=decode, daemon=True) for _ in range(self.decode_workers)]
+        for thread in threads:
+            thread.start()
+
+        pending, pending_crops = [], 0
+        finished = 0
+        try:
+            while finished < self.decode_workers:
+                started = time.perf_counter()
+                item = prepared.get()
+                stats["model_wait"] += time.perf_counter() - started
+                if item is None:
+                    finished += 1
+                    continue
+                source, image_path, crops, description, embedding = item
+                if image_path is None:
+                    self.writer.add_file(source)
+                    continue
+                if description and embedding is not None:
+                    self._store(source, image_path, description, embedding, remaining)
+                    continue
+                pending.append((source, image_path, crops, description))
+                pending_crops += len(crops) if crops else 0
+                if pending_crops >= self.caption_batch_size:
+                    started = time.perf_counter()
+                    self._caption_batch(pending, remaining)
+                    stats["model"] += time.perf_counter() - started
+                    pending, pending_crops = [], 0
+            started = time.perf_counter()
+            self._caption_batch(pending, remaining)
+            stats["model"] += time.perf_counter() - started
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.pipeline_stats = stats
+        # Простои очередей: ждут декодеры — узкое место модель, ждёт модель — чтение с диска
+        metrics.observe("queue_wait_seconds", stats["decode_wait"], side="decode")
+        metrics.observe("queue_wait_seconds", stats["model_wait"], side="model")
+        print(f"Декодирование: {stats['decode']:.2f} с (ожидание очереди {stats['decode_wait']:.2f} с), "
+              f"модели: {stats['model']:.2f} с (ожидание данных {stats['model_wait']:.2f} с)")
+
+    def _caption_batch(self, pending, remaining):
+        """Один вызов модели подписей на батч кропов, затем пакетное кодирование описаний."""
+        if not pending:
+            return
+        crops = [crop for _, _, item_crops, _ in pending if item_crops for crop in item_crops]
+        captions = iter(self.model.generate_image_captions(crops, max_length=100, num_beams=5) if crops else [])
+        descriptions = []
+        for _, _, item_crops, description in pending:
+            if item_crops:
+                description = " ".join(next(captions) for _ in item_crops)
+            descriptions.append(description)
+        embeddings = self.model.encode_text(descriptions)
+        for (source, image_path, item_crops, _), description, embedding in zip(pending, descriptions, embeddings):
+            if item_crops:
+                self.cache.save(image_path, description)
+            self.cache.put(image_path, description, embedding, kind=self.caption_kind())
+            self._store(source, image_path, description, embedding, remaining)
+
+    def _store(self, source, image_path, description, embedding, remaining):
+        """Запись результата; файл попадает в манифест после обработки всех его изображений."""
+        self.writer.add(image_path, description, embedding, source=source)
+        remaining[source] -= 1
+        if remaining[source] == 0:
+            self.writer.add_file(source)
 
     def index_files(self, directory):
         """Индексация файлов в указанной директории."""
-        files = list_files_with_progress(directory, self.default_extensions)
-        for file_path in files:
-            self.process_file(file_path)
+        return JournaledIndex(self, directory).run()
+
+    def flush(self):
+        """Запись накопленных в буфере записей в базу."""
+        self.writer.flush()
 
     def list_files_with_progress(self, directory, extensions):
         """Список файлов с прогресс-баром."""
         return list_files_with_progress(directory, extensions)
 
+    @metrics.scoped(modality="image")
+    def plan_index(self, directory, extensions=None):
+        """Новые и изменённые файлы директории; записи удалённых файлов удаляются из базы."""
+        files = list_files_with_progress(directory, extensions or self.default_extensions)
+        return select_changed_files(self.db, directory, files)
+
+    def query_text(self, query):
+        """Запрос переводится на английский — язык подписей BLIP."""
+        return self.translator.translate(query, "en")
+
+    @metrics.scoped(modality="image")
     def search(self, query, top_k=5):
         """Поиск по текстовому запросу с переводом на английский."""
-        translated_query = self.translator.translate(query)
-        query_embedding = SentenceTransformer('roberta-base-nli-stsb-mean-tokens').encode([translated_query])[0]
-        
-        # Ручной поиск для использования fast_cosine_similarity
-        with sqlite3.connect(self.db.db_path) as conn:
-            cursor = conn.execute("SELECT path, description, embedding FROM entries")
-            results = []
-            for path, desc, emb_bytes in cursor.fetchall():
-                emb = np.frombuffer(emb_bytes, dtype=np.float32)
-                similarity = fast_cosine_similarity(query_embedding, emb)
-                results.append((path, desc, similarity, None))
-            return sorted(results, key=lambda x: x[2], reverse=True)[:top_k]
\ No newline at end of file
+        return self.search_embedding(self.model.encode_query(self.query_text(query)), top_k)
+
+    @metrics.scoped(modality="image")
+    def search_embedding(self, query_embedding, top_k=5):
+        """Поиск по готовому эмбеддингу запроса."""
+        self.writer.flush()
+        return [(path, desc, sim, None) for path, desc, sim, _ in self.db.search(query_embedding, top_k)]
\ No newline at end of file
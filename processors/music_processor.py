@@ -1,17 +1,54 @@
 import os
+import subprocess
+import numpy as np
 from mutagen.mp3 import MP3
+from core import metrics
 from core.models import ModelManager
-from core.database import Database
+from core.database import Database, BatchWriter
+from core.cache import Cache
 from core.utils import list_files_with_progress
-from sentence_transformers import InputExample
+from core.manifest import select_changed_files
+from core.journal import JournaledIndex
+
+# Частота дискретизации, ожидаемая Whisper
+SAMPLE_RATE = 16000
+# Длина кадра энергетического VAD, секунды
+VAD_FRAME = 0.03
+
+def load_audio_window(path, offset, duration, sr=SAMPLE_RATE):
+    """Декодирование только фрагмента [offset, offset + duration) в моно float32 через ffmpeg."""
+    cmd = [
+        "ffmpeg", "-nostdin", "-v", "error", "-ss", str(offset), "-t", str(duration), "-i", path,
+        "-f", "s16le", "-ac", "1", "-ar", str(sr), "-"
+    ]
+    out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+def speech_onset(audio, threshold_db=-40.0, sr=SAMPLE_RATE):
+    """Индекс первого отсчёта, где RMS кадра превышает порог (дБ относительно полной шкалы); None — тишина."""
+    frame = int(sr * VAD_FRAME)
+    frames = len(audio) // frame
+    if frames == 0:
+        return None
+    rms = np.sqrt(np.mean(audio[:frames * frame].reshape(frames, frame) ** 2, axis=1))
+    loud = np.flatnonzero(20 * np.log10(rms + 1e-10) > threshold_db)
+    return int(loud[0]) * frame if loud.size else None
 
 class MusicProcessor:
     """Обработка музыкальных файлов для семантического поиска."""
     
-    def __init__(self, model_manager: ModelManager, db_path: str):
+    def __init__(self, model_manager: ModelManager, db_path: str, ann=None, quantization=None, flush_size=500,
+                 windows=((0, 60),), max_silence=30, vad_threshold_db=-40.0):
         self.model = model_manager
-        self.db = Database(db_path)
+        self.db = Database(db_path, ann=ann, name="music", quantization=quantization)
+        self.writer = BatchWriter(self.db, flush_size)
+        self.cache = Cache(db_path.replace(".db", "_cache"))
         self.default_extensions = [".mp3"]
+        # Окна транскрипции (начало, длительность) в секундах; None — трек целиком
+        self.windows = windows
+        # Сколько секунд тишины в начале окна пропускается, прежде чем окно считается пустым
+        self.max_silence = max_silence
+        self.vad_threshold_db = vad_threshold_db
 
     def extract_metadata(self, mp3_path):
         """Извлечение метаданных из mp3."""
@@ -27,41 +64,153 @@ class MusicProcessor:
             print(f"Ошибка обработки метаданных {mp3_path}: {e}")
             return {"title": "Unknown Title", "artist": "Unknown Artist", "album": "Unknown Album", "genre": "Unknown Genre"}
     
-    def generate_description(self, mp3_path):
+    def load_windows(self, mp3_path):
+        """Декодированные окна трека без ведущей тишины (окна из одной тишины пропускаются).
+
+        Ошибка ffmpeg не считается тишиной и пробрасывается: иначе пустая транскрипция
+        попала бы в кэш, а файл — в манифест как обработанный.
+        """
+        windows = []
+        # Вызывается и из потоков планировщика, где метки process_files не действуют
+        with metrics.stage("decode", items=0, modality="music") as decoding:
+            for offset, duration in self.windows:
+                audio = load_audio_window(mp3_path, offset, duration + self.max_silence)
+                onset = speech_onset(audio[:self.max_silence * SAMPLE_RATE + 1], self.vad_threshold_db)
+                if onset is not None:
+                    windows.append(audio[onset:onset + duration * SAMPLE_RATE])
+            decoding.items = len(windows)
+        return windows
+
+    def transcribe(self, mp3_path, windows=None):
+        """Транскрипция заданных окон трека; windows — уже декодированные окна (load_windows)."""
+        if self.windows is None:
+            return self.model.transcribe_audio(mp3_path)
+        if windows is None:
+            windows = self.load_windows(mp3_path)
+        parts = []
+        for audio in windows:
+            text = self.model.transcribe_audio(audio).strip()
+            if text:
+                parts.append(text)
+        return " ".join(parts)
+
+    def prepare_files(self, files, executor=None):
+        """Декодирование окон треков без готовой транскрипции заранее, пока модель занята предыдущими.
+
+        ffmpeg сам работает в отдельных процессах, поэтому executor не используется.
+        """
+        if self.windows is None:
+            return None
+        prepared = {}
+        for path in files:
+            if self.cache.load(path, kind="transcript") is not None:
+                continue
+            try:
+                prepared[path] = self.load_windows(path)
+            except (OSError, subprocess.CalledProcessError) as e:
+                # Файл декодируется повторно в process_file, и ошибка засчитывается ему одному
+                print(f"Ошибка декодирования {path}: {e}")
+        return prepared
+
+    def build_description(self, metadata, lyrics):
+        """Текст описания трека из метаданных и начала текста песни."""
+        base_desc = f"{metadata['title']} by {metadata['artist']} from the album {metadata['album']} in the genre {metadata['genre']}"
+        return f"{base_desc}. Lyrics: {lyrics[:400]}..." if lyrics else base_desc
+
+    def generate_description(self, mp3_path, windows=None):
         """Генерация описания музыкального трека."""
         metadata = self.extract_metadata(mp3_path)
-        lyrics = self.model.transcribe_audio(mp3_path)
-        base_desc = f"{metadata['title']} by {metadata['artist']} from the album {metadata['album']} in the genre {metadata['genre']}"
-        full_desc = f"{base_desc}. Lyrics: {lyrics[:400]}..." if lyrics else base_desc
-        return full_desc, lyrics
+        lyrics = self.cache.load(mp3_path, kind="transcript")
+        if lyrics is None:
+            lyrics = self.transcribe(mp3_path, windows)
+            self.cache.save(mp3_path, lyrics, kind="transcript")
+        return self.build_description(metadata, lyrics), lyrics
 
-    def process_file(self, mp3_path):
+    def description_kind(self):
+        """Вид записи кэша с описанием и эмбеддингом текущей текстовой модели."""
+        return self.cache.embedding_kind("description", self.model.text_model_name)
+
+    def process_file(self, mp3_path, windows=None):
         """Обработка одного музыкального файла."""
-        description, lyrics = self.generate_description(mp3_path)
-        embedding = self.model.encode_text([description])[0]
-        self.db.add_entry(mp3_path, description, embedding, extra=lyrics)
+        # Побайтно одинаковые треки берут готовые описание и эмбеддинг из кэша
+        description, embedding = self.cache.get(mp3_path, kind=self.description_kind())
+        lyrics = self.cache.load(mp3_path, kind="transcript")
+        if description is None or embedding is None or lyrics is None:
+            description, lyrics = self.generate_description(mp3_path, windows)
+            embedding = self.model.encode_text([description])[0]
+            self.cache.put(mp3_path, description, embedding, kind=self.description_kind())
+        self.writer.add(mp3_path, description, embedding, extra=lyrics)
+        self.writer.add_file(mp3_path)
+
+    @metrics.scoped(modality="music")
+    def process_files(self, files, prepared=None):
+        """Обработка набора файлов; prepared — результат prepare_files."""
+        prepared = prepared or {}
+        for mp3_path in files:
+            self.process_file(mp3_path, prepared.pop(mp3_path, None))
 
     def index_files(self, directory):
         """Индексация музыкальных файлов в указанной директории."""
-        files = list_files_with_progress(directory, self.default_extensions)
-        for mp3_path in files:
-            self.process_file(mp3_path)
+        return JournaledIndex(self, directory).run()
+
+    def flush(self):
+        """Запись накопленных в буфере записей в базу."""
+        self.writer.flush()
 
     def list_files_with_progress(self, directory, extensions):
         """Список файлов с прогресс-баром."""
         return list_files_with_progress(directory, extensions)
 
+    @metrics.scoped(modality="music")
+    def plan_index(self, directory, extensions=None):
+        """Новые и изменённые файлы директории; записи удалённых файлов удаляются из базы."""
+        files = list_files_with_progress(directory, extensions or self.default_extensions)
+        return select_changed_files(self.db, directory, files)
+
+    def query_text(self, query):
+        """Текст запроса для кодирования моделью."""
+        return query
+
+    @metrics.scoped(modality="music")
     def search(self, query, top_k=5):
         """Поиск по текстовому запросу."""
-        query_embedding = self.model.encode_text([query])[0]
+        return self.search_embedding(self.model.encode_query(self.query_text(query)), top_k)
+
+    @metrics.scoped(modality="music")
+    def search_embedding(self, query_embedding, top_k=5):
+        """Поиск по готовому эмбеддингу запроса."""
+        self.writer.flush()
         return self.db.search(query_embedding, top_k)
     
+    def stored_lyrics(self):
+        """Тексты песен, уже сохранённые в базе (колонка extra): {путь: текст}."""
+        self.writer.flush()
+        return {path: extra for rows in self.db.iter_entries() for path, _, extra, _ in rows if extra is not None}
+
+    def reembed(self, batch_size=256):
+        """Пересчёт эмбеддингов (например, после дообучения) по сохранённым текстам, без Whisper."""
+        self.writer.flush()
+        for rows in self.db.iter_entries(batch_size):
+            rows = [(path, extra) for path, _, extra, _ in rows if os.path.exists(path)]
+            descriptions = [self.build_description(self.extract_metadata(path), lyrics or "") for path, lyrics in rows]
+            if not descriptions:
+                continue
+            embeddings = self.model.encode_text(descriptions)
+            for (path, lyrics), description, embedding in zip(rows, descriptions, embeddings):
+                self.cache.put(path, description, embedding, kind=self.description_kind())
+            # Файлы уже в манифесте, поэтому записи обновляются напрямую, минуя буфер индексации
+            self.db.add_entries([(path, description, embedding, lyrics)
+                                 for (path, lyrics), description, embedding in zip(rows, descriptions, embeddings)])
+
     def fine_tune(self, directory, output_path="fine_tuned_model"):
         """Дообучение модели на текстах песен."""
+        from sentence_transformers import InputExample
         files = list_files_with_progress(directory, self.default_extensions)
+        stored = self.stored_lyrics()
         train_examples = []
         for mp3_path in files:
-            _, lyrics = self.generate_description(mp3_path)
+            # Транскрибируются только ещё не проиндексированные треки
+            lyrics = stored[mp3_path] if mp3_path in stored else self.generate_description(mp3_path)[1]
             if lyrics and len(lyrics) > 50:
                 short_lyrics = lyrics[:200]
                 train_examples.append(InputExample(texts=[lyrics, short_lyrics], label=1.0))
@@ -1,80 +1,228 @@
 import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from core import metrics
 from core.models import ModelManager
-from core.database import Database
+from core.database import Database, BatchWriter
 from core.utils import list_files_with_progress
-from odf.opendocument import load
-from odf.text import P
+from core.manifest import select_changed_files
+from core.journal import JournaledIndex
+from core.extractors import iter_segments, iter_lines, extract_to_file, is_plain
 
 class TextProcessor:
     """Обработка текстовых данных для семантического поиска."""
     
-    def __init__(self, model_manager: ModelManager, db_path: str):
+    def __init__(self, model_manager: ModelManager, db_path: str, ann=None, quantization=None, flush_size=500, encode_batch_size=4096,
+                 extract_workers=0):
         self.model = model_manager
-        self.db = Database(db_path)
+        self.db = Database(db_path, ann=ann, name="text", quantization=quantization)
+        self.writer = BatchWriter(self.db, flush_size)
         self.default_extensions = [".odt", ".txt", ".docx", ".pdf", ".csv"]
+        # Сколько предложений (из одного или нескольких файлов) собирается перед кодированием
+        self.encode_batch_size = encode_batch_size
+        # Число процессов извлечения текста из PDF/DOCX/ODT (0 — в текущем процессе)
+        self.extract_workers = extract_workers
+        # Пул процессов извлечения создаётся при первой пачке и живёт до close(), а не до конца пачки
+        self._extract_pool = None
+        # Извлечённый текст непростых форматов: по файлу на документ, смещения записей указывают в него
+        self.sidecar_dir = f"{os.path.splitext(db_path)[0]}_text"
+        os.makedirs(self.sidecar_dir, exist_ok=True)
 
-    def extract_text_from_odt(self, file_path):
-        """Извлечение текста из .odt файла."""
-        try:
-            doc = load(file_path)
-            paragraphs = doc.getElementsByType(P)
-            text = []
-            for para in paragraphs:
-                text_nodes = para.childNodes
-                para_text = "".join([node.data for node in text_nodes if node.nodeType == node.TEXT_NODE])
-                if para_text.strip():
-                    text.append(para_text)
-            return "\n".join(text)
-        except Exception as e:
-            print(f"Ошибка при обработке файла {file_path}: {e}")
-            return ""
+    def sentence_key(self, sentence):
+        """Стабильный ключ эмбеддинга: хэш имени модели и нормализованного текста."""
+        normalized = " ".join(sentence.split())
+        return hashlib.sha1(f"{self.model.text_model_name}\0{normalized}".encode("utf-8")).hexdigest()
 
     def process_file(self, file_path):
         """Обработка одного текстового файла."""
-        if file_path.lower().endswith(".odt"):
-            text = self.extract_text_from_odt(file_path)
-        else:
+        self.process_files([file_path])
+
+    def sidecar_path(self, file_path):
+        """Файл с извлечённым текстом документа."""
+        key = hashlib.md5(os.path.abspath(file_path).encode("utf-8")).hexdigest()
+        return os.path.join(self.sidecar_dir, f"{key}.txt")
+
+    def text_source(self, file_path):
+        """Файл, в который указывают смещения записей документа."""
+        return file_path if is_plain(file_path) else self.sidecar_path(file_path)
+
+    def prepare_files(self, files, executor=None):
+        """Запуск извлечения текста непростых форматов заранее (в executor, если он задан).
+
+        Возвращает словарь future по файлам; его принимает process_files(files, prepared=...).
+        """
+        if executor is None:
+            return None
+        return {f: executor.submit(extract_to_file, f, self.sidecar_path(f)) for f in files if not is_plain(f)}
+
+    def iter_files(self, files, prepared=None):
+        """Пары (файл, итератор (фрагмент, начало, конец)).
+
+        Простые форматы читаются напрямую; остальные сначала извлекаются в отдельный файл,
+        при extract_workers > 0 — параллельно в других процессах. prepared — результат
+        prepare_files, если извлечение уже запущено.
+        """
+        extracted = [file_path for file_path in files if not is_plain(file_path)]
+        futures = prepared or {}
+        if not futures and self.extract_workers > 0 and len(extracted) > 1:
+            futures = self.prepare_files(extracted, self.extract_pool())
+        try:
+            for file_path in files:
+                try:
+                    if is_plain(file_path):
+                        source = file_path
+                    elif file_path in futures:
+                        # Извлечение идёт в другом процессе: здесь замеряется только ожидание результата
+                        with metrics.stage("extract_wait"):
+                            source = futures[file_path].result()
+                    else:
+                        with metrics.stage("extract"):
+                            source = extract_to_file(file_path, self.sidecar_path(file_path))
+                except Exception as e:
+                    print(f"Ошибка извлечения текста {file_path}: {e}")
+                    self.writer.fail_file(file_path, e)
+                    continue
+                yield file_path, iter_lines(source)
+        finally:
+            # Пачка прервана: извлечение ещё не начатых файлов не нужно
+            for future in futures.values():
+                future.cancel()
+
+    def extract_pool(self):
+        """Пул процессов извлечения текста, общий для всех пачек до close()."""
+        if self._extract_pool is None:
+            self._extract_pool = ProcessPoolExecutor(max_workers=self.extract_workers)
+        return self._extract_pool
+
+    def close(self):
+        """Остановка пула процессов извлечения (при следующей индексации он создаётся заново)."""
+        if self._extract_pool is not None:
+            self._extract_pool.shutdown(cancel_futures=True)
+            self._extract_pool = None
+
+    @metrics.scoped(modality="text")
+    def process_files(self, files, prepared=None):
+        """Потоковая обработка набора файлов пачками по encode_batch_size фрагментов.
+
+        Кодируются только предложения, которых ещё нет в базе; файл попадает в манифест
+        после записи всех его фрагментов.
+        """
+        batch, done = [], []
+        for file_path, segments in self.iter_files(files, prepared):
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
+                for position, (sentence, start, end) in enumerate(segments):
+                    batch.append((file_path, position, sentence, f"{start}:{end}"))
+                    if len(batch) >= self.encode_batch_size:
+                        self._write_sentences(batch, done)
+                        batch, done = [], []
             except Exception as e:
                 print(f"Ошибка чтения файла {file_path}: {e}")
-                return
-        
-        sentences = [s.strip() for s in text.split("\n") if s.strip()]
-        if sentences:
-            embeddings = self.model.encode_text(sentences)
-            for sentence, embedding in zip(sentences, embeddings):
-                unique_path = f"{file_path}#{hash(sentence)}"
-                self.db.add_entry(unique_path, sentence, embedding)
+                self.writer.fail_file(file_path, e)
+                continue
+            done.append(file_path)
+        self._write_sentences(batch, done)
+
+    def _write_sentences(self, batch, files):
+        """Пакетное кодирование новых предложений и запись всех вхождений со ссылкой на общий эмбеддинг."""
+        keys = [self.sentence_key(sentence) for _, _, sentence, _ in batch]
+        known = self.writer.known_keys(keys)
+        unseen = {}
+        for (_, _, sentence, _), key in zip(batch, keys):
+            if key not in known:
+                unseen.setdefault(key, sentence)
+        embeddings = dict(zip(unseen, self.model.encode_text(list(unseen.values())))) if unseen else {}
+        for (file_path, position, sentence, location), key in zip(batch, keys):
+            # Вектор передаётся только с первым вхождением ключа, остальные ссылаются на него;
+            # в extra хранятся байтовые смещения фрагмента "начало:конец"
+            self.writer.add(f"{file_path}#{position}", sentence, embeddings.pop(key, None),
+                            extra=location, source=file_path, key=key)
+        for file_path in files:
+            self.writer.add_file(file_path)
 
     def index_files(self, directory, extensions):
         """Индексация текстовых файлов в указанной директории."""
-        files = list_files_with_progress(directory, extensions)
-        for file_path in files:
-            self.process_file(file_path)
+        try:
+            return JournaledIndex(self, directory, extensions).run()
+        finally:
+            self.close()
+
+    def flush(self):
+        """Запись накопленных в буфере записей в базу."""
+        self.writer.flush()
 
     def list_files_with_progress(self, directory, extensions):
         """Список файлов с прогресс-баром."""
         return list_files_with_progress(directory, extensions)
 
+    @metrics.scoped(modality="text")
+    def plan_index(self, directory, extensions=None):
+        """Новые и изменённые файлы директории; записи удалённых файлов удаляются из базы."""
+        files = list_files_with_progress(directory, extensions or self.default_extensions)
+        changed = select_changed_files(self.db, directory, files)
+        self.remove_orphan_sidecars()
+        return changed
+
+    def remove_orphan_sidecars(self):
+        """Удаление извлечённого текста документов, которых больше нет в манифесте."""
+        expected = {os.path.basename(self.sidecar_path(path)) for path in self.db.get_manifest()}
+        for name in os.listdir(self.sidecar_dir):
+            if name not in expected:
+                os.remove(os.path.join(self.sidecar_dir, name))
+
+    def query_text(self, query):
+        """Текст запроса для кодирования моделью."""
+        return query
+
+    @metrics.scoped(modality="text")
     def search(self, query, top_k=5):
         """Поиск по текстовому запросу."""
-        query_embedding = self.model.encode_text([query])[0]
+        return self.search_embedding(self.model.encode_query(self.query_text(query)), top_k)
+
+    @metrics.scoped(modality="text")
+    def search_embedding(self, query_embedding, top_k=5):
+        """Поиск по готовому эмбеддингу запроса."""
+        self.writer.flush()
         results = self.db.search(query_embedding, top_k)
-        return [(path.split("#")[0], desc, sim, None) for path, desc, sim, _ in results]
+        return [(path.rsplit("#", 1)[0], desc, sim, location) for path, desc, sim, location in results]
     
-    def get_snippet(self, file_path, matched_text, snippet_length=200):
+    def read_snippet(self, file_path, matched_text, location, snippet_length=200):
+        """Фрагмент по сохранённым смещениям: чтение небольшого окна вокруг записи.
+
+        Возвращает None, если смещений нет или файл изменился после индексации.
+        """
+        try:
+            start, end = (int(value) for value in location.split(":"))
+            context = snippet_length // 2
+            with open(self.text_source(file_path), "rb") as f:
+                # Окно читается с запасом по байтам (UTF-8 — до 4 байт на символ) и обрезается по символам
+                f.seek(max(0, start - context * 4))
+                before = f.read(start - f.tell()).decode("utf-8", errors="ignore")
+                matched = f.read(end - start).decode("utf-8")
+                after = f.read(context * 4 + 1).decode("utf-8", errors="ignore")
+        except (AttributeError, ValueError, OSError):
+            return None
+        if matched != matched_text:
+            return None
+        truncated = start > len(before.encode("utf-8"))
+        before, after = before.replace("\r\n", "\n"), after.replace("\r\n", "\n")
+        snippet = before[-context:] + matched + after[:context]
+        if truncated or len(before) > context:
+            snippet = "..." + snippet
+        if len(after) > context:
+            snippet += "..."
+        return snippet
+
+    def get_snippet(self, file_path, matched_text, snippet_length=200, location=None):
         """Получение текстового фрагмента вокруг совпадения."""
-        full_text = ""
-        if file_path.lower().endswith(".odt"):
-            full_text = self.extract_text_from_odt(file_path)
-        else:
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    full_text = f.read()
-            except Exception as e:
-                full_text = matched_text
+        if location:
+            snippet = self.read_snippet(file_path, matched_text, location, snippet_length)
+            if snippet is not None:
+                return snippet
+        # Записи без смещений (старый формат) или изменённый файл: поиск по всему тексту
+        try:
+            full_text = "\n".join(iter_segments(file_path))
+        except Exception as e:
+            full_text = matched_text
         
         pos = full_text.lower().find(matched_text.lower())
         if pos == -1:
@@ -86,4 +234,4 @@ class TextProcessor:
             snippet = "..." + snippet
         if end < len(full_text):
             snippet += "..."
-        return snippet
\ No newline at end of file
+        return snippet
@@ -1,71 +1,398 @@
 import os
-import cv2
+import glob
+import json
+import shutil
+import hashlib
+import numpy as np
 from PIL import Image
+from core import metrics
 from core.models import ModelManager
-from core.database import Database
+from core.database import Database, BatchWriter
+from core.cache import Cache
 from core.utils import list_files_with_progress
+from core.manifest import select_changed_files
+from core.journal import JournaledIndex
+from processors.image_processor import ImageProcessor, CROP_MEMORY_MB, CROPS_PER_IMAGE
+
+# Интервалы выборки от этой длины (в секундах) проходятся перемоткой, а не grab() каждого кадра
+SEEK_MIN_INTERVAL = 5.0
+# Шаг проверки смены сцены и размер уменьшенного кадра для сравнения
+SCENE_CHECK_INTERVAL = 0.25
+SCENE_PREVIEW_SIZE = (32, 32)
+
+def dhash(image, hash_size=8):
+    """Разностный перцептивный хэш кадра (64 бита при hash_size=8)."""
+    gray = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+def hamming_distance(a, b):
+    """Число различающихся битов двух хэшей."""
+    return bin(a ^ b).count("1")
+
+def summarize(embeddings):
+    """Вектор-сводка видео: нормированный центроид эмбеддингов кадров и номер самого близкого к нему кадра."""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    centroid = vectors.mean(axis=0)
+    centroid /= max(float(np.linalg.norm(centroid)), 1e-12)
+    return centroid, int(np.argmax(vectors @ centroid))
+
+def frame_timestamp(path):
+    """Время кадра в мс из ключа записи <путь>#<мс>; None для записи-сводки видео."""
+    _, sep, timestamp = path.rpartition("#")
+    return int(timestamp) if sep and timestamp.isdigit() else None
+
+def format_timestamp(ms):
+    """Время в виде ч:мм:сс или м:сс."""
+    minutes, seconds = divmod(ms // 1000, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+class FrameCaptioner:
+    """Долгоживущий компонент подписей кадров: кропы нескольких кадров идут в модель общим батчем."""
+
+    def __init__(self, model_manager, caption_memory_mb=1024):
+        self.model = model_manager
+        crops = min(128, max(CROPS_PER_IMAGE, caption_memory_mb // CROP_MEMORY_MB))
+        self.batch_size = crops // CROPS_PER_IMAGE * CROPS_PER_IMAGE
+        self.calls = 0
+
+    def describe(self, frames):
+        """Описания и эмбеддинги для списка кадров PIL."""
+        crops = [crop for frame in frames for crop in ImageProcessor.split_image(ImageProcessor.resize_image(frame))]
+        captions = []
+        for start in range(0, len(crops), self.batch_size):
+            captions.extend(self.model.generate_image_captions(crops[start:start + self.batch_size],
+                                                                 max_length=100, num_beams=5))
+            self.calls += 1
+        descriptions = [" ".join(captions[i:i + CROPS_PER_IMAGE]) for i in range(0, len(captions), CROPS_PER_IMAGE)]
+        return descriptions, self.model.encode_text(descriptions)
 
 class VideoProcessor:
     """Обработка видео для семантического поиска."""
     
-    def __init__(self, model_manager: ModelManager, db_path: str):
+    def __init__(self, model_manager: ModelManager, db_path: str, ann=None, quantization=None, flush_size=500,
+                 thumbnail_dir=None, interval=1.0, scene_threshold=None, thumbnail_size=256,
+                 dedup_distance=6, caption_memory_mb=1024, shortlist=4, segment_margin=0.05):
         self.model = model_manager
-        self.db = Database(db_path)
+        self.db = Database(db_path, ann=ann, name="video", quantization=quantization)
+        self.writer = BatchWriter(self.db, flush_size)
+        self.cache = Cache(db_path.replace(".db", "_cache"))
         self.default_extensions = [".mp4"]
+        # Миниатюры кадров хранятся рядом с базой, а не в папке пользователя
+        self.thumbnail_dir = thumbnail_dir or f"{os.path.splitext(db_path)[0]}_thumbnails"
+        os.makedirs(self.thumbnail_dir, exist_ok=True)
+        self.interval = interval
+        # Порог смены сцены (средняя разница яркости 0..255); None — выборка с фиксированным интервалом
+        self.scene_threshold = scene_threshold
+        self.thumbnail_size = thumbnail_size
+        # Кадры с расстоянием dHash не больше порога считаются повторами и получают прежнее описание
+        self.dedup_distance = dedup_distance
+        self.captioner = FrameCaptioner(model_manager, caption_memory_mb)
+        # Поиск: первый проход по сводкам отбирает shortlist * top_k видео; кадры со сходством
+        # не ниже лучшего кадра видео минус segment_margin объединяются в фрагменты
+        self.shortlist = shortlist
+        self.segment_margin = segment_margin
+        # Видео без записей кадров: сводку для них не из чего построить
+        self._without_frames = set()
+        # Видео из записей базы старого формата, которых нет в манифесте (ищутся один раз за сеанс)
+        self._legacy_videos = None
+
+    def sample_frames(self, video_path):
+        """Выборка кадров без сохранения на диск: генератор пар (время в мс, кадр PIL RGB).
 
-    def extract_keyframes(self, video_path, interval=1):
-        """Извлечение ключевых кадров из видео."""
-        output_folder = os.path.join(os.path.dirname(video_path), "keyframes")
-        os.makedirs(output_folder, exist_ok=True)
-        
+        Пропускаемые кадры только захватываются grab() без декодирования, при длинном
+        интервале выполняется перемотка. В режиме смены сцены кадр берётся, когда он
+        заметно отличается от последнего выбранного.
+        """
+        import cv2  # OpenCV импортируется только при обработке видео
         cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = 0
-        keyframe_paths = []
-        
-        while cap.isOpened():
-            ret, frame = cap.read()
+        if not cap.isOpened():
+            # Иначе нечитаемый файл попал бы в манифест как обработанный без единого кадра
+            raise OSError(f"Не удалось открыть видео: {video_path}")
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+            total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            if self.scene_threshold is None:
+                step = max(1, round(fps * self.interval))
+                frames = self._sample_interval(cap, step, total)
+            else:
+                frames = self._sample_scenes(cap, max(1, round(fps * SCENE_CHECK_INTERVAL)))
+            for index, frame in frames:
+                yield int(index * 1000 / fps), Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        finally:
+            cap.release()
+
+    def _sample_interval(self, cap, step, total):
+        """Кадры с фиксированным шагом."""
+        import cv2
+        seek = self.interval >= SEEK_MIN_INTERVAL and total > 0
+        index = 0
+        while True:
+            if seek:
+                if index >= total:
+                    break
+                cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+                ret, frame = cap.read()
+            else:
+                ret, frame = cap.read() if index % step == 0 else (cap.grab(), None)
             if not ret:
                 break
-            if frame_count % int(fps * interval) == 0:
-                keyframe_path = os.path.join(output_folder, f"{os.path.basename(video_path)}_frame_{frame_count}.jpg")
-                cv2.imwrite(keyframe_path, frame)
-                keyframe_paths.append(keyframe_path)
-            frame_count += 1
-        cap.release()
-        return keyframe_paths
-    
-    def generate_description(self, image_path):
-        """Генерация описания для изображения (кадра)."""
-        from processors.image_processor import ImageProcessor  # Локальный импорт
-        temp_processor = ImageProcessor(self.model, self.db.db_path)
-        return temp_processor.generate_description(image_path)
+            if frame is not None:
+                yield index, frame
+            index += step if seek else 1
+
+    def _sample_scenes(self, cap, step):
+        """Кадры на смене сцены: сравнение уменьшенных полутоновых кадров."""
+        import cv2
+        previous = None
+        index = 0
+        while True:
+            ret, frame = cap.read() if index % step == 0 else (cap.grab(), None)
+            if not ret:
+                break
+            if frame is not None:
+                preview = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), SCENE_PREVIEW_SIZE,
+                                     interpolation=cv2.INTER_AREA).astype(np.float32)
+                if previous is None or np.abs(preview - previous).mean() > self.scene_threshold:
+                    previous = preview
+                    yield index, frame
+            index += 1
+
+    def thumbnail_prefix(self, video_path):
+        """Общий префикс имён миниатюр одного видео."""
+        key = hashlib.md5(os.path.abspath(video_path).encode("utf-8")).hexdigest()
+        return os.path.join(self.thumbnail_dir, key)
+
+    def save_thumbnail(self, video_path, timestamp, frame):
+        """Сохранение уменьшенной копии кадра для показа в результатах."""
+        thumbnail = frame.copy()
+        thumbnail.thumbnail((self.thumbnail_size, self.thumbnail_size))
+        thumbnail_path = f"{self.thumbnail_prefix(video_path)}_{timestamp}.jpg"
+        thumbnail.save(thumbnail_path, "JPEG", quality=85)
+        return thumbnail_path
+
+    def generate_description(self, frame):
+        """Генерация описания для кадра, переданного в памяти."""
+        return self.captioner.describe([frame])[0][0]
+
+    def frames_kind(self):
+        """Вид записи кэша с кадрами видео: зависит от параметров выборки и текстовой модели."""
+        return self.cache.embedding_kind(f"frames:{self.interval}:{self.scene_threshold}:{self.dedup_distance}",
+                                         self.model.text_model_name)
 
     def process_file(self, video_path):
-        """Обработка одного видео."""
-        keyframes = self.extract_keyframes(video_path)
-        for keyframe in keyframes:
-            description = self.generate_description(keyframe)
-            embedding = self.model.encode_text([description])[0]
-            self.db.add_entry(video_path, description, embedding, extra=keyframe)
+        """Обработка одного видео: запись на каждый выбранный кадр с ключом <путь>#<мс>
+        и запись-сводка с ключом <путь> (центроид кадров) для первого прохода поиска.
 
-    def index_files(self, directory):
-        """Индексация видео в указанной директории."""
-        files = list_files_with_progress(directory, self.default_extensions)
+        Побайтно одинаковое видео берёт кадры, описания и эмбеддинги из кэша без декодирования.
+        """
+        old_thumbnails = set(glob.glob(f"{glob.escape(self.thumbnail_prefix(video_path))}_*.jpg"))
+        cached, embeddings = self.cache.get(video_path, kind=self.frames_kind())
+        if cached is not None and embeddings is not None:
+            sampled, groups = self.load_cached_frames(video_path, json.loads(cached), embeddings)
+            captioned = 0
+        else:
+            sampled, groups = self.sample_and_caption(video_path)
+            captioned = len(groups)
+            self.cache.put(video_path, json.dumps({
+                "frames": [list(frame) for frame in sampled],
+                "groups": [[description, thumbnail] for description, _, thumbnail in groups]
+            }, ensure_ascii=False), np.array([embedding for _, embedding, _ in groups], dtype=np.float32).reshape(-1),
+                kind=self.frames_kind())
+        for old_thumbnail in old_thumbnails - {thumbnail for _, _, thumbnail in groups}:
+            os.remove(old_thumbnail)
+
+        for timestamp, group in sampled:
+            description, embedding, thumbnail = groups[group]
+            self.writer.add(f"{video_path}#{timestamp}", description, embedding, extra=thumbnail, source=video_path)
+        if sampled:
+            # Повторы кадров входят в центроид, поэтому длинные сцены весят больше коротких
+            centroid, central = summarize([groups[group][1] for _, group in sampled])
+            description, _, thumbnail = groups[sampled[central][1]]
+            self.writer.add(video_path, description, centroid, extra=thumbnail, source=video_path)
+        self.writer.add_file(video_path)
+        print(f"{os.path.basename(video_path)}: кадров {len(sampled)}, подписано {captioned}")
+
+    def sample_and_caption(self, video_path):
+        """Выборка и подпись кадров: ([(время, номер группы)], [(описание, эмбеддинг, миниатюра)]).
+
+        Кадр, почти совпадающий по dHash с последним подписанным, попадает в его группу и получает
+        его описание, эмбеддинг и миниатюру; подписываются только новые по содержанию кадры.
+        """
+        sampled = []        # (время, номер группы)
+        thumbnails = []     # миниатюра каждой группы
+        groups = []         # (описание, эмбеддинг) для каждой группы одинаковых кадров
+        pending = []        # кадры, ожидающие подписи
+        anchor = None
+        for timestamp, frame in metrics.timed_iter(self.sample_frames(video_path), "decode"):
+            frame_hash = dhash(frame)
+            if anchor is None or self.dedup_distance is None or hamming_distance(frame_hash, anchor) > self.dedup_distance:
+                anchor = frame_hash
+                pending.append(frame)
+                thumbnails.append(self.save_thumbnail(video_path, timestamp, frame))
+                if len(pending) * CROPS_PER_IMAGE >= self.captioner.batch_size:
+                    groups.extend(zip(*self.captioner.describe(pending)))
+                    pending = []
+            sampled.append((timestamp, len(thumbnails) - 1))
+        if pending:
+            groups.extend(zip(*self.captioner.describe(pending)))
+        return sampled, [(description, embedding, thumbnail)
+                         for (description, embedding), thumbnail in zip(groups, thumbnails)]
+
+    def load_cached_frames(self, video_path, cached, embeddings):
+        """Кадры из кэша; миниатюры копируются у ранее обработанной копии видео, если она ещё есть."""
+        vectors = embeddings.reshape(len(cached["groups"]), -1) if cached["groups"] else embeddings
+        groups = []
+        for (description, source), embedding in zip(cached["groups"], vectors):
+            thumbnail = None
+            if source is not None:
+                thumbnail = f"{self.thumbnail_prefix(video_path)}_{source.rsplit('_', 1)[1]}"
+                if source != thumbnail and os.path.exists(source):
+                    shutil.copyfile(source, thumbnail)
+                elif not os.path.exists(thumbnail):
+                    thumbnail = None
+            groups.append((description, embedding, thumbnail))
+        return [tuple(frame) for frame in cached["frames"]], groups
+
+    @metrics.scoped(modality="video")
+    def process_files(self, files):
+        """Обработка набора файлов."""
         for video_path in files:
             self.process_file(video_path)
 
+    def index_files(self, directory):
+        """Индексация видео в указанной директории."""
+        return JournaledIndex(self, directory).run()
+
+    def flush(self):
+        """Запись накопленных в буфере записей в базу."""
+        self.writer.flush()
+
     def list_files_with_progress(self, directory, extensions):
         """Список файлов с прогресс-баром."""
         return list_files_with_progress(directory, extensions)
 
+    @metrics.scoped(modality="video")
+    def plan_index(self, directory, extensions=None):
+        """Новые и изменённые файлы директории; записи удалённых файлов удаляются из базы."""
+        files = list_files_with_progress(directory, extensions or self.default_extensions)
+        changed = select_changed_files(self.db, directory, files)
+        self.remove_orphan_thumbnails()
+        return changed
+
+    def remove_orphan_thumbnails(self):
+        """Удаление миниатюр видео, которых больше нет в манифесте (удалённых или не обработанных до конца)."""
+        expected = {os.path.basename(self.thumbnail_prefix(path)) for path in self.db.get_manifest()}
+        for name in os.listdir(self.thumbnail_dir):
+            if name.rsplit("_", 1)[0] not in expected:
+                os.remove(os.path.join(self.thumbnail_dir, name))
+
+    def query_text(self, query):
+        """Текст запроса для кодирования моделью."""
+        return query
+
+    @metrics.scoped(modality="video")
     def search(self, query, top_k=5):
         """Поиск по текстовому запросу."""
-        query_embedding = self.model.encode_text([query])[0]
-        results = self.db.search(query_embedding, top_k * 2)
-        
-        video_results = {}
-        for path, desc, sim, keyframe in results:
-            if path not in video_results or video_results[path][2] < sim:
-                video_results[path] = (path, desc, sim, keyframe)
-        return list(video_results.values())[:top_k]
\ No newline at end of file
+        return self.search_embedding(self.model.encode_query(self.query_text(query)), top_k)
+
+    @metrics.scoped(modality="video")
+    def search_embedding(self, query_embedding, top_k=5):
+        """Поиск по готовому эмбеддингу запроса: по одному результату на видео.
+
+        Описание начинается с интервала лучшего фрагмента, миниатюра — его лучший кадр.
+        """
+        results = []
+        for video_path, score, segments in self.search_segments(query_embedding, top_k):
+            start, end, _, description, thumbnail = segments[0]
+            if start is not None:
+                description = f"[{format_timestamp(start)}–{format_timestamp(end)}] {description}"
+            results.append((video_path, description, score, thumbnail))
+        return results
+
+    def search_segments(self, query_embedding, top_k=5):
+        """Двухпроходный поиск видео с разбиением совпадений на фрагменты.
+
+        Первый проход сравнивает запрос только со сводками видео (стоимость — по числу видео)
+        и оставляет shortlist * top_k лучших; во втором оцениваются кадры только этих видео.
+        Соседние совпавшие кадры объединяются во фрагменты. Видео упорядочены по лучшему кадру.
+        Возвращает [(видео, оценка, [(начало мс, конец мс, оценка, описание, миниатюра), ...])],
+        фрагменты каждого видео — по убыванию оценки. Видео без записей кадров (например, старая
+        запись с ключом-путём) возвращается одним фрагментом из собственной записи без времени (None).
+        """
+        self.writer.flush()
+        videos = self.candidate_videos()
+        summaries = {path: (score, desc, extra) for path, desc, score, extra, _ in
+                     self.db.score_entries(query_embedding, paths=videos)}
+        missing = [path for path in videos if path not in summaries and path not in self._without_frames]
+        if missing:
+            summaries.update((path, (score, desc, extra)) for path, desc, score, extra, _ in
+                             self.db.score_entries(query_embedding, paths=self.build_summaries(missing)))
+        shortlist = sorted(summaries, key=lambda path: summaries[path][0], reverse=True)[:max(1, top_k * self.shortlist)]
+
+        frames = {}
+        for path, desc, score, thumbnail, source in self.db.score_entries(query_embedding, sources=shortlist):
+            timestamp = frame_timestamp(path)
+            if timestamp is not None:
+                frames.setdefault(source, []).append((timestamp, score, desc, thumbnail))
+        results = []
+        for video_path in shortlist:
+            if video_path in frames:
+                segments = self.merge_segments(sorted(frames[video_path]))
+            else:
+                score, desc, thumbnail = summaries[video_path]
+                segments = [(None, None, score, desc, thumbnail)]
+            results.append((video_path, segments[0][2], segments))
+        results.sort(key=lambda result: result[1], reverse=True)
+        return results[:top_k]
+
+    def candidate_videos(self):
+        """Видео для первого прохода: манифест (стоимость — по числу видео) и видео старого формата.
+
+        Базы старого формата манифеста не имеют, поэтому их видео один раз за сеанс находятся
+        полным просмотром записей; после переиндексации они попадают в манифест.
+        """
+        manifest = self.db.get_manifest()
+        if self._legacy_videos is None:
+            self._legacy_videos = [source for source in self.db.get_sources() if source not in manifest]
+        return list(manifest) + [path for path in self._legacy_videos if path not in manifest]
+
+    def merge_segments(self, frames):
+        """Фрагменты из упорядоченных по времени кадров (время, оценка, описание, миниатюра).
+
+        Кадр совпадает, если его оценка не ниже лучшей по видео минус segment_margin; подряд идущие
+        совпавшие кадры образуют фрагмент от первого до последнего из них.
+        """
+        threshold = max(score for _, score, _, _ in frames) - self.segment_margin
+        segments, current = [], None
+        for timestamp, score, desc, thumbnail in frames:
+            if score < threshold:
+                current = None
+                continue
+            if current is None:
+                current = [timestamp, timestamp, score, desc, thumbnail]
+                segments.append(current)
+            current[1] = timestamp
+            if score > current[2]:
+                current[2:] = [score, desc, thumbnail]
+        return sorted((tuple(segment) for segment in segments), key=lambda segment: segment[2], reverse=True)
+
+    def build_summaries(self, videos):
+        """Сводки для видео, проиндексированных до их появления: центроид уже записанных кадров.
+
+        Возвращает видео, для которых сводка записана.
+        """
+        entries = []
+        for video_path in videos:
+            rows, vectors = self.db.source_vectors(video_path)
+            frames = [(row, vector) for row, vector in zip(rows, vectors) if frame_timestamp(row[0]) is not None]
+            if not frames:
+                self._without_frames.add(video_path)
+                continue
+            centroid, central = summarize([vector for _, vector in frames])
+            _, description, thumbnail = frames[central][0]
+            entries.append((video_path, description, centroid, thumbnail, video_path))
+        self.db.add_entries(entries)
+        return [entry[0] for entry in entries]